@@ -3,10 +3,23 @@ Configuración de la aplicación usando Pydantic Settings.
 """
 
 import os
-from typing import Literal
+import secrets
+from pathlib import Path
+from typing import Dict, Literal
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+class WhisperModelConfig(BaseModel):
+    """Entrada del registro de modelos Whisper."""
+    size: str = "medium"            # tamaño/nombre de faster-whisper (si no hay ruta local)
+    path: str = ""                  # modelo CTranslate2 local; vacío = CORONERIA_MODELS/whisper/<size>
+    device: str = "auto"            # auto | cpu | cuda
+    compute_type: str = "auto"      # auto = float16 en GPU, int8 en CPU
+    cpu_threads: int = 0            # 0 = valor por defecto de CTranslate2
+    num_workers: int = 1            # pasadas en paralelo (réplicas que comparten los pesos)
+
+
 class Settings(BaseSettings):
     """Configuración global de ForensIA."""
     
@@ -21,6 +34,20 @@ class Settings(BaseSettings):
 
     # Google Gemini (Alternative)
     GEMINI_API_KEY: str | None = None
+    # Cuota de Gemini (limitador compartido por el proceso) y concurrencia por modelo
+    GEMINI_REQUESTS_PER_MINUTE: int = 30
+    GEMINI_BURST: int = 5
+    GEMINI_MAX_CONCURRENCY: int = 4
+    GEMINI_MAX_RETRIES: int = 3
+    # Audio: inline hasta este tamaño; subidas reutilizables por hash durante el TTL
+    GEMINI_INLINE_AUDIO_MAX_BYTES: int = 8 * 1024 * 1024
+    GEMINI_FILE_TTL_SECONDS: int = 900
+    GEMINI_FILE_CACHE_ENTRIES: int = 32
+    
+    # Caché persistente de respuestas de LLM (data/llm_cache.db)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    LLM_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
     
     # Azure Document Intelligence
     AZURE_DOC_INTEL_KEY: str = ""
@@ -39,15 +66,72 @@ class Settings(BaseSettings):
     CORONERIA_MODELS: str = "./models"
     CORONERIA_EXPORTS: str = "./exports"
 
+    # SQLite (pool de conexiones)
+    DB_READ_POOL_SIZE: int = 4
+    DB_STATEMENT_CACHE_SIZE: int = 256
+    DB_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_CACHE_SIZE_KB: int = 32 * 1024
+    DB_BUSY_TIMEOUT_MS: int = 5000
+    CASE_CACHE_ENTRIES: int = 256
+
+    # Audio (compuerta de silencio y subida de grabaciones)
+    AUDIO_SILENCE_THRESHOLD_DB: float = -40.0
+    AUDIO_MAX_SILENCE_SECONDS: float = 0.5
+    AUDIO_MAX_UPLOAD_BYTES: int = 1024 * 1024 * 1024
+    AUDIO_UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+    
+    # Modelos Whisper (registro; WHISPER_MODELS se puede dar como JSON en el entorno)
+    WHISPER_MODELS: Dict[str, WhisperModelConfig] = {
+        "medium": WhisperModelConfig(size="medium"),
+        "large-v3": WhisperModelConfig(size="large-v3"),
+    }
+    WHISPER_DEFAULT_MODEL: str = "medium"
+    WHISPER_PRELOAD: bool = True
+    
+    # Dictado en vivo con Whisper (WebSocket)
+    WHISPER_STREAM_END_SILENCE_MS: int = 600
+    WHISPER_STREAM_PARTIAL_MS: int = 1000
+    WHISPER_STREAM_MAX_UTTERANCE_SECONDS: float = 30.0
+    
+    # Servidor local de inferencia compartido entre workers de uvicorn
+    # (python -m services.inference_server); vacío = modelos en cada proceso
+    INFERENCE_SOCKET: str = ""
+    INFERENCE_TIMEOUT_SECONDS: float = 300.0
+
     # Feature Flags (Arquitectura Híbrida)
     ENABLE_CLOUD_BACKUP: bool = False
     ENABLE_MEDICAL_DICTIONARY: bool = True
 
     
     # Security
-    SECRET_KEY: str = "change-this-in-production"
+    # Vacío o un valor de ejemplo = clave aleatoria persistida en CORONERIA_DATA/.secret_key
+    SECRET_KEY: str = ""
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 480
+    # Antigüedad máxima de la copia local de revoked_tokens (logout en otro worker)
+    REVOCATION_REFRESH_SECONDS: float = 1.0
+    
+    # Hash de contraseñas (bcrypt fuera del event loop)
+    BCRYPT_WORKERS: int = 4
+    BCRYPT_MAX_PENDING: int = 64
+    LOGIN_MAX_ATTEMPTS: int = 5
+    LOGIN_WINDOW_SECONDS: int = 300
+    LOGIN_THROTTLE_MAX_USERS: int = 10_000  # nombres con fallos recientes en memoria
+    
+    # Auditoría (escritura diferida por lotes)
+    AUDIT_BATCH_SIZE: int = 256
+    AUDIT_BACKLOG_WARN: int = 10_000
+    
+    # Render de PDF (pool de procesos)
+    RENDER_WORKERS: int = 2
+    RENDER_MAX_PENDING: int = 32
+    RENDER_JOB_TTL_SECONDS: int = 3600
+    PDF_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    
+    # Exportación masiva FHIR (NDJSON)
+    FHIR_EXPORT_MAX_JOBS: int = 2
+    FHIR_EXPORT_FILE_RESOURCES: int = 100_000
+    FHIR_EXPORT_JOB_TTL_SECONDS: int = 3600
     
     class Config:
         env_file = ".env"
@@ -79,3 +163,46 @@ try:
     print(f"[INFO] Directorios verificados: {settings.CORONERIA_DATA}")
 except Exception as e:
     print(f"[WARNING] Warning creando directorios: {e}")
+
+
+# Valores de ejemplo (código, docker-compose, .env.example) que nunca deben firmar tokens
+PLACEHOLDER_SECRET_KEYS = {
+    "",
+    "change-this-in-production",
+    "change-me-in-production",
+    "change-this-to-a-random-string",
+    "cambia-esto-por-una-clave-segura-aleatoria",
+}
+
+
+def _resolve_secret_key(configured: str) -> str:
+    """
+    Clave de firma de tokens. Sin una clave propia se genera una aleatoria
+    la primera vez y se guarda en CORONERIA_DATA/.secret_key (0600), así
+    todos los workers y los reinicios firman con la misma.
+    """
+    if configured not in PLACEHOLDER_SECRET_KEYS:
+        return configured
+
+    path = Path(settings.CORONERIA_DATA) / ".secret_key"
+    if not path.exists():
+        # Escritura atómica: si dos workers arrancan a la vez, gana el primer link
+        tmp = path.with_name(f".secret_key.{os.getpid()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_urlsafe(64))
+        try:
+            os.link(tmp, path)
+            print(f"[INFO] SECRET_KEY no configurada: clave aleatoria generada en {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+
+    key = path.read_text().strip()
+    if not key:
+        raise RuntimeError(f"{path} está vacío: borrarlo o definir SECRET_KEY")
+    return key
+
+
+settings.SECRET_KEY = _resolve_secret_key(settings.SECRET_KEY)
@@ -2,28 +2,318 @@
 Configuración de base de datos SQLite con aiosqlite.
 """
 
+import asyncio
 import aiosqlite
+import hashlib
+import logging
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 from core.config import settings
 
+logger = logging.getLogger(__name__)
 
 DATABASE_PATH = Path(settings.CORONERIA_DATA) / "forensia.db"
 
+# Columnas JSON del protocolo (secciones v2.0 + legacy v1)
+SECTION_COLUMNS = [
+    'datos_generales', 'fenomenos_cadavericos', 'examen_externo_cabeza',
+    'examen_interno_cabeza', 'examen_interno_cuello', 'examen_interno_torax',
+    'examen_interno_abdomen', 'aparato_genital', 'lesiones_traumaticas',
+    'perennizacion', 'datos_referenciales', 'causas_muerte', 'organos_adicionales',
+    'datos_administrativos', 'examen_externo', 'examen_interno', 'conclusiones',
+]
 
-async def get_db():
-    """Obtiene conexión a la base de datos."""
-    db = await aiosqlite.connect(DATABASE_PATH)
+
+# Columnas que forman la representación de un caso (GET /api/cases/{id});
+# su hash se guarda en hash_caso y se usa como ETag fuerte.
+CASE_HASH_COLUMNS = (
+    ['id', 'protocol_number', 'status', 'created_at', 'updated_at', 'version']
+    + SECTION_COLUMNS
+    + ['audio_path', 'transcript_raw']
+)
+CASE_HASH_SQL = f"case_hash({', '.join(CASE_HASH_COLUMNS)})"
+
+
+def _case_hash(*values) -> str:
+    """SHA-256 del estado de un caso (función SQL case_hash)."""
+    h = hashlib.sha256()
+    for value in values:
+        h.update(b"\x00" if value is None else str(value).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+async def refresh_case_hash(db: aiosqlite.Connection, case_id: str) -> Optional[str]:
+    """
+    Recalcula hash_caso tras una escritura (misma transacción).
+    Retorna el nuevo hash, o None si el caso no existe.
+    """
+    cursor = await db.execute(
+        f"UPDATE cases SET hash_caso = {CASE_HASH_SQL} WHERE id = ? RETURNING hash_caso",
+        (case_id,)
+    )
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def _connect(path: Path, readonly: bool = False) -> aiosqlite.Connection:
+    """Abre una conexión con los PRAGMAs de rendimiento aplicados."""
+    db = await aiosqlite.connect(
+        path,
+        # Caché de sentencias preparadas de sqlite3 (se reutilizan mientras
+        # la conexión viva, de ahí el interés de conexiones de larga vida).
+        cached_statements=settings.DB_STATEMENT_CACHE_SIZE
+    )
     db.row_factory = aiosqlite.Row
-    try:
+    await db.create_function("case_hash", -1, _case_hash, deterministic=True)
+    
+    await db.execute("PRAGMA journal_mode = WAL")
+    await db.execute("PRAGMA synchronous = NORMAL")
+    await db.execute("PRAGMA temp_store = MEMORY")
+    await db.execute(f"PRAGMA busy_timeout = {int(settings.DB_BUSY_TIMEOUT_MS)}")
+    await db.execute(f"PRAGMA mmap_size = {int(settings.DB_MMAP_SIZE)}")
+    # cache_size negativo = tamaño en KiB
+    await db.execute(f"PRAGMA cache_size = -{int(settings.DB_CACHE_SIZE_KB)}")
+    if readonly:
+        await db.execute("PRAGMA query_only = ON")
+    
+    return db
+
+
+class DatabasePool:
+    """
+    Pool de conexiones SQLite de larga vida.
+    
+    SQLite admite un solo escritor a la vez, así que el pool mantiene
+    una conexión de escritura (serializada con un lock) y N conexiones
+    de lectura que, gracias a WAL, leen en paralelo sin bloquear al escritor.
+    """
+    
+    def __init__(self, path: Path, readers: int = 4):
+        self.path = path
+        self.size = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: list = []
+    
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+    
+    async def open(self):
+        """Abre la conexión de escritura y las de lectura."""
+        if self.is_open:
+            return
+        
+        self._writer = await _connect(self.path)
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await _connect(self.path, readonly=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        
+        logger.info(f"Pool SQLite abierto: 1 escritor + {self.size} lectores ({self.path})")
+    
+    async def close(self):
+        """Cierra todas las conexiones del pool."""
+        if not self.is_open:
+            return
+        
+        async with self._writer_lock:
+            await self._writer.close()
+            self._writer = None
+        
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        
+        logger.info("Pool SQLite cerrado")
+    
+    @asynccontextmanager
+    async def writer(self):
+        """Conexión de escritura con acceso exclusivo durante el bloque."""
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            finally:
+                # No dejar transacciones abiertas para el siguiente usuario
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+    
+    @asynccontextmanager
+    async def reader(self):
+        """Conexión de solo lectura tomada del pool."""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._readers.put_nowait(conn)
+
+
+# Singleton (se abre en el lifespan de la aplicación)
+db_pool = DatabasePool(DATABASE_PATH, readers=settings.DB_READ_POOL_SIZE)
+
+
+@asynccontextmanager
+async def write_connection():
+    """Conexión de escritura del pool durante el bloque (propia si el pool no está abierto)."""
+    if not db_pool.is_open:
+        # Fuera de la aplicación (scripts): conexión propia
+        db = await _connect(DATABASE_PATH)
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+    
+    async with db_pool.writer() as db:
+        yield db
+
+
+@asynccontextmanager
+async def read_connection():
+    """Conexión de solo lectura del pool durante el bloque (propia si el pool no está abierto)."""
+    if not db_pool.is_open:
+        db = await _connect(DATABASE_PATH, readonly=True)
+        try:
+            yield db
+        finally:
+            await db.close()
+        return
+    
+    async with db_pool.reader() as db:
         yield db
-    finally:
-        await db.close()
+
+
+async def get_db():
+    """
+    Conexión de escritura del pool mientras dure el consumidor (scripts).
+    Los endpoints usan write_connection() solo alrededor de sus sentencias:
+    como dependencia retendría el escritor durante todo el handler.
+    """
+    async with write_connection() as db:
+        yield db
+
+
+async def get_read_db():
+    """Obtiene una conexión de solo lectura del pool."""
+    async with read_connection() as db:
+        yield db
+
+
+def _fts_text_sql(alias: str) -> str:
+    """Expresión SQL que concatena las hojas de texto de todas las secciones."""
+    parts = " UNION ALL ".join(
+        f"SELECT atom FROM json_tree({alias}.{col}) WHERE type = 'text'"
+        for col in SECTION_COLUMNS
+    )
+    return f"(SELECT group_concat(atom, ' ') FROM ({parts}))"
+
+
+async def _init_fts(db: aiosqlite.Connection):
+    """
+    Tabla FTS5 sobre transcripción y texto del protocolo, sincronizada
+    con triggers. unicode61 + remove_diacritics pliega tildes
+    ("higado" encuentra "hígado"). Los casos eliminados no se indexan.
+    
+    Cada caso tiene un rowid FTS fijo en cases_fts_ids (INTEGER PRIMARY KEY:
+    VACUUM no lo renumera, a diferencia del rowid implícito de cases) y los
+    triggers borran por ese rowid, sin pasar por MATCH.
+    """
+    cursor = await db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cases_fts_ids'"
+    )
+    if await cursor.fetchone() is None:
+        # Versión anterior (borrado por MATCH sobre case_id): reconstruir
+        for trigger in ("cases_fts_insert", "cases_fts_update", "cases_fts_delete"):
+            await db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        await db.execute("DROP TABLE IF EXISTS cases_fts")
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS cases_fts_ids (
+            id INTEGER PRIMARY KEY,
+            case_id TEXT UNIQUE NOT NULL
+        )
+    """)
+    
+    cursor = await db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cases_fts'"
+    )
+    exists = await cursor.fetchone() is not None
+    
+    await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS cases_fts USING fts5(
+            case_id UNINDEXED,
+            protocol_number,
+            transcript,
+            hallazgos,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    
+    fts_rowid = "(SELECT id FROM cases_fts_ids WHERE case_id = {0}.id)"
+    insert_new = f"""
+        INSERT OR IGNORE INTO cases_fts_ids (case_id) VALUES (NEW.id);
+        INSERT INTO cases_fts (rowid, case_id, protocol_number, transcript, hallazgos)
+        SELECT {fts_rowid.format('NEW')}, NEW.id, NEW.protocol_number, NEW.transcript_raw, {_fts_text_sql('NEW')}
+        WHERE NEW.status IS NULL OR NEW.status != 'deleted';
+    """
+    delete_old = f"""
+        DELETE FROM cases_fts WHERE rowid = {fts_rowid.format('OLD')};
+    """
+    
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cases_fts_insert AFTER INSERT ON cases
+        BEGIN
+            {insert_new}
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cases_fts_update
+        AFTER UPDATE OF protocol_number, status, transcript_raw, {', '.join(SECTION_COLUMNS)} ON cases
+        BEGIN
+            {delete_old}
+            {insert_new}
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS cases_fts_delete AFTER DELETE ON cases
+        BEGIN
+            {delete_old}
+            DELETE FROM cases_fts_ids WHERE case_id = OLD.id;
+        END
+    """)
+    
+    if not exists:
+        await db.execute("INSERT OR IGNORE INTO cases_fts_ids (case_id) SELECT id FROM cases")
+        await db.execute(f"""
+            INSERT INTO cases_fts (rowid, case_id, protocol_number, transcript, hallazgos)
+            SELECT ids.id, c.id, c.protocol_number, c.transcript_raw, {_fts_text_sql('c')}
+            FROM cases c JOIN cases_fts_ids ids ON ids.case_id = c.id
+            WHERE c.status IS NULL OR c.status != 'deleted'
+        """)
+
+
+async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, declaration: str):
+    """Agrega una columna a una tabla existente si aún no la tiene (migración)."""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in await cursor.fetchall()]:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
 
 
 async def init_db():
     """Inicializa las tablas de la base de datos."""
     async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.create_function("case_hash", -1, _case_hash, deterministic=True)
+        # WAL es persistente en el archivo: lo activamos desde el inicio
+        await db.execute("PRAGMA journal_mode = WAL")
+        
         # Tabla de usuarios
         await db.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -46,6 +336,7 @@ async def init_db():
                 updated_at TIMESTAMP,
                 status TEXT DEFAULT 'borrador',
                 user_id TEXT,
+                version INTEGER NOT NULL DEFAULT 1,
                 
                 -- Secciones del protocolo (JSON)
                 datos_generales TEXT,
@@ -83,7 +374,11 @@ async def init_db():
             )
         """)
         
-        # Tabla de auditoría
+        # Migraciones de columnas para bases creadas con versiones anteriores
+        await _ensure_column(db, "cases", "version", "INTEGER NOT NULL DEFAULT 1")
+        
+        # Tabla de auditoría (chain_hash encadena cada fila con la anterior,
+        # ver AuditService)
         await db.execute("""
             CREATE TABLE IF NOT EXISTS audit_log (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -95,32 +390,90 @@ async def init_db():
                 details TEXT,
                 hash_before TEXT,
                 hash_after TEXT,
-                device_id TEXT
+                device_id TEXT,
+                chain_hash TEXT
             )
         """)
+        await _ensure_column(db, "audit_log", "chain_hash", "TEXT")
         
-        # Tabla de sesiones
+        # Tokens revocados (las sesiones son tokens firmados, ver core.security).
+        # La antigua tabla sessions ya no se usa (sus tokens opacos no son
+        # válidos) pero no se borra: queda como registro histórico de accesos.
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                token TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id)
-            )
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                jti TEXT PRIMARY KEY,
+                expires_at INTEGER NOT NULL
+            ) WITHOUT ROWID
         """)
         
+        # Índice de campos: ruta con puntos -> valor tipado (ver FieldIndexService)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS case_fields (
+                case_id TEXT NOT NULL,
+                section TEXT NOT NULL,
+                path TEXT NOT NULL,
+                value_text TEXT,
+                value_num REAL,
+                PRIMARY KEY (case_id, path)
+            ) WITHOUT ROWID
+        """)
+        
+        # Búsqueda de texto completo
+        await _init_fts(db)
+        
         # Índices
+        # Listado paginado por (created_at, id): índices cubrientes para que
+        # cada página sea un recorrido solo de índice (ver list_cases).
+        # Reemplazan a idx_cases_status / idx_cases_user (prefijos de estos).
+        await db.execute("DROP INDEX IF EXISTS idx_cases_status")
+        await db.execute("DROP INDEX IF EXISTS idx_cases_user")
         await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_cases_status ON cases(status)
+            CREATE INDEX IF NOT EXISTS idx_cases_created
+            ON cases(created_at, id, status, protocol_number, updated_at, user_id)
         """)
         await db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_cases_user ON cases(user_id)
+            CREATE INDEX IF NOT EXISTS idx_cases_status_created
+            ON cases(status, created_at, id, protocol_number, updated_at, user_id)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cases_user_created
+            ON cases(user_id, created_at, id, status, protocol_number, updated_at)
+        """)
+        # Sincronización incremental por marca de agua (updated_at, id)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cases_updated ON cases(updated_at, id)
+        """)
+        # Filas sin updated_at (anteriores o insertadas a mano) quedarían fuera de la marca de agua
+        await db.execute("UPDATE cases SET updated_at = created_at WHERE updated_at IS NULL")
+        # ETag (hash_caso) sin leer la fila completa: búsqueda solo de índice
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cases_hash ON cases(id, hash_caso)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cases_etiologia
+            ON cases(json_extract(causas_muerte, '$.diagnostico_presuntivo.etiologia.forma'))
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_cases_sexo
+            ON cases(json_extract(datos_generales, '$.fallecido.sexo'))
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_case_fields_text
+            ON case_fields(path, value_text)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_case_fields_num
+            ON case_fields(path, value_num)
         """)
         await db.execute("""
             CREATE INDEX IF NOT EXISTS idx_audit_resource 
             ON audit_log(resource_type, resource_id)
         """)
         
+        # Casos anteriores a hash_caso mantenido
+        await db.execute(
+            f"UPDATE cases SET hash_caso = {CASE_HASH_SQL} WHERE hash_caso IS NULL"
+        )
+        
         await db.commit()
         print("[INFO] Base de datos inicializada")
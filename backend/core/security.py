@@ -0,0 +1,271 @@
+"""
+Seguridad: tokens de sesión firmados (JWT) y lista de revocación.
+
+Los tokens se verifican en el proceso (firma + expiración) sin consultar
+la base de datos por cada llamada. El logout agrega el identificador del
+token (jti) a la tabla revoked_tokens; cada worker guarda una copia en
+memoria que relee cada REVOCATION_REFRESH_SECONDS, así un logout se
+respeta en todos los workers. Cada entrada se descarta cuando el token
+habría expirado igual.
+
+La clave de firma sale de SECRET_KEY o, si no se configuró, de una clave
+aleatoria persistida en el directorio de datos (ver core.config).
+
+bcrypt (~250 ms por llamada) corre en un pool de hilos acotado para no
+bloquear el event loop (WebSockets de dictado incluidos).
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Optional, Tuple
+
+import aiosqlite
+import bcrypt
+from fastapi import Header
+from jose import jwt, JWTError, ExpiredSignatureError
+
+from core.config import settings
+from core.database import read_connection
+
+logger = logging.getLogger(__name__)
+
+
+class TokenError(Exception):
+    """Token inválido, expirado o revocado."""
+
+
+def create_access_token(user_id: str, username: str, full_name: str, role: str) -> Tuple[str, datetime]:
+    """Emite un token firmado. Retorna (token, expires_at)."""
+    now = datetime.now()
+    expires_at = now + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    claims = {
+        "sub": user_id,
+        "username": username,
+        "name": full_name,
+        "role": role,
+        "jti": secrets.token_hex(8),
+        "iat": int(now.timestamp()),
+        "exp": int(expires_at.timestamp()),
+    }
+    token = jwt.encode(claims, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    return token, expires_at
+
+
+class RevocationList:
+    """
+    Conjunto de jti revocados: copia en memoria de la tabla revoked_tokens.
+
+    Cada worker de uvicorn tiene su propia copia; el logout escribe en la
+    tabla y los demás workers la releen cuando su copia tiene más de
+    REVOCATION_REFRESH_SECONDS (0 = releer en cada verificación).
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._revoked: Dict[str, int] = {}  # jti -> exp (epoch)
+        self._loaded_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    def _prune(self):
+        """Descarta entradas de tokens que ya expiraron por sí solos."""
+        now = time.time()
+        expired = [jti for jti, exp in self._revoked.items() if exp < now]
+        for jti in expired:
+            del self._revoked[jti]
+
+    async def _read(self, db: aiosqlite.Connection):
+        cursor = await db.execute(
+            "SELECT jti, expires_at FROM revoked_tokens WHERE expires_at >= ?",
+            (int(time.time()),)
+        )
+        self._revoked = {row[0]: row[1] for row in await cursor.fetchall()}
+        self._loaded_at = time.monotonic()
+
+    async def load(self, db: aiosqlite.Connection):
+        """Carga la lista persistida (al iniciar) y purga las entradas vencidas."""
+        await db.execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (int(time.time()),))
+        await db.commit()
+        await self._read(db)
+        logger.info(f"Lista de revocación cargada: {len(self._revoked)} tokens")
+
+    async def _refresh(self):
+        """Relee la tabla si la copia local está vencida (revocaciones de otros workers)."""
+        if time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return  # otra verificación la releyó mientras esperábamos
+            async with read_connection() as db:
+                await self._read(db)
+
+    async def is_revoked(self, jti: str) -> bool:
+        if jti in self._revoked:
+            return True
+        await self._refresh()
+        return jti in self._revoked
+
+    async def revoke(self, db: aiosqlite.Connection, jti: str, exp: int):
+        """Revoca un token hasta su expiración."""
+        self._prune()
+        self._revoked[jti] = exp
+        await db.execute(
+            "INSERT OR REPLACE INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+            (jti, exp)
+        )
+        await db.commit()
+
+
+# Singleton
+revocation_list = RevocationList(settings.REVOCATION_REFRESH_SECONDS)
+
+
+async def verify_token(token: str) -> dict:
+    """
+    Verifica firma, expiración y revocación de un token.
+    Retorna sus claims o lanza TokenError.
+    """
+    try:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except ExpiredSignatureError:
+        raise TokenError("Token expirado")
+    except JWTError:
+        raise TokenError("Token inválido")
+
+    if await revocation_list.is_revoked(claims.get("jti", "")):
+        raise TokenError("Token revocado")
+
+    return claims
+
+
+async def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[dict]:
+    """
+    Dependencia: claims del token 'Authorization: Bearer ...' si es válido.
+    Los endpoints aún no exigen sesión, así que sin token (o con uno
+    inválido) retorna None.
+    """
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return await verify_token(authorization[7:].strip())
+    except TokenError:
+        return None
+
+
+class HasherBusy(Exception):
+    """La cola de hash de contraseñas está llena."""
+
+
+class PasswordHasher:
+    """
+    bcrypt en un pool de hilos dedicado.
+    Limita los trabajos en curso + en cola; por encima se rechaza (HasherBusy)
+    en lugar de acumular latencia para todos.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = max(1, workers)
+        self.max_pending = max(self.workers, max_pending)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_pending:
+            raise HasherBusy()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+        return hashed.decode()
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode(), password_hash.encode())
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class LoginThrottle:
+    """
+    Limita los intentos fallidos por usuario en una ventana deslizante.
+    Sigue a lo sumo max_users nombres (un barrido con nombres inventados no
+    hace crecer la memoria): al superarlo se descartan primero los vencidos
+    y luego los de fallo más antiguo.
+    """
+
+    def __init__(self, max_attempts: int, window_seconds: int, max_users: int):
+        self.max_attempts = max_attempts
+        self.window = window_seconds
+        self.max_users = max(1, max_users)
+        self._failures: "OrderedDict[str, Deque[float]]" = OrderedDict()  # fallo más antiguo primero
+
+    def _recent(self, username: str) -> Deque[float]:
+        failures = self._failures.get(username)
+        if failures is None:
+            return deque()
+        cutoff = time.monotonic() - self.window
+        while failures and failures[0] < cutoff:
+            failures.popleft()
+        if not failures:
+            del self._failures[username]
+        return failures
+
+    def retry_after(self, username: str) -> int:
+        """Segundos hasta el próximo intento permitido (0 si está permitido)."""
+        failures = self._recent(username)
+        if len(failures) < self.max_attempts:
+            return 0
+        return max(1, int(failures[0] + self.window - time.monotonic()) + 1)
+
+    def record_failure(self, username: str):
+        failures = self._failures.setdefault(username, deque())
+        failures.append(time.monotonic())
+        self._failures.move_to_end(username)
+        if len(self._failures) > self.max_users:
+            self._shrink()
+
+    def discard_last(self, username: str):
+        """Anula el último intento registrado (no llegó a verificarse)."""
+        failures = self._failures.get(username)
+        if failures:
+            failures.pop()
+            if not failures:
+                del self._failures[username]
+
+    def _shrink(self):
+        cutoff = time.monotonic() - self.window
+        for name in [n for n, f in self._failures.items() if f[-1] < cutoff]:
+            del self._failures[name]
+        while len(self._failures) > self.max_users:
+            self._failures.popitem(last=False)
+
+    def reset(self, username: str):
+        self._failures.pop(username, None)
+
+
+# Singletons
+password_hasher = PasswordHasher(settings.BCRYPT_WORKERS, settings.BCRYPT_MAX_PENDING)
+login_throttle = LoginThrottle(
+    settings.LOGIN_MAX_ATTEMPTS, settings.LOGIN_WINDOW_SECONDS, settings.LOGIN_THROTTLE_MAX_USERS
+)
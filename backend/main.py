@@ -3,14 +3,23 @@ CoronerIA Backend - Main Application
 Asistente de IA para Documentación Médico-Legal
 """
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from core.config import settings
-from core.database import init_db
+from core.database import init_db, db_pool
+from core.security import revocation_list, password_hasher
 from core.logging_config import setup_logging
-from routers import transcription, ner, export, cases, auth
+from routers import transcription, ner, export, cases, auth, audit
+from services.audit_service import audit_service
+from services.render_service import render_service
+from services.fhir_export_service import fhir_export_service
+from services.gemini_service import gemini_files
+from services.inference_client import inference_client
+from services.llm_cache import llm_cache
+from services.model_registry import whisper_models
 
 
 @asynccontextmanager
@@ -19,11 +28,28 @@ async def lifespan(app: FastAPI):
     # Startup
     setup_logging()
     await init_db()
+    await db_pool.open()
+    async with db_pool.writer() as db:
+        await cases.field_index.backfill(db)
+        await revocation_list.load(db)
+    await audit_service.start()
+    if (settings.WHISPER_PRELOAD and not inference_client.enabled
+            and transcription.speech_service.get_current_mode() == "edge"):
+        # En segundo plano: el servidor atiende mientras el modelo carga
+        whisper_models.preload()
     print(f"🔬 CoronerIA Backend iniciado en modo: {settings.CORONERIA_MODE}")
     
     yield
     
     # Shutdown
+    await fhir_export_service.shutdown()
+    await inference_client.close()
+    await gemini_files.close()
+    await llm_cache.close()
+    await audit_service.stop()
+    await db_pool.close()
+    password_hasher.shutdown()
+    render_service.shutdown()
     print("🔬 CoronerIA Backend cerrado")
 
 
@@ -50,6 +76,7 @@ app.include_router(transcription.router)
 app.include_router(ner.router)
 app.include_router(export.router)
 app.include_router(cases.router)
+app.include_router(audit.router)
 
 
 @app.get("/")
@@ -70,5 +97,17 @@ async def health():
         "status": "healthy",
         "azure_configured": settings.is_azure_configured,
         "mode": settings.CORONERIA_MODE,
-        "language": settings.CORONERIA_LANGUAGE
+        "language": settings.CORONERIA_LANGUAGE,
+        "whisper": await _whisper_status()
     }
+
+
+async def _whisper_status() -> dict:
+    """Estado de Whisper: local o del servidor de inferencia compartido."""
+    if not inference_client.enabled:
+        return whisper_models.status()
+    try:
+        status = await asyncio.wait_for(inference_client.status(), 5)
+        return {**status["whisper"], "server": {"queued": status["queued"], "served": status["served"]}}
+    except Exception as e:
+        return {"ready": False, "server": {"error": str(e)}}
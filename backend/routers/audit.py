@@ -0,0 +1,66 @@
+"""
+Router de auditoría - historial de cadena de custodia.
+"""
+
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel
+from typing import Optional, List
+import aiosqlite
+
+from core.database import get_read_db
+from services.audit_service import audit_service
+
+router = APIRouter(prefix="/api/audit", tags=["audit"])
+
+
+class AuditEntry(BaseModel):
+    id: int
+    timestamp: Optional[str] = None
+    user_id: str
+    action: str
+    resource_type: str
+    resource_id: str
+    details: Optional[str] = None
+    hash_before: Optional[str] = None
+    hash_after: Optional[str] = None
+    device_id: Optional[str] = None
+    chain_hash: Optional[str] = None
+
+
+class AuditPage(BaseModel):
+    items: List[AuditEntry]
+    next_before_id: Optional[int] = None
+
+
+@router.get("/verify")
+async def verify_audit_chain(db: aiosqlite.Connection = Depends(get_read_db)):
+    """Verifica la integridad de la cadena de hashes de toda la auditoría."""
+
+    await audit_service.drain()
+    return await audit_service.verify_chain(db)
+
+
+@router.get("/{resource_type}/{resource_id}", response_model=AuditPage)
+async def get_resource_history(
+    resource_type: str,
+    resource_id: str,
+    before_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """
+    Historial de auditoría de un recurso (p. ej. /api/audit/case/{id}),
+    del evento más reciente al más antiguo. Para la página siguiente,
+    pasar before_id = next_before_id.
+    """
+
+    # Incluir los eventos aún en cola
+    await audit_service.drain()
+
+    items = await audit_service.query(db, resource_type, resource_id, before_id, limit + 1)
+    next_before_id = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_before_id = items[-1]["id"]
+
+    return AuditPage(items=[AuditEntry(**item) for item in items], next_before_id=next_before_id)
@@ -2,15 +2,18 @@
 Router de autenticación.
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import bcrypt
 import secrets
-from datetime import datetime, timedelta
+from datetime import datetime
 import aiosqlite
 
-from core.database import get_db
-from core.config import settings
+from core.database import read_connection, write_connection
+from core.security import (
+    create_access_token, verify_token, revocation_list, TokenError,
+    password_hasher, login_throttle, HasherBusy
+)
+from services.audit_service import audit_service
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -36,37 +39,68 @@ class CreateUserRequest(BaseModel):
     role: str = "medico"
 
 
+def _hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Servidor ocupado, reintente en unos segundos",
+        headers={"Retry-After": "2"}
+    )
+
+
 @router.post("/login", response_model=LoginResponse)
-async def login(request: LoginRequest, db: aiosqlite.Connection = Depends(get_db)):
+async def login(request: LoginRequest):
     """Autenticar usuario."""
     
-    cursor = await db.execute(
-        "SELECT id, password_hash, full_name, role FROM users WHERE username = ?",
-        (request.username,)
-    )
-    row = await cursor.fetchone()
+    retry_after = login_throttle.retry_after(request.username)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiados intentos fallidos, intente más tarde",
+            headers={"Retry-After": str(retry_after)}
+        )
+    
+    # La conexión se devuelve al pool antes de bcrypt (~250 ms)
+    async with read_connection() as db:
+        cursor = await db.execute(
+            "SELECT id, password_hash, full_name, role FROM users WHERE username = ?",
+            (request.username,)
+        )
+        row = await cursor.fetchone()
     
     if not row:
+        login_throttle.record_failure(request.username)
+        audit_service.record("login_failed", "user", request.username)
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
     
     user_id, password_hash, full_name, role = row
     
-    if not bcrypt.checkpw(request.password.encode(), password_hash.encode()):
+    # El intento cuenta desde ya: una ráfaga concurrente no supera el límite
+    login_throttle.record_failure(request.username)
+    try:
+        valid = await password_hasher.verify(request.password, password_hash)
+    except HasherBusy:
+        # Sin verificar la contraseña: el intento no cuenta para el bloqueo
+        login_throttle.discard_last(request.username)
+        raise _hasher_busy()
+    
+    if not valid:
+        audit_service.record("login_failed", "user", user_id, user_id=user_id)
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
     
-    # Crear sesión
-    token = secrets.token_urlsafe(32)
-    expires_at = datetime.now() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    login_throttle.reset(request.username)
     
-    await db.execute(
-        "INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)",
-        (token, user_id, expires_at.isoformat())
-    )
-    await db.execute(
-        "UPDATE users SET last_login = ? WHERE id = ?",
-        (datetime.now().isoformat(), user_id)
-    )
-    await db.commit()
+    # Emitir token firmado (sin estado en la base de datos)
+    token, expires_at = create_access_token(user_id, request.username, full_name or "", role)
+    
+    # El escritor solo se toma para esta actualización, no durante bcrypt
+    async with write_connection() as wdb:
+        await wdb.execute(
+            "UPDATE users SET last_login = ? WHERE id = ?",
+            (datetime.now().isoformat(), user_id)
+        )
+        await wdb.commit()
+    
+    audit_service.record("login", "user", user_id, user_id=user_id)
     
     return LoginResponse(
         token=token,
@@ -79,69 +113,76 @@ async def login(request: LoginRequest, db: aiosqlite.Connection = Depends(get_db
 
 
 @router.post("/register")
-async def register(request: CreateUserRequest, db: aiosqlite.Connection = Depends(get_db)):
+async def register(request: CreateUserRequest):
     """Registrar nuevo usuario (para desarrollo)."""
     
-    # Verificar si existe
-    cursor = await db.execute(
-        "SELECT id FROM users WHERE username = ?",
-        (request.username,)
-    )
-    if await cursor.fetchone():
+    # Verificar si existe (sin retener la conexión durante el hash)
+    async with read_connection() as db:
+        cursor = await db.execute(
+            "SELECT id FROM users WHERE username = ?",
+            (request.username,)
+        )
+        exists = await cursor.fetchone()
+    if exists:
         raise HTTPException(status_code=400, detail="Usuario ya existe")
     
     # Crear usuario
-    password_hash = bcrypt.hashpw(
-        request.password.encode(),
-        bcrypt.gensalt()
-    ).decode()
+    try:
+        password_hash = await password_hasher.hash(request.password)
+    except HasherBusy:
+        raise _hasher_busy()
     
     user_id = secrets.token_hex(16)
     
-    await db.execute(
-        """INSERT INTO users (id, username, password_hash, full_name, role)
-           VALUES (?, ?, ?, ?, ?)""",
-        (user_id, request.username, password_hash, request.full_name, request.role)
+    async with write_connection() as wdb:
+        try:
+            await wdb.execute(
+                """INSERT INTO users (id, username, password_hash, full_name, role)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (user_id, request.username, password_hash, request.full_name, request.role)
+            )
+        except aiosqlite.IntegrityError:
+            # Registrado en paralelo mientras se calculaba el hash
+            raise HTTPException(status_code=400, detail="Usuario ya existe")
+        await wdb.commit()
+    
+    audit_service.record(
+        "register", "user", user_id, user_id=user_id,
+        details={"username": request.username, "role": request.role}
     )
-    await db.commit()
     
     return {"user_id": user_id, "message": "Usuario creado exitosamente"}
 
 
 @router.get("/me")
-async def get_current_user(token: str, db: aiosqlite.Connection = Depends(get_db)):
-    """Obtener usuario actual por token."""
-    
-    cursor = await db.execute(
-        """SELECT s.user_id, s.expires_at, u.username, u.full_name, u.role
-           FROM sessions s
-           JOIN users u ON s.user_id = u.id
-           WHERE s.token = ?""",
-        (token,)
-    )
-    row = await cursor.fetchone()
+async def get_current_user(token: str):
+    """Obtener usuario actual por token (verificado en proceso, sin consultar la base)."""
     
-    if not row:
-        raise HTTPException(status_code=401, detail="Token inválido")
-    
-    user_id, expires_at, username, full_name, role = row
-    
-    if datetime.fromisoformat(expires_at) < datetime.now():
-        raise HTTPException(status_code=401, detail="Token expirado")
+    try:
+        claims = await verify_token(token)
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
     
     return {
-        "user_id": user_id,
-        "username": username,
-        "full_name": full_name,
-        "role": role
+        "user_id": claims["sub"],
+        "username": claims["username"],
+        "full_name": claims["name"],
+        "role": claims["role"]
     }
 
 
 @router.post("/logout")
-async def logout(token: str, db: aiosqlite.Connection = Depends(get_db)):
-    """Cerrar sesión."""
-    
-    await db.execute("DELETE FROM sessions WHERE token = ?", (token,))
-    await db.commit()
+async def logout(token: str):
+    """Cerrar sesión: revoca el token hasta su expiración."""
+    
+    try:
+        claims = await verify_token(token)
+    except TokenError:
+        # Token ya inválido, expirado o revocado: nada que revocar
+        return {"message": "Sesión cerrada"}
+    
+    async with write_connection() as db:
+        await revocation_list.revoke(db, claims["jti"], claims["exp"])
+    audit_service.record("logout", "user", claims["sub"], user_id=claims["sub"])
     
     return {"message": "Sesión cerrada"}
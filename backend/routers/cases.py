@@ -2,15 +2,23 @@
 Router de casos - CRUD de protocolos de necropsia v2.0
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Literal, Union
 from datetime import datetime
 import secrets
+import base64
 import json
 import aiosqlite
 
-from core.database import get_db
+from core.database import get_read_db, read_connection, refresh_case_hash, write_connection
+from core.security import get_optional_user
+from services.audio_service import audio_service, AudioTooLarge
+from services.audit_service import audit_service
+from services.case_repository import case_repository
+from services.field_index_service import FieldIndexService
+from services.pdf_cache import pdf_cache
+from services.search_service import SearchService
 
 router = APIRouter(prefix="/api/cases", tags=["cases"])
 
@@ -43,6 +51,19 @@ LEGACY_SECTIONS = [
     'conclusiones',
 ]
 
+# Columnas escalares de la respuesta de get_case
+CASE_COLUMNS = [
+    'id', 'protocol_number', 'status', 'created_at', 'updated_at',
+    'audio_path', 'hash_audio', 'transcript_raw', 'hash_caso', 'version',
+]
+
+
+# Índice de campos anidados (case_fields)
+field_index = FieldIndexService(PROTOCOL_SECTIONS + LEGACY_SECTIONS)
+
+# Búsqueda de texto completo (cases_fts)
+search_service = SearchService()
+
 
 # ============================================
 # MODELOS
@@ -76,6 +97,27 @@ class CaseUpdate(BaseModel):
     conclusiones: Optional[Dict] = None
 
 
+class FieldFilter(BaseModel):
+    path: str  # ej: "examen_interno_torax.corazon.peso"
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte"] = "eq"
+    value: Union[bool, int, float, str]
+
+
+class CaseQuery(BaseModel):
+    filters: List[FieldFilter]
+    status: Optional[str] = None
+    limit: int = 50
+
+
+class CaseSearchResult(BaseModel):
+    id: str
+    protocol_number: Optional[str]
+    status: str
+    created_at: str
+    rank: float
+    snippet: Optional[str]
+
+
 class CaseResponse(BaseModel):
     id: str
     protocol_number: Optional[str]
@@ -84,62 +126,171 @@ class CaseResponse(BaseModel):
     updated_at: Optional[str]
 
 
+class CaseListResponse(BaseModel):
+    items: List[CaseResponse]
+    next_cursor: Optional[str] = None
+
+
+def _encode_cursor(created_at: str, case_id: str) -> str:
+    """Cursor opaco para paginación keyset sobre (created_at, id)."""
+    raw = json.dumps([created_at, case_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _etag(hash_caso: str) -> str:
+    """ETag fuerte: hash_caso cubre toda la representación del caso."""
+    return f'"{hash_caso}"'
+
+
+def _parse_etags(header: Optional[str], weak: bool = False) -> Optional[List[str]]:
+    """
+    Lista de hashes de un header If-Match / If-None-Match.
+    None = cualquier versión (header ausente o "*"). If-Match usa
+    comparación fuerte (las ETags W/ no coinciden); If-None-Match, débil.
+    """
+    if header is None or header.strip() == "*":
+        return None
+    hashes = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if weak and tag.startswith("W/"):
+            tag = tag[2:]
+        if len(tag) > 2 and tag.startswith('"') and tag.endswith('"'):
+            hashes.append(tag[1:-1])
+    return hashes
+
+
+def _decode_cursor(cursor: str) -> List[str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, case_id = json.loads(raw)
+        return [str(created_at), str(case_id)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+async def _current_hash(db: aiosqlite.Connection, case_id: str) -> Optional[str]:
+    """hash_caso actual (None si el caso no existe), solo con el índice cubriente."""
+    cursor = await db.execute(
+        "SELECT hash_caso FROM cases INDEXED BY idx_cases_hash WHERE id = ?",
+        (case_id,)
+    )
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+def _user_id(user: Optional[dict]) -> Optional[str]:
+    return user["sub"] if user else None
+
+
 # ============================================
 # ENDPOINTS
 # ============================================
 
-@router.get("", response_model=List[CaseResponse])
+@router.get("", response_model=CaseListResponse)
 async def list_cases(
     status: Optional[str] = None,
+    user_id: Optional[str] = None,
+    protocol_prefix: Optional[str] = None,
+    created_from: Optional[str] = None,
+    created_to: Optional[str] = None,
+    cursor: Optional[str] = None,
     limit: int = 50,
-    db: aiosqlite.Connection = Depends(get_db)
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
-    """Lista todos los casos."""
+    """
+    Lista casos, del más reciente al más antiguo, paginados por cursor.
+    Para la página siguiente, enviar el next_cursor de la respuesta.
+    """
+    
+    limit = max(1, min(limit, 200))
+    conditions = ["status != 'deleted'"]
+    params: List[Any] = []
     
     if status:
-        query = "SELECT id, protocol_number, status, created_at, updated_at FROM cases WHERE status = ? AND status != 'deleted' ORDER BY created_at DESC LIMIT ?"
-        cursor = await db.execute(query, (status, limit))
-    else:
-        query = "SELECT id, protocol_number, status, created_at, updated_at FROM cases WHERE status != 'deleted' ORDER BY created_at DESC LIMIT ?"
-        cursor = await db.execute(query, (limit,))
+        conditions.append("status = ?")
+        params.append(status)
+    if user_id:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if protocol_prefix:
+        conditions.append("substr(protocol_number, 1, ?) = ?")
+        params.extend([len(protocol_prefix), protocol_prefix])
+    if created_from:
+        conditions.append("created_at >= ?")
+        params.append(created_from)
+    if created_to:
+        conditions.append("created_at < ?")
+        params.append(created_to)
+    if cursor:
+        conditions.append("(created_at, id) < (?, ?)")
+        params.extend(_decode_cursor(cursor))
     
-    rows = await cursor.fetchall()
+    # Un registro extra para saber si hay página siguiente
+    params.append(limit + 1)
     
-    return [
-        CaseResponse(
-            id=row[0],
-            protocol_number=row[1],
-            status=row[2],
-            created_at=row[3],
-            updated_at=row[4]
-        )
-        for row in rows
-    ]
+    db_cursor = await db.execute(
+        f"""SELECT id, protocol_number, status, created_at, updated_at FROM cases
+           WHERE {' AND '.join(conditions)}
+           ORDER BY created_at DESC, id DESC
+           LIMIT ?""",
+        params
+    )
+    rows = await db_cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][3], rows[-1][0])
+    
+    return CaseListResponse(
+        items=[
+            CaseResponse(
+                id=row[0],
+                protocol_number=row[1],
+                status=row[2],
+                created_at=row[3],
+                updated_at=row[4]
+            )
+            for row in rows
+        ],
+        next_cursor=next_cursor
+    )
 
 
 @router.post("", response_model=CaseResponse)
 async def create_case(
     case: CaseCreate,
-    db: aiosqlite.Connection = Depends(get_db)
+    user: Optional[dict] = Depends(get_optional_user)
 ):
     """Crea un nuevo caso."""
     
     case_id = secrets.token_hex(16)
     now = datetime.now().isoformat()
     
-    await db.execute(
-        """INSERT INTO cases (id, protocol_number, created_at, updated_at, status, datos_generales)
-           VALUES (?, ?, ?, ?, ?, ?)""",
-        (
-            case_id,
-            case.protocol_number,
-            now,
-            now,
-            "borrador",
-            json.dumps(case.datos_generales) if case.datos_generales else None
+    async with write_connection() as db:
+        await db.execute(
+            """INSERT INTO cases (id, protocol_number, created_at, updated_at, status, datos_generales)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (
+                case_id,
+                case.protocol_number,
+                now,
+                now,
+                "borrador",
+                json.dumps(case.datos_generales) if case.datos_generales else None
+            )
         )
+        if case.datos_generales:
+            await field_index.reindex(db, case_id, ['datos_generales'])
+        hash_caso = await refresh_case_hash(db, case_id)
+        await db.commit()
+    
+    audit_service.record(
+        "create", "case", case_id, user_id=_user_id(user),
+        details={"protocol_number": case.protocol_number},
+        hash_after=hash_caso
     )
-    await db.commit()
     
     return CaseResponse(
         id=case_id,
@@ -150,91 +301,228 @@ async def create_case(
     )
 
 
-@router.get("/{case_id}")
-async def get_case(case_id: str, db: aiosqlite.Connection = Depends(get_db)):
-    """Obtiene un caso completo con todas las secciones."""
+@router.post("/query", response_model=List[CaseResponse])
+async def query_cases(
+    query: CaseQuery,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """
+    Filtra casos por campos de las secciones del protocolo.
+    Ej: causas_muerte.diagnostico_presuntivo.etiologia.forma = HOMICIDA
+        examen_interno_torax.corazon.peso > 500
+    """
+    
+    conditions = ["status != 'deleted'"]
+    params: List[Any] = []
+    
+    for f in query.filters:
+        if not field_index.validate_path(f.path):
+            raise HTTPException(status_code=400, detail=f"Ruta de campo inválida: {f.path}")
+        sql, values = field_index.build_filter(f.path, f.op, f.value)
+        conditions.append(sql)
+        params.extend(values)
     
-    # Construir SELECT con todas las secciones
-    all_sections = PROTOCOL_SECTIONS + LEGACY_SECTIONS
-    sections_sql = ', '.join(all_sections)
+    if query.status:
+        conditions.append("status = ?")
+        params.append(query.status)
+    
+    params.append(max(1, min(query.limit, 200)))
     
     cursor = await db.execute(
-        f"""SELECT id, protocol_number, status, created_at, updated_at,
-                  {sections_sql},
-                  audio_path, transcript_raw, hash_caso
-           FROM cases WHERE id = ?""",
-        (case_id,)
+        f"""SELECT id, protocol_number, status, created_at, updated_at FROM cases
+           WHERE {' AND '.join(conditions)}
+           ORDER BY created_at DESC LIMIT ?""",
+        params
     )
-    row = await cursor.fetchone()
+    rows = await cursor.fetchall()
     
-    if not row:
-        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    return [
+        CaseResponse(
+            id=row[0],
+            protocol_number=row[1],
+            status=row[2],
+            created_at=row[3],
+            updated_at=row[4]
+        )
+        for row in rows
+    ]
+
+
+@router.get("/search", response_model=List[CaseSearchResult])
+async def search_cases(
+    q: str,
+    limit: int = 20,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """Búsqueda de texto completo en transcripciones y texto del protocolo."""
+    
+    results = await search_service.search(db, q, min(limit, 100))
+    return [CaseSearchResult(**r) for r in results]
+
+
+@router.get("/{case_id}")
+async def get_case(
+    case_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """
+    Obtiene un caso completo con todas las secciones.
+    Con If-None-Match (ETag previo) responde 304 si el caso no cambió,
+    consultando solo hash_caso (índice idx_cases_hash) sin leer las secciones.
+    """
     
-    # Construir respuesta
-    result = {
-        "id": row[0],
-        "protocol_number": row[1],
-        "status": row[2],
-        "created_at": row[3],
-        "updated_at": row[4],
-    }
+    if if_none_match is not None:
+        # INDEXED BY: el índice cubriente evita leer la fila (y sus secciones)
+        cursor = await db.execute(
+            "SELECT hash_caso FROM cases INDEXED BY idx_cases_hash WHERE id = ?",
+            (case_id,)
+        )
+        current = await cursor.fetchone()
+        if not current:
+            raise HTTPException(status_code=404, detail="Caso no encontrado")
+        
+        tags = _parse_etags(if_none_match, weak=True)
+        if tags is None or current[0] in tags:
+            return Response(status_code=304, headers={"ETag": _etag(current[0])})
+    
+    case = await case_repository.load(
+        db, case_id, PROTOCOL_SECTIONS + LEGACY_SECTIONS, columns=CASE_COLUMNS
+    )
     
-    # Parsear secciones JSON
-    idx = 5
-    for section in all_sections:
-        result[section] = json.loads(row[idx]) if row[idx] else {}
-        idx += 1
+    if not case:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    result["audio_path"] = row[idx]
-    result["transcript_raw"] = row[idx + 1]
-    result["hash_caso"] = row[idx + 2]
+    response.headers["ETag"] = _etag(case["hash_caso"])
     
-    return result
+    return case
 
 
 @router.patch("/{case_id}")
 async def update_case(
     case_id: str,
     update: CaseUpdate,
-    db: aiosqlite.Connection = Depends(get_db)
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    user: Optional[dict] = Depends(get_optional_user)
 ):
-    """Actualiza campos de un caso."""
+    """
+    Actualiza secciones de un caso con semántica JSON Merge Patch (RFC 7396).
     
-    # Verificar que existe
-    cursor = await db.execute("SELECT id FROM cases WHERE id = ?", (case_id,))
-    if not await cursor.fetchone():
-        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    Cada sección enviada se fusiona en SQL (json_patch) con la guardada:
+    basta con enviar las claves modificadas, y una clave con valor null
+    la elimina. Una sección enviada como null se borra por completo.
+    Con If-Match (ETag de GET) la escritura solo se aplica si nadie más
+    modificó el caso; si no, responde 412.
+    """
     
     now = datetime.now().isoformat()
-    updates = ["updated_at = ?"]
-    values = [now]
+    updates = ["updated_at = ?", "version = version + 1"]
+    values: List[Any] = [now]
     
-    # Actualizar todas las secciones que vengan en el request
+    # Fusionar todas las secciones que vengan en el request
     update_dict = update.model_dump(exclude_unset=True)
+    changed_sections = []
     
     for section in PROTOCOL_SECTIONS + LEGACY_SECTIONS:
-        if section in update_dict and update_dict[section] is not None:
-            updates.append(f"{section} = ?")
+        if section not in update_dict:
+            continue
+        if update_dict[section] is None:
+            updates.append(f"{section} = NULL")
+        else:
+            updates.append(f"{section} = json_patch(COALESCE({section}, '{{}}'), ?)")
             values.append(json.dumps(update_dict[section]))
+        changed_sections.append(section)
+    
+    expected_hashes = _parse_etags(if_match)
+    
+    if not changed_sections:
+        # Sin secciones: no se escribe (version, ETag y auditoría no cambian)
+        async with read_connection() as db:
+            cursor = await db.execute(
+                "SELECT hash_caso, updated_at, version FROM cases WHERE id = ?",
+                (case_id,)
+            )
+            current = await cursor.fetchone()
+        if not current:
+            raise HTTPException(status_code=404, detail="Caso no encontrado")
+        if expected_hashes is not None and current[0] not in expected_hashes:
+            raise HTTPException(
+                status_code=412,
+                detail="El caso fue modificado por otra sesión. Recargue antes de guardar.",
+                headers={"ETag": _etag(current[0])}
+            )
+        response.headers["ETag"] = _etag(current[0])
+        return {"message": "Sin cambios", "updated_at": current[1], "version": current[2]}
     
+    where = "id = ?"
     values.append(case_id)
     
-    query = f"UPDATE cases SET {', '.join(updates)} WHERE id = ?"
-    await db.execute(query, values)
-    await db.commit()
+    if expected_hashes is not None:
+        where += f" AND hash_caso IN ({', '.join('?' * len(expected_hashes)) or 'NULL'})"
+        values.extend(expected_hashes)
     
-    return {"message": "Caso actualizado", "updated_at": now}
+    async with write_connection() as db:
+        hash_before = await _current_hash(db, case_id)
+        if hash_before is None:
+            raise HTTPException(status_code=404, detail="Caso no encontrado")
+        
+        cursor = await db.execute(
+            f"UPDATE cases SET {', '.join(updates)} WHERE {where} RETURNING version",
+            values
+        )
+        row = await cursor.fetchone()
+        
+        if not row:
+            raise HTTPException(
+                status_code=412,
+                detail="El caso fue modificado por otra sesión. Recargue antes de guardar.",
+                headers={"ETag": _etag(hash_before)}
+            )
+        
+        version = row[0]
+        await field_index.reindex(db, case_id, changed_sections)
+        hash_caso = await refresh_case_hash(db, case_id)
+        await db.commit()
+    
+    pdf_cache.invalidate(case_id)
+    
+    audit_service.record(
+        "update", "case", case_id, user_id=_user_id(user),
+        details={"sections": changed_sections, "version": version},
+        hash_before=hash_before, hash_after=hash_caso
+    )
+    
+    response.headers["ETag"] = _etag(hash_caso)
+    
+    return {"message": "Caso actualizado", "updated_at": now, "version": version}
 
 
 @router.delete("/{case_id}")
-async def delete_case(case_id: str, db: aiosqlite.Connection = Depends(get_db)):
+async def delete_case(
+    case_id: str,
+    user: Optional[dict] = Depends(get_optional_user)
+):
     """Elimina un caso (soft delete)."""
     
-    await db.execute(
-        "UPDATE cases SET status = 'deleted', updated_at = ? WHERE id = ?",
-        (datetime.now().isoformat(), case_id)
-    )
-    await db.commit()
+    async with write_connection() as db:
+        hash_before = await _current_hash(db, case_id)
+        await db.execute(
+            "UPDATE cases SET status = 'deleted', updated_at = ?, version = version + 1 WHERE id = ?",
+            (datetime.now().isoformat(), case_id)
+        )
+        hash_caso = await refresh_case_hash(db, case_id)
+        await db.commit()
+    
+    pdf_cache.invalidate(case_id)
+    case_repository.invalidate(case_id)
+    
+    if hash_caso:
+        audit_service.record(
+            "delete", "case", case_id, user_id=_user_id(user),
+            hash_before=hash_before, hash_after=hash_caso
+        )
     
     return {"message": "Caso eliminado"}
 
@@ -243,7 +531,7 @@ async def delete_case(case_id: str, db: aiosqlite.Connection = Depends(get_db)):
 async def update_case_status(
     case_id: str,
     status: str,
-    db: aiosqlite.Connection = Depends(get_db)
+    user: Optional[dict] = Depends(get_optional_user)
 ):
     """Actualiza el status de un caso."""
     
@@ -251,10 +539,50 @@ async def update_case_status(
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Status inválido. Debe ser uno de: {valid_statuses}")
     
-    await db.execute(
-        "UPDATE cases SET status = ?, updated_at = ? WHERE id = ?",
-        (status, datetime.now().isoformat(), case_id)
-    )
-    await db.commit()
+    async with write_connection() as db:
+        hash_before = await _current_hash(db, case_id)
+        await db.execute(
+            "UPDATE cases SET status = ?, updated_at = ?, version = version + 1 WHERE id = ?",
+            (status, datetime.now().isoformat(), case_id)
+        )
+        hash_caso = await refresh_case_hash(db, case_id)
+        await db.commit()
+    
+    if hash_caso:
+        audit_service.record(
+            "status", "case", case_id, user_id=_user_id(user),
+            details={"status": status},
+            hash_before=hash_before, hash_after=hash_caso
+        )
     
     return {"message": f"Status actualizado a {status}"}
+
+
+@router.put("/{case_id}/audio")
+async def upload_case_audio(
+    case_id: str,
+    request: Request,
+    user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Sube la grabación del caso (cuerpo crudo, Content-Type audio/*).
+    Se escribe a disco en bloques mientras llega, con SHA-256 incremental;
+    más de AUDIO_MAX_UPLOAD_BYTES responde 413 sin esperar al final.
+    """
+    
+    if not await audio_service.case_exists(case_id):
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    
+    try:
+        audio_service.check_length(request.headers.get("content-length"))
+        stored = await audio_service.store(
+            request.stream(), case_id, audio_service.extension_for(request.headers.get("content-type"))
+        )
+    except AudioTooLarge:
+        raise HTTPException(status_code=413, detail="Grabación demasiado grande")
+    
+    hash_caso = await audio_service.attach(case_id, stored, user_id=_user_id(user))
+    if not hash_caso:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    
+    return {"hash_audio": stored.sha256, "size": stored.size, "hash_caso": hash_caso}
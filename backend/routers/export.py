@@ -2,74 +2,272 @@
 Router de exportación - PDF, FHIR, CSV
 """
 
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, BinaryIO, Iterator
+from datetime import datetime
+from pathlib import Path
+import base64
+import csv
+import io
 import json
+import os
 import aiosqlite
 
-from core.database import get_db
-from services.document_service import DocumentService
+from core.database import get_read_db, db_pool
+from core.security import get_optional_user
+from services.document_service import (
+    DocumentService, FORENSYS_CSV_HEADERS, FORENSYS_CSV_SQL, FHIR_REPORT_SQL, FHIR_REPORT_FIELDS
+)
+from services.render_service import render_service, RenderJob, RenderQueueFull
+from services.pdf_cache import pdf_cache
+from services.case_repository import case_repository
+from services.bundle_service import bundle_service, BundleMember
+from services.audit_service import audit_service
+from services.fhir_export_service import fhir_export_service, FhirExportBusy
+from services.protocol_template import TEMPLATE_SECTIONS
 
 router = APIRouter(prefix="/api/export", tags=["export"])
 
 document_service = DocumentService()
 
+# Columnas escalares del caso que usa el paquete zip
+BUNDLE_COLUMNS = ["protocol_number", "audio_path", "transcript_raw", "hash_audio", "hash_caso"]
+
+CSV_CHUNK_ROWS = 500
+
+# Renders por solicitud si la caché desaloja el PDF antes de abrirlo
+PDF_RENDER_ATTEMPTS = 2
+PDF_READ_CHUNK = 64 * 1024
+
 
 class ExportRequest(BaseModel):
     case_id: str
 
 
+async def _load_pdf_data(db: aiosqlite.Connection, case_id: str) -> Dict[str, Any]:
+    """Secciones del caso que usa la plantilla PDF."""
+    
+    case_data = await case_repository.load(db, case_id, TEMPLATE_SECTIONS)
+    
+    if case_data is None:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    
+    return case_data
+
+
+def _submit_pdf(case_id: str, case_data: Dict[str, Any]) -> RenderJob:
+    try:
+        return document_service.submit_pdf(case_id, case_data)
+    except RenderQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Cola de exportación llena, reintente en unos segundos",
+            headers={"Retry-After": "5"}
+        )
+
+
+async def _open_rendered_pdf(case_id: str, case_data: Dict[str, Any]) -> BinaryIO:
+    """
+    PDF del caso ya abierto. Si la caché lo desaloja (otro render, otro
+    worker o un cambio del caso) entre el render y la apertura, se vuelve
+    a renderizar.
+    """
+    
+    for _ in range(PDF_RENDER_ATTEMPTS):
+        # Render en el pool de procesos: el event loop sigue atendiendo
+        job = await render_service.wait(_submit_pdf(case_id, case_data))
+        if job.status != "done":
+            raise HTTPException(status_code=500, detail=f"Error generando PDF: {job.error}")
+        pdf = pdf_cache.open(job.path)
+        if pdf is not None:
+            return pdf
+    
+    raise HTTPException(
+        status_code=503,
+        detail="El PDF fue desalojado de la caché, reintente",
+        headers={"Retry-After": "1"}
+    )
+
+
+def _read_file(file: BinaryIO) -> Iterator[bytes]:
+    with file:
+        while True:
+            block = file.read(PDF_READ_CHUNK)
+            if not block:
+                break
+            yield block
+
+
+def _pdf_response(pdf: BinaryIO, case_id: str) -> StreamingResponse:
+    """Envía un PDF ya abierto (el descriptor sobrevive a un desalojo de la caché)."""
+    
+    return StreamingResponse(
+        _read_file(pdf),
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f'attachment; filename="protocolo_{case_id[:8]}.pdf"',
+            "Content-Length": str(os.fstat(pdf.fileno()).st_size),
+        }
+    )
+
+
 @router.post("/pdf")
 async def export_pdf(
     request: ExportRequest,
-    db: aiosqlite.Connection = Depends(get_db)
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
-    """Exporta caso a PDF formato IMLCF."""
+    """Exporta caso a PDF formato IMLCF (espera el render)."""
+    
+    case_data = await _load_pdf_data(db, request.case_id)
+    pdf = await _open_rendered_pdf(request.case_id, case_data)
+    
+    return _pdf_response(pdf, request.case_id)
+
+
+@router.post("/pdf/jobs", status_code=202)
+async def create_pdf_job(
+    request: ExportRequest,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """Encola la exportación a PDF y retorna el trabajo para consultar su estado."""
+    
+    case_data = await _load_pdf_data(db, request.case_id)
+    job = _submit_pdf(request.case_id, case_data)
+    
+    return {
+        **job.to_dict(),
+        "status_url": f"/api/export/pdf/jobs/{job.id}",
+        "download_url": f"/api/export/pdf/jobs/{job.id}/download",
+    }
+
+
+@router.get("/pdf/jobs/{job_id}")
+async def get_pdf_job(job_id: str):
+    """Estado de un trabajo de exportación PDF."""
+    
+    job = render_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    
+    return job.to_dict()
+
+
+@router.get("/pdf/jobs/{job_id}/download")
+async def download_pdf_job(job_id: str):
+    """Descarga el PDF de un trabajo terminado."""
+    
+    job = render_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job.status == "pending":
+        raise HTTPException(status_code=409, detail="El PDF aún se está generando")
+    if job.status == "error":
+        raise HTTPException(status_code=500, detail=f"Error generando PDF: {job.error}")
+    
+    pdf = pdf_cache.open(job.path)
+    if pdf is None:
+        raise HTTPException(
+            status_code=410,
+            detail="El PDF ya no está en la caché; vuelva a solicitar la exportación"
+        )
+    
+    return _pdf_response(pdf, job.case_id)
+
+
+@router.post("/bundle")
+async def export_bundle(
+    request: ExportRequest,
+    user: Optional[dict] = Depends(get_optional_user),
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """
+    Paquete zip con todos los artefactos del caso (PDF, FHIR, CSV, audio,
+    transcripción) y manifest.json con sus SHA-256. Se transmite a medida
+    que se arma: el PDF se genera (o sale de la caché) antes de empezar.
+    """
+    
+    case_id = request.case_id
+    case = await case_repository.load(db, case_id, TEMPLATE_SECTIONS, columns=BUNDLE_COLUMNS)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    # Obtener datos del caso
     cursor = await db.execute(
-        """SELECT datos_administrativos, fenomenos_cadavericos, examen_externo,
-                  examen_interno, lesiones_traumaticas, conclusiones
-           FROM cases WHERE id = ?""",
-        (request.case_id,)
+        f"SELECT {FHIR_REPORT_SQL}, {FORENSYS_CSV_SQL} FROM cases WHERE id = ?",
+        (case_id,)
     )
     row = await cursor.fetchone()
-    
     if not row:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
+    n_fhir = len(FHIR_REPORT_FIELDS)
     
-    case_data = {
-        "datos_administrativos": json.loads(row[0]) if row[0] else {},
-        "fenomenos_cadavericos": json.loads(row[1]) if row[1] else {},
-        "examen_externo": json.loads(row[2]) if row[2] else {},
-        "examen_interno": json.loads(row[3]) if row[3] else {},
-        "lesiones_traumaticas": json.loads(row[4]) if row[4] else {},
-        "conclusiones": json.loads(row[5]) if row[5] else {},
+    case_data = {section: case[section] for section in TEMPLATE_SECTIONS}
+    pdf = await _open_rendered_pdf(case_id, case_data)
+    
+    fhir_document = await document_service.generate_fhir(case_id, row[:n_fhir])
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer)
+    writer.writerow(FORENSYS_CSV_HEADERS)
+    writer.writerow(row[n_fhir:])
+    
+    prefix = f"protocolo_{case_id[:8]}"
+    members = [
+        BundleMember(f"{prefix}.pdf", file=pdf),
+        BundleMember(f"{prefix}.fhir.json", data=json.dumps(fhir_document, ensure_ascii=False, indent=2).encode("utf-8")),
+        BundleMember(f"{prefix}.csv", data=csv_buffer.getvalue().encode("utf-8")),
+    ]
+    
+    missing = []
+    if case["audio_path"]:
+        audio = Path(case["audio_path"])
+        try:
+            members.append(BundleMember(f"audio/{audio.name}", file=open(audio, "rb"), stored=True))
+        except OSError:
+            missing.append(case["audio_path"])
+    if case["transcript_raw"]:
+        members.append(BundleMember("transcripcion.txt", data=case["transcript_raw"].encode("utf-8")))
+    
+    metadata = {
+        "case_id": case_id,
+        "protocol_number": case["protocol_number"],
+        "hash_caso": case["hash_caso"],
+        "hash_audio": case["hash_audio"],
+        "missing": missing,
     }
     
-    # Generar PDF
-    pdf_path = await document_service.generate_pdf(request.case_id, case_data)
+    audit_service.record(
+        "export_bundle", "case", case_id, user_id=user["sub"] if user else None,
+        details={"files": [m.name for m in members], "missing": missing},
+        hash_after=case["hash_caso"]
+    )
     
-    return FileResponse(
-        pdf_path,
-        media_type="application/pdf",
-        filename=f"protocolo_{request.case_id[:8]}.pdf"
+    return StreamingResponse(
+        bundle_service.stream(members, metadata),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={prefix}_paquete.zip"},
+        # Cierra los archivos si el cliente se fue antes de empezar el envío
+        background=BackgroundTask(bundle_service.close, members)
     )
 
 
+@router.get("/pdf/cache")
+async def get_pdf_cache_stats():
+    """Estadísticas de la caché de PDFs."""
+    
+    return pdf_cache.stats()
+
+
 @router.post("/fhir")
 async def export_fhir(
     request: ExportRequest,
-    db: aiosqlite.Connection = Depends(get_db)
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
     """Exporta caso a FHIR DiagnosticReport."""
     
     cursor = await db.execute(
-        """SELECT datos_administrativos, fenomenos_cadavericos, examen_externo,
-                  examen_interno, lesiones_traumaticas, conclusiones
-           FROM cases WHERE id = ?""",
+        f"SELECT {FHIR_REPORT_SQL} FROM cases WHERE id = ?",
         (request.case_id,)
     )
     row = await cursor.fetchone()
@@ -77,26 +275,103 @@ async def export_fhir(
     if not row:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    case_data = {
-        "datos_administrativos": json.loads(row[0]) if row[0] else {},
-        "conclusiones": json.loads(row[5]) if row[5] else {},
-    }
-    
-    fhir_document = await document_service.generate_fhir(request.case_id, case_data)
+    fhir_document = await document_service.generate_fhir(request.case_id, row)
     
     return fhir_document
 
 
+@router.get("/fhir/$export", status_code=202)
+async def fhir_bulk_export(
+    http_request: Request,
+    _since: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """
+    Inicia una exportación masiva (FHIR Bulk Data) de DiagnosticReports.
+    
+    Responde 202 con Content-Location: consultar esa URL hasta obtener el
+    manifiesto con los archivos NDJSON (gzip). `_since` (fecha ISO) limita a
+    los casos modificados después; `status` filtra por estado del caso.
+    """
+    
+    if _since:
+        try:
+            since = datetime.fromisoformat(_since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="_since debe ser una fecha ISO")
+        # updated_at se guarda en hora local sin zona: comparar en ese formato
+        if since.tzinfo is not None:
+            since = since.astimezone().replace(tzinfo=None)
+        _since = since.isoformat()
+    
+    try:
+        job = fhir_export_service.start(str(http_request.url), since=_since, status=status)
+    except FhirExportBusy:
+        raise HTTPException(
+            status_code=429,
+            detail="Hay demasiadas exportaciones en curso",
+            headers={"Retry-After": "30"}
+        )
+    
+    status_url = str(http_request.url_for("fhir_bulk_status", job_id=job.id))
+    return Response(status_code=202, headers={"Content-Location": status_url})
+
+
+def _get_fhir_export(job_id: str):
+    job = fhir_export_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Exportación no encontrada o expirada")
+    return job
+
+
+@router.get("/fhir/export/{job_id}", name="fhir_bulk_status")
+async def fhir_bulk_status(job_id: str, http_request: Request):
+    """Estado de la exportación: 202 en curso (X-Progress), 200 con el manifiesto."""
+    
+    job = _get_fhir_export(job_id)
+    
+    if job.status == "pending":
+        return Response(status_code=202, headers={"X-Progress": job.progress, "Retry-After": "2"})
+    if job.status == "error":
+        raise HTTPException(status_code=500, detail=f"Error en la exportación: {job.error}")
+    
+    return fhir_export_service.manifest(job, str(http_request.url_for("fhir_bulk_status", job_id=job.id)))
+
+
+@router.get("/fhir/export/{job_id}/{filename}")
+async def fhir_bulk_download(job_id: str, filename: str):
+    """Descarga un archivo NDJSON del manifiesto (comprimido con gzip)."""
+    
+    path = fhir_export_service.file_path(_get_fhir_export(job_id), filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    return FileResponse(
+        path,
+        media_type="application/fhir+ndjson",
+        headers={"Content-Encoding": "gzip"}
+    )
+
+
+@router.delete("/fhir/export/{job_id}", status_code=202)
+async def fhir_bulk_delete(job_id: str):
+    """Cancela la exportación (si sigue en curso) y borra sus archivos."""
+    
+    if not fhir_export_service.remove(job_id):
+        raise HTTPException(status_code=404, detail="Exportación no encontrada o expirada")
+    
+    return Response(status_code=202)
+
+
 @router.post("/csv")
 async def export_csv(
     request: ExportRequest,
-    db: aiosqlite.Connection = Depends(get_db)
+    db: aiosqlite.Connection = Depends(get_read_db)
 ):
     """Exporta caso a CSV para Forensys."""
     
     cursor = await db.execute(
-        """SELECT datos_administrativos, examen_externo, conclusiones
-           FROM cases WHERE id = ?""",
+        f"SELECT {FORENSYS_CSV_SQL} FROM cases WHERE id = ?",
         (request.case_id,)
     )
     row = await cursor.fetchone()
@@ -104,16 +379,111 @@ async def export_csv(
     if not row:
         raise HTTPException(status_code=404, detail="Caso no encontrado")
     
-    case_data = {
-        "datos_administrativos": json.loads(row[0]) if row[0] else {},
-        "examen_externo": json.loads(row[1]) if row[1] else {},
-        "conclusiones": json.loads(row[2]) if row[2] else {},
-    }
-    
-    csv_path = await document_service.generate_csv(request.case_id, case_data)
+    csv_path = await document_service.generate_csv(request.case_id, row)
     
     return FileResponse(
         csv_path,
         media_type="text/csv",
         filename=f"protocolo_{request.case_id[:8]}.csv"
     )
+
+
+def _encode_watermark(updated_at: str, case_id: str) -> str:
+    raw = json.dumps([updated_at, case_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_watermark(watermark: str) -> List[str]:
+    """Marca de agua opaca (X-Watermark) o, por comodidad, una fecha ISO."""
+    try:
+        raw = base64.urlsafe_b64decode(watermark + "=" * (-len(watermark) % 4))
+        updated_at, case_id = json.loads(raw)
+        return [str(updated_at), str(case_id)]
+    except Exception:
+        pass
+    try:
+        datetime.fromisoformat(watermark)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Marca de agua inválida")
+    return [watermark, ""]
+
+
+@router.get("/csv/bulk")
+async def export_csv_bulk(
+    since: Optional[str] = None,
+    status: Optional[str] = None,
+    db: aiosqlite.Connection = Depends(get_read_db)
+):
+    """
+    CSV de Forensys con muchos casos en una sola respuesta en streaming.
+    
+    Sin `since` exporta todos los casos no eliminados. Con `since` (el
+    valor del header X-Watermark de la sincronización anterior, o una fecha
+    ISO) exporta solo los casos modificados después, incluidos los
+    eliminados (columna status). Guardar el X-Watermark de esta respuesta
+    para la próxima sincronización.
+    """
+    
+    # Cota superior fija al inicio: lo que cambie durante el streaming
+    # queda para la próxima sincronización, sin perder ni duplicar filas.
+    cursor = await db.execute(
+        "SELECT updated_at, id FROM cases INDEXED BY idx_cases_updated "
+        "ORDER BY updated_at DESC, id DESC LIMIT 1"
+    )
+    upper = await cursor.fetchone()
+    
+    conditions = []
+    params: List[Any] = []
+    if upper:
+        conditions.append("(updated_at, id) <= (?, ?)")
+        params.extend(upper)
+    if since:
+        conditions.append("(updated_at, id) > (?, ?)")
+        params.extend(_decode_watermark(since))
+    else:
+        conditions.append("status != 'deleted'")
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    
+    sql = f"""SELECT {FORENSYS_CSV_SQL}, id, updated_at, status
+              FROM cases INDEXED BY idx_cases_updated
+              WHERE {' AND '.join(conditions)}
+              ORDER BY updated_at, id"""
+    
+    if upper:
+        watermark = _encode_watermark(*upper)
+    else:
+        watermark = since or ""
+    
+    return StreamingResponse(
+        _stream_csv(sql, params),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename=forensys_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "X-Watermark": watermark,
+        }
+    )
+
+
+async def _stream_csv(sql: str, params: List[Any]):
+    """Filas en bloques de CSV_CHUNK_ROWS: memoria constante sea cual sea el volumen."""
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FORENSYS_CSV_HEADERS + ["case_id", "updated_at", "status"])
+    
+    # Conexión propia: la de la dependencia se libera antes de enviar el cuerpo
+    async with db_pool.reader() as db:
+        cursor = await db.execute(sql, params)
+        while True:
+            rows = await cursor.fetchmany(CSV_CHUNK_ROWS)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -7,9 +7,10 @@ from pydantic import BaseModel
 from typing import Dict, Any, List
 import logging
 
-from services.ner_service import NERService
+from services.ner_service import NERService, ner_flight
 # Import Directo de GeminiService para la función especial de análisis
-from services.gemini_service import GeminiService
+from services.gemini_service import GeminiService, gemini_flight
+from services.llm_cache import llm_cache
 
 router = APIRouter(prefix="/api/ner", tags=["ner"])
 logger = logging.getLogger(__name__)
@@ -55,6 +56,21 @@ async def get_mode():
     }
 
 
+@router.get("/cache")
+async def get_llm_cache_stats():
+    """
+    Estadísticas de la caché de respuestas de LLM (aciertos, fallos, tamaño)
+    y de la coalescencia de solicitudes simultáneas (llamadas ahorradas).
+    """
+    return {
+        **await llm_cache.stats(),
+        "single_flight": {
+            "ner": ner_flight.stats(),
+            "gemini": gemini_flight.stats(),
+        },
+    }
+
+
 @router.post("/extract", response_model=ExtractionResponse)
 async def extract_entities(request: ExtractionRequest):
     """Extrae entidades y mapea a campos del protocolo."""
@@ -2,11 +2,15 @@
 Router de transcripción - Azure Speech y Whisper Local
 """
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+from typing import Optional
+import asyncio
 import logging
 
+from core.security import get_optional_user
+from services.audio_service import audio_service, AudioTooLarge, InvalidUpload, MultipartUpload
 from services.speech_service import SpeechService
 
 router = APIRouter(prefix="/api/transcription", tags=["transcription"])
@@ -30,82 +34,68 @@ async def get_mode():
 
 
 @router.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...)):
-    """Transcribe un archivo de audio."""
+async def transcribe_audio(
+    request: Request,
+    case_id: Optional[str] = None,
+    user: Optional[dict] = Depends(get_optional_user)
+):
+    """
+    Transcribe un archivo de audio: campo "file" de un multipart/form-data
+    o el cuerpo crudo (Content-Type audio/*).
+    El cuerpo se lee mientras llega y el límite AUDIO_MAX_UPLOAD_BYTES se
+    aplica a los bytes recibidos (413 sin esperar al final, también con
+    Transfer-Encoding chunked).
+    Decodifica, remuestrea a 16 kHz mono y remueve silencios en proceso
+    (PyAV + NumPy) y pasa el PCM directo al motor de ASR.
+    Con case_id la grabación se guarda como evidencia del caso (por bloques,
+    con SHA-256) y se transcribe desde ese archivo.
+    """
     
     try:
-        # Guardar archivo temporal
-        import tempfile
-        import os
-        
-        # Detectar extensión correcta basada en content_type
-        ext = ".webm" if file.content_type == "audio/webm" else ".wav"
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-        
-        # Convertir webm a WAV si es necesario (Gemini no soporta webm/Opus de Chrome)
-        final_path = tmp_path
-        if ext == ".webm":
-            import subprocess
-            wav_path = tmp_path.replace(".webm", ".wav")
-            try:
-                logger.info(f"🔄 Convirtiendo {tmp_path} a WAV...")
-                result = subprocess.run([
-                    "ffmpeg", "-y", "-i", tmp_path,
-                    "-acodec", "pcm_s16le",
-                    "-ar", "16000",
-                    "-ac", "1",
-                    wav_path
-                ], capture_output=True, text=True, timeout=30)
-                
-                if result.returncode == 0:
-                    logger.info(f"✅ Conversión exitosa: {wav_path}")
-                    os.unlink(tmp_path)  # Eliminar webm original
-                    final_path = wav_path
-                else:
-                    logger.error(f"❌ FFmpeg error: {result.stderr}")
-            except Exception as conv_err:
-                logger.error(f"❌ Error en conversión: {conv_err}")
-        
-        # Remover silencios del audio (necropsias pueden tener muchas pausas)
-        if final_path.endswith(".wav"):
-            import subprocess
-            processed_path = final_path.replace(".wav", "_processed.wav")
-            try:
-                logger.info(f"🔇 Removiendo silencios de {final_path}...")
-                result = subprocess.run([
-                    "ffmpeg", "-y", "-i", final_path,
-                    "-af", "silenceremove=stop_periods=-1:stop_duration=0.5:stop_threshold=-40dB",
-                    "-ar", "16000", "-ac", "1",
-                    processed_path
-                ], capture_output=True, text=True, timeout=60)
-                
-                if result.returncode == 0:
-                    # Comparar tamaños
-                    original_size = os.path.getsize(final_path)
-                    processed_size = os.path.getsize(processed_path)
-                    reduction = (1 - processed_size / original_size) * 100 if original_size > 0 else 0
-                    logger.info(f"✅ Silencios removidos: {reduction:.1f}% reducción")
-                    os.unlink(final_path)  # Eliminar original
-                    final_path = processed_path
-                else:
-                    logger.warning(f"⚠️ No se pudieron remover silencios: {result.stderr}")
-            except Exception as proc_err:
-                logger.warning(f"⚠️ Error removiendo silencios: {proc_err}")
+        audio_service.check_length(request.headers.get("content-length"))
+    except AudioTooLarge:
+        raise HTTPException(status_code=413, detail="Grabación demasiado grande")
+    
+    if case_id and not await audio_service.case_exists(case_id):
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    
+    content_type = request.headers.get("content-type", "")
+    stored = None
+    spooled = None
+    try:
+        if content_type.lower().startswith("multipart/"):
+            upload = MultipartUpload(request.stream(), content_type)
+            await upload.open()
+            chunks, file_type = upload.chunks(), upload.content_type
+        else:
+            chunks, file_type = request.stream(), content_type
         
-        # Transcribir
-        text = await speech_service.transcribe_file(final_path)
+        if case_id:
+            stored = await audio_service.store(chunks, case_id, audio_service.extension_for(file_type))
+        else:
+            spooled = await audio_service.spool(chunks)
+    except AudioTooLarge:
+        raise HTTPException(status_code=413, detail="Grabación demasiado grande")
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if stored and not await audio_service.attach(case_id, stored, user_id=user["sub"] if user else None):
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+    
+    try:
+        # Decodificación CPU-bound fuera del event loop
+        source = str(stored.path) if stored else spooled
+        pcm = await asyncio.to_thread(audio_service.load_pcm, source)
         
-        # Limpiar
-        os.unlink(final_path)
+        text = await speech_service.transcribe_pcm(pcm) if pcm.size else ""
         
-        return {
+        result = {
             "text": text,
             "mode": speech_service.get_current_mode()
         }
+        if stored:
+            result["hash_audio"] = stored.sha256
+        return result
         
     except Exception as e:
         logger.error(f"Error en transcripción: {e}")
@@ -113,15 +103,24 @@ async def transcribe_audio(file: UploadFile = File(...)):
             status_code=500,
             content={"error": str(e)}
         )
+    finally:
+        if spooled:
+            spooled.close()
 
 
 @router.websocket("/stream")
 async def websocket_stream(websocket: WebSocket):
-    """WebSocket para transcripción en tiempo real."""
+    """
+    WebSocket para transcripción en tiempo real.
+    Mensajes de texto: comandos (stop, pause, resume). Mensajes binarios:
+    audio PCM 16-bit little-endian, 16 kHz mono (dictado con Whisper local).
+    """
     
     await websocket.accept()
     logger.info("Cliente WebSocket conectado")
     
+    stream = None
+    paused = False
     try:
         # Callbacks para enviar al cliente
         async def on_partial(text: str):
@@ -143,22 +142,36 @@ async def websocket_stream(websocket: WebSocket):
             })
         
         # Iniciar reconocimiento
-        await speech_service.start_streaming(
+        stream = await speech_service.start_streaming(
             on_partial=on_partial,
             on_final=on_final,
             on_error=on_error
         )
         
-        # Mantener conexión y escuchar comandos
+        # Mantener conexión: audio (binario) y comandos (texto)
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            if message.get("bytes") is not None:
+                if stream and not paused:
+                    await stream.feed(message["bytes"])
+                continue
             
+            data = message.get("text")
             if data == "stop":
+                if stream:
+                    # Transcribir la última frase antes de cerrar
+                    await stream.close()
+                    stream = None
                 await speech_service.stop_streaming()
                 break
             elif data == "pause":
+                paused = True
                 await speech_service.pause_streaming()
             elif data == "resume":
+                paused = False
                 await speech_service.resume_streaming()
                 
     except WebSocketDisconnect:
@@ -166,4 +179,6 @@ async def websocket_stream(websocket: WebSocket):
     except Exception as e:
         logger.error(f"Error en WebSocket: {e}")
     finally:
+        if stream:
+            await stream.close(flush=False)
         await speech_service.stop_streaming()
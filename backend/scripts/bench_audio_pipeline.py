@@ -0,0 +1,151 @@
+"""
+Benchmark: preprocesamiento de audio para transcripción.
+
+Compara el pipeline en proceso (PyAV decodifica + remuestrea a 16 kHz mono,
+compuerta de silencio NumPy, PCM directo al ASR) con la cadena anterior de
+subprocesos (archivo temporal -> ffmpeg a WAV -> ffmpeg silenceremove ->
+leer el WAV final). Genera un dictado sintético webm/Opus (tramos de "voz"
+separados por pausas) y mide tiempo total y pico de memoria (RSS) de cada
+variante en un proceso aparte.
+
+Uso:
+    python scripts/bench_audio_pipeline.py [minutos]
+"""
+
+import sys
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+RATE = 48000  # webm/Opus del navegador
+VOICE_SECONDS = 4.0
+PAUSE_SECONDS = 2.0
+
+
+def generate_dictation(path: str, minutes: float):
+    """Dictado sintético: tonos modulados con ruido (voz) y ruido de fondo (pausas)."""
+    import av
+
+    rng = np.random.default_rng(0)
+    with av.open(path, mode="w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=RATE, layout="mono")
+        t = 0.0
+        total = minutes * 60
+        pts = 0
+        while t < total:
+            for seconds, voiced in ((VOICE_SECONDS, True), (PAUSE_SECONDS, False)):
+                n = int(seconds * RATE)
+                x = np.arange(n) / RATE
+                if voiced:
+                    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * x)
+                    signal = 0.3 * envelope * (np.sin(2 * np.pi * 180 * x) + 0.5 * np.sin(2 * np.pi * 900 * x))
+                    signal += 0.01 * rng.standard_normal(n)
+                else:
+                    signal = 0.001 * rng.standard_normal(n)
+                frame = av.AudioFrame.from_ndarray(signal.astype(np.float32).reshape(1, -1), format="flt", layout="mono")
+                frame.rate = RATE
+                frame.pts = pts
+                pts += n
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+            t += VOICE_SECONDS + PAUSE_SECONDS
+        for packet in stream.encode(None):
+            container.mux(packet)
+
+
+def peak_rss_mb() -> float:
+    """Pico de RSS de este proceso y sus hijos (ffmpeg), en MB."""
+    import resource
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / scale
+
+
+def run_pyav(path: str) -> dict:
+    from services.audio_service import audio_service
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        pcm = audio_service.load_pcm(f)
+    return {"seconds": time.perf_counter() - start, "samples": len(pcm)}
+
+
+def run_ffmpeg(path: str) -> dict:
+    """Cadena anterior de /api/transcription/transcribe."""
+    import wave
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        content = f.read()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".webm") as tmp:
+        tmp.write(content)
+        tmp_path = tmp.name
+
+    wav_path = tmp_path.replace(".webm", ".wav")
+    subprocess.run([
+        "ffmpeg", "-y", "-i", tmp_path, "-acodec", "pcm_s16le", "-ar", "16000", "-ac", "1", wav_path
+    ], capture_output=True, check=True)
+    os.unlink(tmp_path)
+
+    processed_path = wav_path.replace(".wav", "_processed.wav")
+    subprocess.run([
+        "ffmpeg", "-y", "-i", wav_path,
+        "-af", "silenceremove=stop_periods=-1:stop_duration=0.5:stop_threshold=-40dB",
+        "-ar", "16000", "-ac", "1", processed_path
+    ], capture_output=True, check=True)
+    os.unlink(wav_path)
+
+    # El motor de ASR lee el WAV final a memoria
+    with wave.open(processed_path, "rb") as wav:
+        pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2").astype(np.float32) / 32768
+    os.unlink(processed_path)
+    return {"seconds": time.perf_counter() - start, "samples": len(pcm)}
+
+
+def child(variant: str, path: str):
+    result = run_pyav(path) if variant == "pyav" else run_ffmpeg(path)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def main(minutes: float):
+    workdir = tempfile.mkdtemp(prefix="bench_audio_")
+    path = os.path.join(workdir, "dictado.webm")
+    print(f"[INFO] Generando dictado sintético de {minutes:g} min...")
+    generate_dictation(path, minutes)
+    print(f"[INFO] {os.path.getsize(path) / 1024 / 1024:.1f} MB webm/Opus\n")
+
+    variants = ["pyav"]
+    if shutil.which("ffmpeg"):
+        variants.append("ffmpeg")
+    else:
+        print("[WARNING] ffmpeg no está en el PATH: se omite la cadena de subprocesos\n")
+
+    print(f"{'variante':>8} | {'tiempo':>8} | {'RSS pico':>9} | audio resultante")
+    for variant in variants:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", variant, path],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(out)
+        print(f"{variant:>8} | {result['seconds']:7.2f}s | {result['peak_rss_mb']:7.0f}MB | "
+              f"{result['samples'] / 16000 / 60:.1f} min")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    print("\n[OK] Benchmark completado")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+    else:
+        main(float(sys.argv[1]) if len(sys.argv) > 1 else 30)
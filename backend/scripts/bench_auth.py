@@ -0,0 +1,120 @@
+"""
+Benchmark: throughput de verificación de sesión.
+
+Compara la verificación anterior (JOIN sessions/users en SQLite por cada
+llamada a /api/auth/me) con la verificación de tokens firmados en proceso
+(firma + expiración + lista de revocación), con N sesiones activas.
+
+Uso:
+    python scripts/bench_auth.py [n_sessions]
+"""
+
+import asyncio
+import sys
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Base temporal antes de importar core
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_auth_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from core.database import init_db, DATABASE_PATH, DatabasePool
+from core.security import create_access_token, verify_token, revocation_list
+
+CHECKS = 20_000
+
+
+async def seed_sessions(n: int) -> list:
+    """Recrea la tabla sessions anterior con n sesiones activas."""
+    expires_at = (datetime.now() + timedelta(hours=8)).isoformat()
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.execute("""
+            CREATE TABLE sessions (
+                token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await db.executemany(
+            "INSERT INTO users (id, username, password_hash, full_name, role) VALUES (?, ?, 'x', ?, 'medico')",
+            [(f"user{i}", f"user{i}", f"Usuario {i}") for i in range(100)]
+        )
+        tokens = [f"token{i:08d}" for i in range(n)]
+        await db.executemany(
+            "INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)",
+            [(token, f"user{i % 100}", expires_at) for i, token in enumerate(tokens)]
+        )
+        await db.commit()
+    return tokens
+
+
+async def check_table(db, token: str) -> dict:
+    """Verificación anterior: una consulta por llamada."""
+    cursor = await db.execute(
+        """SELECT s.user_id, s.expires_at, u.username, u.full_name, u.role
+           FROM sessions s
+           JOIN users u ON s.user_id = u.id
+           WHERE s.token = ?""",
+        (token,)
+    )
+    row = await cursor.fetchone()
+    if datetime.fromisoformat(row[1]) < datetime.now():
+        raise ValueError("expirado")
+    return {"user_id": row[0], "username": row[2], "full_name": row[3], "role": row[4]}
+
+
+async def main(n: int):
+    await init_db()
+    print(f"[INFO] Sembrando {n} sesiones...")
+    table_tokens = await seed_sessions(n)
+
+    signed_tokens = [create_access_token(f"user{i}", f"user{i}", f"Usuario {i}", "medico")[0] for i in range(100)]
+
+    # Lista de revocación realista: 10% de las sesiones cerradas
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        exp = int(time.time()) + 8 * 3600
+        await db.executemany(
+            "INSERT INTO revoked_tokens (jti, expires_at) VALUES (?, ?)",
+            [(f"{i:016x}", exp) for i in range(n // 10)]
+        )
+        await db.commit()
+        await revocation_list.load(db)
+
+    rng = random.Random(42)
+    pool = DatabasePool(DATABASE_PATH, readers=1)
+    await pool.open()
+    try:
+        async with pool.reader() as db:
+            sample = [rng.choice(table_tokens) for _ in range(CHECKS)]
+            start = time.perf_counter()
+            for token in sample:
+                await check_table(db, token)
+            table_elapsed = time.perf_counter() - start
+    finally:
+        await pool.close()
+
+    sample = [rng.choice(signed_tokens) for _ in range(CHECKS)]
+    start = time.perf_counter()
+    for token in sample:
+        await verify_token(token)
+    signed_elapsed = time.perf_counter() - start
+
+    print(f"\n[OK] Tabla sessions (JOIN): {CHECKS / table_elapsed:10.0f} verificaciones/s "
+          f"({table_elapsed / CHECKS * 1e6:.1f} µs c/u)")
+    print(f"[OK] Token firmado:         {CHECKS / signed_elapsed:10.0f} verificaciones/s "
+          f"({signed_elapsed / CHECKS * 1e6:.1f} µs c/u, {len(revocation_list)} revocados)")
+    print(f"[INFO] Aceleración: x{table_elapsed / signed_elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    n_sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(n_sessions))
@@ -0,0 +1,117 @@
+"""
+Benchmark: latencia por request con conexión nueva vs pool de conexiones.
+
+Compara el comportamiento anterior de get_db (aiosqlite.connect + close en
+cada request) contra el pool de larga vida (WAL + PRAGMAs + caché de
+sentencias). Usa una base temporal para no tocar data/forensia.db.
+
+Uso:
+    python scripts/bench_db_pool.py [n_requests]
+"""
+
+import asyncio
+import sys
+import os
+import json
+import tempfile
+import time
+import statistics
+
+# Base temporal antes de importar core (settings se lee al importar)
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_db_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from core.database import init_db, DATABASE_PATH, DatabasePool
+
+N_CASES = 2000
+
+
+async def seed():
+    await init_db()
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        section = json.dumps({"fallecido": {"nombre": "NN", "edad": 40, "sexo": "M"}})
+        await db.executemany(
+            "INSERT INTO cases (id, protocol_number, created_at, status, datos_generales) VALUES (?, ?, ?, ?, ?)",
+            [
+                (f"case{i:06d}", f"P-{i:06d}", f"2026-01-01T00:{i % 60:02d}:00", "borrador", section)
+                for i in range(N_CASES)
+            ]
+        )
+        await db.commit()
+
+
+async def request_read(db, i):
+    cursor = await db.execute(
+        "SELECT id, protocol_number, status, datos_generales FROM cases WHERE id = ?",
+        (f"case{i % N_CASES:06d}",)
+    )
+    await cursor.fetchone()
+
+
+async def request_write(db, i):
+    await db.execute(
+        "UPDATE cases SET updated_at = ? WHERE id = ?",
+        (str(i), f"case{i % N_CASES:06d}")
+    )
+    await db.commit()
+
+
+async def bench_per_request(n, op):
+    """Comportamiento anterior: abrir y cerrar conexión en cada request."""
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        db = await aiosqlite.connect(DATABASE_PATH)
+        db.row_factory = aiosqlite.Row
+        try:
+            await op(db, i)
+        finally:
+            await db.close()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def bench_pool(pool, n, op, writer=False):
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        ctx = pool.writer() if writer else pool.reader()
+        async with ctx as db:
+            await op(db, i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label, timings):
+    ms = sorted(t * 1000 for t in timings)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(f"  {label:<32} media={statistics.mean(ms):7.3f} ms  p50={statistics.median(ms):7.3f} ms  p95={p95:7.3f} ms")
+
+
+async def main(n):
+    print(f"[INFO] Base temporal: {DATABASE_PATH}")
+    await seed()
+    print(f"[INFO] {N_CASES} casos insertados, {n} requests por escenario\n")
+
+    print("Lectura (SELECT por id):")
+    report("conexión por request", await bench_per_request(n, request_read))
+    pool = DatabasePool(DATABASE_PATH, readers=4)
+    await pool.open()
+    try:
+        report("pool (lector)", await bench_pool(pool, n, request_read))
+
+        print("\nEscritura (UPDATE + commit):")
+        report("conexión por request", await bench_per_request(n, request_write))
+        report("pool (escritor, WAL+NORMAL)", await bench_pool(pool, n, request_write, writer=True))
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(n_requests))
@@ -0,0 +1,118 @@
+"""
+Benchmark: throughput de la exportación masiva FHIR (NDJSON gzip).
+
+Crea N casos con secciones v2.0 en una base temporal, ejecuta una
+exportación $export completa y reporta reportes/minuto, tamaño de los
+archivos y latencia del event loop durante la exportación. Compara con
+armar los reportes uno por uno como la exportación individual.
+
+Uso:
+    python scripts/bench_fhir_export.py [n_casos]
+"""
+
+import asyncio
+import sys
+import os
+import gzip
+import json
+import statistics
+import tempfile
+import time
+
+# Base y exports temporales antes de importar core
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_fhir_")
+os.environ["CORONERIA_EXPORTS"] = tempfile.mkdtemp(prefix="bench_fhir_exports_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from core.database import init_db, DATABASE_PATH, db_pool
+from services.document_service import DocumentService, FHIR_REPORT_SQL
+from services.fhir_export_service import fhir_export_service
+
+SINGLE_SAMPLE = 2_000
+
+
+async def seed(n: int):
+    datos = json.dumps({
+        "numero_informe": "2026-000123", "fecha_informe": "2026-01-15",
+        "fallecido": {"nombre": "Juan", "apellido_paterno": "Pérez", "apellido_materno": "Quispe", "edad": 45},
+    })
+    causas = json.dumps({"diagnostico_presuntivo": {
+        "causa_final": {"texto": "Edema pulmonar", "cie10": "J81"},
+        "causa_basica": {"texto": "Cardiopatía isquémica", "cie10": "I25.9"},
+    }})
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.executemany(
+            """INSERT INTO cases (id, protocol_number, created_at, updated_at, status, datos_generales, causas_muerte)
+               VALUES (?, ?, ?, ?, 'completado', ?, ?)""",
+            [
+                (f"case{i:07d}", f"P-{i:07d}", "2026-01-01", f"2026-01-01T00:00:00.{i:07d}", datos, causas)
+                for i in range(n)
+            ]
+        )
+        await db.commit()
+
+
+async def loop_lag(stop: asyncio.Event) -> list:
+    """Retraso del event loop muestreado cada 10 ms."""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - start - 0.01) * 1000)
+    return lags
+
+
+async def bench_single(n: int) -> float:
+    """Reportes/s armados uno por uno (una consulta + un documento por caso)."""
+    service = DocumentService()
+    async with db_pool.reader() as db:
+        start = time.perf_counter()
+        for i in range(n):
+            cursor = await db.execute(f"SELECT {FHIR_REPORT_SQL} FROM cases WHERE id = ?", (f"case{i:07d}",))
+            json.dumps(await service.generate_fhir(f"case{i:07d}", await cursor.fetchone()))
+        return n / (time.perf_counter() - start)
+
+
+async def main(n: int):
+    await init_db()
+    await seed(n)
+    await db_pool.open()
+    print(f"[INFO] {n} casos\n")
+
+    try:
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(loop_lag(stop))
+
+        start = time.perf_counter()
+        job = fhir_export_service.start("bench")
+        await job.task
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        lags = await lag_task
+        if job.status != "done":
+            raise RuntimeError(job.error)
+
+        size = sum((job.directory / f["name"]).stat().st_size for f in job.files)
+        with gzip.open(job.directory / job.files[0]["name"], "rt", encoding="utf-8") as f:
+            json.loads(f.readline())
+
+        single_rate = await bench_single(min(n, SINGLE_SAMPLE))
+    finally:
+        await db_pool.close()
+
+    print(f"  exportados:        {job.exported} en {len(job.files)} archivos ({size / 1024 / 1024:.1f} MB gzip)")
+    print(f"  tiempo:            {elapsed:.2f} s")
+    print(f"  lag event loop:    p50 {statistics.median(lags):.1f} ms, máx {max(lags):.1f} ms")
+    print(f"\n[OK] $export:      {job.exported / elapsed * 60:12,.0f} reportes/min")
+    print(f"[OK] uno por uno:  {single_rate * 60:12,.0f} reportes/min")
+
+
+if __name__ == "__main__":
+    n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(n_cases))
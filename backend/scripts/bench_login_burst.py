@@ -0,0 +1,123 @@
+"""
+Benchmark: latencia de WebSocket durante una ráfaga de logins.
+
+Levanta la aplicación con uvicorn en un puerto local, mantiene un WebSocket
+de eco midiendo el tiempo de ida y vuelta cada 20 ms, y lanza 50 logins
+simultáneos (cambio de turno). Compara bcrypt en el event loop (comportamiento
+anterior) con el pool de hilos acotado de core.security.
+
+Uso:
+    python scripts/bench_login_burst.py
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+import time
+import statistics
+from collections import Counter
+
+# Base temporal antes de importar core
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_login_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt
+import httpx
+import uvicorn
+import websockets
+from fastapi import WebSocket, WebSocketDisconnect
+
+import main
+from routers import auth
+from core.security import password_hasher
+
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}"
+N_LOGINS = 50
+PING_INTERVAL = 0.02
+
+
+class InlineHasher:
+    """bcrypt directo en el event loop (como antes)."""
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+
+async def echo(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        while True:
+            await websocket.send_text(await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+
+
+async def measure_ws(stop: asyncio.Event) -> list:
+    """RTT de un WebSocket de eco mientras dura la ráfaga."""
+    rtts = []
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/bench/echo") as ws:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await ws.send("ping")
+            await ws.recv()
+            rtts.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(PING_INTERVAL)
+    return rtts
+
+
+async def burst(client: httpx.AsyncClient, hasher) -> tuple:
+    auth.password_hasher = hasher
+    stop = asyncio.Event()
+    ws_task = asyncio.create_task(measure_ws(stop))
+    await asyncio.sleep(0.3)  # línea base sin carga
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/api/auth/login", json={"username": f"medico{i}", "password": "clave-segura"})
+        for i in range(N_LOGINS)
+    ])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    rtts = await ws_task
+    return rtts, elapsed, Counter(r.status_code for r in responses)
+
+
+async def main_bench():
+    main.app.add_api_websocket_route("/bench/echo", echo)
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        async with httpx.AsyncClient(base_url=BASE_URL, timeout=60) as client:
+            print(f"[INFO] Registrando {N_LOGINS} usuarios...")
+            for i in range(N_LOGINS):
+                r = await client.post("/api/auth/register", json={
+                    "username": f"medico{i}", "password": "clave-segura", "full_name": f"Médico {i}"
+                })
+                r.raise_for_status()
+
+            print(f"{'modo':<22} | {'RTT p50':>9} | {'RTT p99':>9} | {'RTT máx':>9} | {'ráfaga':>8} | respuestas")
+            for name, hasher in [("bcrypt en event loop", InlineHasher()), ("pool de hilos", password_hasher)]:
+                rtts, elapsed, statuses = await burst(client, hasher)
+                rtts.sort()
+                p99 = rtts[min(len(rtts) - 1, int(len(rtts) * 0.99))]
+                print(f"{name:<22} | {statistics.median(rtts):7.1f}ms | {p99:7.1f}ms | {max(rtts):7.1f}ms | "
+                      f"{elapsed:6.2f}s | {dict(statuses)}")
+    finally:
+        auth.password_hasher = password_hasher
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main_bench())
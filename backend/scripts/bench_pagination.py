@@ -0,0 +1,127 @@
+"""
+Benchmark: latencia por página del listado de casos a medida que crece la tabla.
+
+Mide list_cases (paginación keyset por (created_at, id) sobre índices
+cubrientes) en la primera página y en páginas profundas, y la compara con
+la alternativa LIMIT/OFFSET. Con keyset la latencia por página debe
+mantenerse plana aunque la tabla y la profundidad crezcan.
+
+Uso:
+    python scripts/bench_pagination.py
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+import time
+import statistics
+
+# Base temporal antes de importar core
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_pages_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from core.database import init_db, DATABASE_PATH, DatabasePool
+from routers.cases import list_cases, _encode_cursor
+
+SIZES = [10_000, 50_000, 200_000]
+PAGE_SIZE = 50
+PAGES_WALKED = 40
+
+
+async def grow_to(n_total: int, current: int):
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        rows = [
+            (f"case{i:07d}", f"P-{i:07d}", f"2026-01-01T{(i // 3600) % 24:02d}:{(i // 60) % 60:02d}:{i % 60:02d}.{i:07d}",
+             "borrador", f"user{i % 20}")
+            for i in range(current, n_total)
+        ]
+        await db.executemany(
+            "INSERT INTO cases (id, protocol_number, created_at, status, user_id) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        await db.commit()
+        await db.execute("ANALYZE")
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return (time.perf_counter() - start) * 1000, result
+
+
+async def bench(db):
+    # Primera página
+    first = [
+        (await timed(list_cases(limit=PAGE_SIZE, db=db)))[0]
+        for _ in range(20)
+    ]
+
+    # Recorrido keyset: PAGES_WALKED páginas siguiendo next_cursor
+    keyset = []
+    cursor = None
+    for _ in range(PAGES_WALKED):
+        ms, page = await timed(list_cases(limit=PAGE_SIZE, cursor=cursor, db=db))
+        keyset.append(ms)
+        cursor = page.next_cursor
+
+    # Filtro por usuario (índice idx_cases_user_created)
+    by_user = [
+        (await timed(list_cases(user_id="user7", limit=PAGE_SIZE, db=db)))[0]
+        for _ in range(20)
+    ]
+
+    # Página a mitad de la tabla: keyset (cursor) vs OFFSET
+    c = await db.execute("SELECT COUNT(*) FROM cases")
+    middle = (await c.fetchone())[0] // 2
+    c = await db.execute(
+        "SELECT created_at, id FROM cases ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+        (middle - 1,)
+    )
+    created_at, case_id = await c.fetchone()
+    mid_cursor = _encode_cursor(created_at, case_id)
+    keyset_mid = [
+        (await timed(list_cases(limit=PAGE_SIZE, cursor=mid_cursor, db=db)))[0]
+        for _ in range(5)
+    ]
+
+    offset = []
+    for _ in range(5):
+        start = time.perf_counter()
+        c = await db.execute(
+            """SELECT id, protocol_number, status, created_at, updated_at FROM cases
+               WHERE status != 'deleted' ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?""",
+            (PAGE_SIZE, middle)
+        )
+        await c.fetchall()
+        offset.append((time.perf_counter() - start) * 1000)
+
+    return first, keyset, by_user, keyset_mid, offset
+
+
+async def main():
+    await init_db()
+    current = 0
+    print(f"{'filas':>8} | {'1ª página':>10} | {'keyset p50':>10} | {'keyset máx':>10} | {'por usuario':>11} | {'mitad keyset':>12} | {'mitad OFFSET':>12}")
+    for size in SIZES:
+        await grow_to(size, current)
+        current = size
+        pool = DatabasePool(DATABASE_PATH, readers=1)
+        await pool.open()
+        try:
+            async with pool.reader() as db:
+                first, keyset, by_user, keyset_mid, offset = await bench(db)
+        finally:
+            await pool.close()
+        print(f"{size:>8} | {statistics.median(first):8.3f}ms | {statistics.median(keyset):8.3f}ms | "
+              f"{max(keyset):8.3f}ms | {statistics.median(by_user):9.3f}ms | "
+              f"{statistics.median(keyset_mid):10.3f}ms | {statistics.median(offset):10.3f}ms")
+
+
+if __name__ == "__main__":
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+"""
+Benchmark: renders de PDF por segundo según el número de procesos.
+
+Encola N renders del protocolo de ejemplo en RenderService con 1, 2, 4...
+procesos y mide el throughput, además de la latencia del event loop
+mientras los renders corren (debe mantenerse en ~0 ms). Al final compara
+la primera exportación de un caso con su reimpresión (caché de PDFs).
+
+Uso:
+    python scripts/bench_render.py [n_renders]
+"""
+
+import asyncio
+import sys
+import os
+import tempfile
+import time
+import statistics
+from pathlib import Path
+
+# Exports temporales antes de importar core
+os.environ["CORONERIA_EXPORTS"] = tempfile.mkdtemp(prefix="bench_render_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.document_service import DocumentService, EXPORTS_DIR
+from services.render_service import RenderService, render_service
+
+SAMPLE_CASE = {
+    "datos_administrativos": {
+        "protocolo_numero": "2026-000123",
+        "nombre_fallecido": "NN",
+        "edad": "45",
+        "sexo": "Masculino",
+        "fecha_necropsia": "2026-01-15",
+    },
+    "fenomenos_cadavericos": {
+        "campo_25_livideces": "Dorsales, fijas",
+        "campo_26_rigidez": "Generalizada",
+        "campo_33_tiempo_muerte": "12 a 18 horas",
+    },
+    "examen_externo": {"campo_36_talla": "170", "campo_37_peso": "72"},
+    "examen_interno": {
+        "campo_60_pulmon_derecho": "Congestivo, edematoso",
+        "peso_pulmon_derecho": "650",
+        "campo_63_corazon": "Sin alteraciones macroscópicas",
+        "peso_corazon": "340",
+    },
+    "conclusiones": {"causa_final": "Edema pulmonar", "codigo_cie10": "J81"},
+}
+
+WORKER_COUNTS = [1, 2, 4, os.cpu_count() or 1]
+
+
+async def loop_lag(stop: asyncio.Event) -> list:
+    """Retraso del event loop muestreado cada 10 ms."""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - start - 0.01) * 1000)
+    return lags
+
+
+async def bench(workers: int, n: int, html: str) -> tuple:
+    service = RenderService(workers, max_pending=n, job_ttl=60)
+    try:
+        # Calentar: arrancar los procesos e importar WeasyPrint
+        warmup = [service.submit("warmup", html, EXPORTS_DIR / f"warmup_{i}.pdf") for i in range(workers)]
+        for job in warmup:
+            await service.wait(job)
+        if any(job.status != "done" for job in warmup):
+            raise RuntimeError(warmup[0].error)
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(loop_lag(stop))
+
+        start = time.perf_counter()
+        jobs = [service.submit(f"case{i}", html, EXPORTS_DIR / f"w{workers}_{i}.pdf") for i in range(n)]
+        for job in jobs:
+            await service.wait(job)
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        lags = await lag_task
+        failed = sum(1 for job in jobs if job.status != "done")
+        return n / elapsed, statistics.median(lags), max(lags), failed
+    finally:
+        service.shutdown()
+
+
+async def bench_reprint() -> tuple:
+    """Primera exportación (render) vs reimpresión (caché) del mismo caso."""
+    service = DocumentService()
+    try:
+        start = time.perf_counter()
+        await service.generate_pdf("reprint", SAMPLE_CASE)
+        first = (time.perf_counter() - start) * 1000
+
+        reprints = []
+        for _ in range(20):
+            start = time.perf_counter()
+            await service.generate_pdf("reprint", SAMPLE_CASE)
+            reprints.append((time.perf_counter() - start) * 1000)
+        return first, statistics.median(reprints)
+    finally:
+        render_service.shutdown()
+
+
+async def main(n: int):
+    html = DocumentService()._build_html(SAMPLE_CASE)
+    print(f"[INFO] {n} renders por configuración, {os.cpu_count()} CPUs\n")
+    print(f"{'procesos':>8} | {'renders/s':>9} | {'lag p50':>8} | {'lag máx':>8} | errores")
+    for workers in sorted(set(WORKER_COUNTS)):
+        rate, lag_p50, lag_max, failed = await bench(workers, n, html)
+        print(f"{workers:>8} | {rate:9.2f} | {lag_p50:6.1f}ms | {lag_max:6.1f}ms | {failed}")
+
+    first, reprint = await bench_reprint()
+    print(f"\n[OK] Primera exportación: {first:.0f} ms (incluye arranque del pool)")
+    print(f"[OK] Reimpresión (caché): {reprint:.2f} ms")
+
+
+if __name__ == "__main__":
+    n_renders = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(n_renders))
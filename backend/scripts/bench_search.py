@@ -0,0 +1,117 @@
+"""
+Benchmark: búsqueda FTS5 sobre un corpus sintético de protocolos.
+
+Genera N casos (por defecto 100k) en una base temporal, con transcripción
+y texto libre en varias secciones, y mide la latencia de /api/cases/search
+(SearchService.search) para consultas típicas. Objetivo: < ~50 ms.
+
+Uso:
+    python scripts/bench_search.py [n_cases]
+"""
+
+import asyncio
+import sys
+import os
+import json
+import random
+import tempfile
+import time
+import statistics
+
+# Base temporal antes de importar core
+os.environ["CORONERIA_DATA"] = tempfile.mkdtemp(prefix="bench_search_")
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from core.database import init_db, DATABASE_PATH, DatabasePool
+from services.search_service import SearchService
+
+ORGANOS = ["hígado", "bazo", "pulmón derecho", "pulmón izquierdo", "corazón", "encéfalo", "riñón", "páncreas"]
+HALLAZGOS = ["congestivo", "edematoso", "laceración", "hematoma", "equimosis", "antracosis",
+             "hemorragia subaracnoidea", "contusión", "petequias", "atelectasia"]
+ETIOLOGIAS = ["HOMICIDA", "SUICIDA", "ACCIDENTAL", "NATURAL", "INDETERMINADA"]
+
+# Términos comunes (aparecen en ~50% del corpus: peor caso para bm25) y selectivos
+QUERIES = ["higado", "hemorragia subaracnoidea", "laceracion bazo", "petequ", "corazon edematoso",
+           "subdural", "P-0004"]
+
+
+def fake_case(i: int, rng: random.Random):
+    frases = [
+        f"{rng.choice(ORGANOS)} {rng.choice(HALLAZGOS)} de {rng.randint(100, 1800)} gramos"
+        for _ in range(rng.randint(3, 8))
+    ]
+    if rng.random() < 0.01:
+        frases.append("hematoma subdural agudo")
+    return (
+        f"case{i:07d}",
+        f"P-{i:07d}",
+        f"2026-01-01T00:00:{i % 60:02d}",
+        "borrador",
+        ". ".join(frases),
+        json.dumps({"descripcion": rng.choice(HALLAZGOS) + " en " + rng.choice(ORGANOS)}, ensure_ascii=False),
+        json.dumps({"diagnostico_presuntivo": {"etiologia": {"forma": rng.choice(ETIOLOGIAS)}}}),
+    )
+
+
+async def seed(n: int):
+    await init_db()
+    rng = random.Random(42)
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        batch = []
+        for i in range(n):
+            batch.append(fake_case(i, rng))
+            if len(batch) == 5000:
+                await db.executemany(
+                    """INSERT INTO cases (id, protocol_number, created_at, status, transcript_raw,
+                                          lesiones_traumaticas, causas_muerte)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    batch
+                )
+                batch = []
+        if batch:
+            await db.executemany(
+                """INSERT INTO cases (id, protocol_number, created_at, status, transcript_raw,
+                                      lesiones_traumaticas, causas_muerte)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                batch
+            )
+        await db.commit()
+
+
+async def main(n: int):
+    print(f"[INFO] Base temporal: {DATABASE_PATH}")
+    start = time.perf_counter()
+    await seed(n)
+    print(f"[INFO] {n} casos indexados en {time.perf_counter() - start:.1f}s\n")
+
+    service = SearchService()
+    pool = DatabasePool(DATABASE_PATH, readers=1)
+    await pool.open()
+    try:
+        async with pool.reader() as db:
+            for q in QUERIES:
+                timings = []
+                for _ in range(20):
+                    t0 = time.perf_counter()
+                    results = await service.search(db, q, limit=20)
+                    timings.append((time.perf_counter() - t0) * 1000)
+                cursor = await db.execute(
+                    "SELECT COUNT(*) FROM cases_fts WHERE cases_fts MATCH ?",
+                    (service.build_match(q),)
+                )
+                matches = (await cursor.fetchone())[0]
+                status = "OK" if statistics.median(timings) < 50 else "LENTO"
+                print(f"  [{status}] {q!r:<28} p50={statistics.median(timings):7.2f} ms  "
+                      f"max={max(timings):7.2f} ms  coincidencias={matches}  resultados={len(results)}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(n_cases))
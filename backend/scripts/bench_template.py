@@ -0,0 +1,107 @@
+"""
+Micro-benchmark: tiempo de render de un protocolo por fase.
+
+Separa el render de un PDF en:
+  - plantilla: datos del caso -> HTML (plantilla precompilada)
+  - layout:    HTML -> documento maquetado (WeasyPrint)
+  - escritura: documento -> bytes PDF
+y compara el layout con hoja de estilos y fuentes reutilizadas (como en los
+procesos de render) contra el CSS embebido en el HTML re-parseado en cada
+render, como se hacía antes.
+
+Uso:
+    python scripts/bench_template.py [repeticiones]
+"""
+
+import sys
+import os
+import time
+import statistics
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import render_service
+from services.protocol_template import render_protocol, STYLESHEET
+
+ORGANO = {
+    "presencia": "si", "lesiones": "no", "peso": 350,
+    "medidas": {"largo": 12, "ancho": 9, "alto": 4},
+    "descripcion": "Superficie lisa, al corte parénquima congestivo sin lesiones focales.",
+}
+
+SAMPLE_CASE = {
+    "datos_generales": {
+        "numero_informe": "2026-000123",
+        "fecha_informe": "2026-01-15",
+        "fallecido": {"nombre": "Juan", "apellido_paterno": "Pérez", "apellido_materno": "Quispe",
+                      "sexo": "M", "edad": 45, "nacionalidad": "Peruana", "estado_civil": "Casado"},
+        "lugar_fallecimiento": "Vía pública",
+        "prendas": [{"tipo": "Camisa", "color": "Azul", "material": "Algodón", "descripcion": "Manchada"}] * 4,
+        "circunstancias_muerte": "Encontrado sin vida en la vía pública. " * 5,
+    },
+    "fenomenos_cadavericos": {
+        "livideces": {"ubicacion": ["dorsales"], "estado": "no_modificable", "observaciones": "Violáceas"},
+        "rigidez": {"ubicacion": ["mandibula", "miembros_superiores"], "estado": "instalado"},
+        "temperatura": {"ambiental": 18, "rectal": 29.5, "hepatica": 30},
+        "tiempo_muerte_horas": "12 a 18",
+    },
+    "examen_externo": {"piel": "Pálida", "cabeza": "Sin lesiones", "torax": "Simétrico"},
+    "examen_interno_cabeza": {"encefalo": {**ORGANO, "peso": 1350}},
+    "examen_interno_torax": {
+        "pulmones": {"derecho": {**ORGANO, "peso": 650}, "izquierdo": {**ORGANO, "peso": 600}},
+        "corazon": {**ORGANO, "valvulas": {"aortica_mm": 70, "mitral_mm": 90}},
+    },
+    "examen_interno_abdomen": {"higado": {**ORGANO, "peso": 1500}, "bazo": ORGANO, "pancreas": ORGANO,
+                               "rinones": {"derecho": ORGANO, "izquierdo": ORGANO}},
+    "lesiones_traumaticas": {"descripcion": "Equimosis violácea en región frontal de 3 x 2 cm. " * 10},
+    "causas_muerte": {
+        "diagnostico_presuntivo": {
+            "causa_final": {"texto": "Edema pulmonar", "cie10": "J81"},
+            "causa_basica": {"texto": "Cardiopatía isquémica", "cie10": "I25.9"},
+            "etiologia": {"forma": "NATURAL"},
+        },
+        "conclusiones": "Muerte de etiología natural.",
+    },
+}
+
+
+def timed(fn, repeat: int) -> tuple:
+    result = None
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main(repeat: int):
+    from weasyprint import HTML
+
+    template_ms, html = timed(lambda: render_protocol(SAMPLE_CASE), repeat * 20)
+    print(f"[INFO] HTML: {len(html)} caracteres, {repeat} repeticiones\n")
+
+    # Preparar hoja de estilos y fuentes (una vez por proceso de render)
+    start = time.perf_counter()
+    render_service._init_worker()
+    init_ms = (time.perf_counter() - start) * 1000
+
+    layout_ms, document = timed(lambda: render_service._layout(html), repeat)
+    write_ms, pdf = timed(lambda: document.write_pdf(), repeat)
+
+    # Antes: <style> embebido, CSS y fuentes resueltos en cada render
+    inline_html = html.replace("<head>", f"<head><style>{STYLESHEET}</style>", 1)
+    inline_layout_ms, _ = timed(lambda: HTML(string=inline_html).render(), repeat)
+
+    print(f"  plantilla:                   {template_ms:8.3f} ms")
+    print(f"  layout (CSS/fuentes en caché): {layout_ms:6.1f} ms")
+    print(f"  escritura PDF:               {write_ms:8.1f} ms   ({len(pdf) / 1024:.0f} KB)")
+    print(f"  total por render:            {template_ms + layout_ms + write_ms:8.1f} ms")
+    print(f"\n  preparación por proceso:     {init_ms:8.1f} ms (una sola vez)")
+    print(f"  layout con <style> embebido: {inline_layout_ms:8.1f} ms")
+    print(f"\n[OK] Ahorro de layout por render: {inline_layout_ms - layout_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,89 @@
+"""
+Benchmark: latencia del dictado en vivo con Whisper local.
+
+Reproduce una grabación (cualquier formato que lea PyAV) como si viniera
+del micrófono: la convierte a PCM 16 kHz mono y la envía a una sesión de
+dictado (la misma que usa el WebSocket /api/transcription/stream) en
+frames de 20 ms al ritmo real. Mide, por frase, el tiempo desde la última
+ventana con voz hasta el mensaje final, y cuenta los parciales enviados.
+
+Uso:
+    python scripts/bench_whisper_stream.py <grabacion> [velocidad]
+
+velocidad > 1 envía el audio más rápido que el tiempo real.
+"""
+
+import asyncio
+import sys
+import os
+import time
+import statistics
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.audio_service import audio_service, to_int16, SAMPLE_RATE
+from services.model_registry import whisper_models
+from services.speech_service import SpeechService
+
+FRAME_MS = 20
+
+
+async def main(path: str, speed: float):
+    pcm = audio_service.load_pcm(path, trim_silence=False)
+    data = to_int16(pcm).tobytes()
+    print(f"[INFO] {len(pcm) / SAMPLE_RATE:.1f}s de audio, velocidad x{speed:g}")
+
+    service = SpeechService()
+    await whisper_models.get()
+    state = whisper_models.status()["models"][whisper_models.default]
+    print(f"[INFO] Modelo {whisper_models.default}: carga {state['load_seconds']}s, "
+          f"calentamiento {state['warmup_seconds']}s ({state['device']}/{state['compute_type']})")
+
+    messages = []
+
+    async def on_partial(text: str):
+        messages.append(("partial", time.perf_counter(), text))
+
+    async def on_final(text: str):
+        messages.append(("final", time.perf_counter(), text))
+        print(f"  [final] {text}")
+
+    async def on_error(error: str):
+        print(f"[ERROR] {error}")
+
+    stream = await service._start_whisper_streaming(on_partial, on_final, on_error)
+    if stream is None:
+        return
+
+    frame_bytes = SAMPLE_RATE * FRAME_MS // 1000 * 2
+    interval = FRAME_MS / 1000 / speed
+    start = time.perf_counter()
+    for i, offset in enumerate(range(0, len(data), frame_bytes)):
+        await stream.feed(data[offset:offset + frame_bytes])
+        # Ritmo de micrófono: esperar hasta el instante de envío del próximo frame
+        delay = start + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await stream.close()
+    elapsed = time.perf_counter() - start
+
+    latencies = stream.final_latencies_ms
+    partials = sum(1 for kind, _, _ in messages if kind == "partial")
+    print(f"\n  frases:         {len(latencies)}")
+    print(f"  parciales:      {partials}")
+    print(f"  tiempo total:   {elapsed:.1f}s")
+    if latencies:
+        ordered = sorted(latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        print(f"\n[OK] Latencia fin de voz -> final: p50 {statistics.median(latencies):.0f} ms, "
+              f"p95 {p95:.0f} ms, máx {max(latencies):.0f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1.0))
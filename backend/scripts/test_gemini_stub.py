@@ -0,0 +1,299 @@
+"""
+Prueba de GeminiService contra un Gemini falso local (gRPC, sin red).
+
+El stub implementa GenerateContent con latencia fija y responde 429
+(RESOURCE_EXHAUSTED) a una fracción de las solicitudes; la API de archivos
+se simula con latencia de red y un ciclo de PROCESSING. Se lanzan a la vez
+extracciones NER, transcripciones y análisis de causa de muerte, y se
+verifica que:
+  - todas terminan pese a los 429 (reintentos con backoff);
+  - el event loop nunca se bloquea (latido cada 50 ms);
+  - la tasa de solicitudes no supera la del limitador (más la ráfaga);
+  - ningún modelo supera GEMINI_MAX_CONCURRENCY en vuelo;
+  - los tres tipos de llamada corren en paralelo;
+  - el mismo audio largo se sube una sola vez y se borra al cerrar;
+  - los clips cortos van inline (se compara la latencia mediana);
+  - con la caché de LLM, repetir una extracción no vuelve al modelo;
+  - análisis idénticos simultáneos comparten una sola llamada.
+
+Uso:
+    python scripts/test_gemini_stub.py [solicitudes_por_tipo]
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import wave
+from collections import defaultdict
+from pathlib import Path
+
+# Configurar path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["GEMINI_API_KEY"] = "stub"
+os.environ["GEMINI_REQUESTS_PER_MINUTE"] = "600"
+os.environ["GEMINI_BURST"] = "5"
+os.environ["GEMINI_MAX_CONCURRENCY"] = "3"
+os.environ["GEMINI_INLINE_AUDIO_MAX_BYTES"] = str(256 * 1024)
+os.environ["LLM_CACHE_ENABLED"] = "false"  # se activa al final, en un directorio temporal
+
+import grpc
+import google.generativeai as genai
+from google.ai import generativelanguage_v1beta as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+    GenerativeServiceGrpcAsyncIOTransport,
+)
+from google.generativeai.types import file_types
+
+from core.config import settings
+import services.gemini_service as gemini_module
+from services.gemini_service import GeminiService, gemini_files, gemini_flight
+from services.llm_cache import llm_cache
+
+LATENCY_SECONDS = 0.3
+ERROR_RATE = 0.2
+UPLOAD_SECONDS = 0.3
+
+# Tiempos de la prueba más cortos que los de producción
+gemini_module.RETRY_BASE_SECONDS = 0.2
+gemini_module.FILE_POLL_SECONDS = 0.5
+
+
+class FakeGemini:
+    """GenerateContent con latencia, 429 aleatorios y registro de concurrencia."""
+
+    def __init__(self, error_rate: float):
+        self.error_rate = error_rate
+        self.rng = random.Random(0)
+        self.in_flight = defaultdict(int)
+        self.max_in_flight = defaultdict(int)
+        self.kinds_in_flight = defaultdict(int)
+        self.overlapped = False  # hubo llamadas de los tres tipos en curso a la vez
+        self.accepted = []       # instante de cada solicitud aceptada
+        self.rejected = 0
+
+    async def generate_content(self, request, context):
+        if self.rng.random() < self.error_rate:
+            self.rejected += 1
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "429 Resource has been exhausted")
+
+        model = request.model
+        parts = [p for c in request.contents for p in c.parts]
+        prompt = " ".join(p.text for p in parts)
+        if any(p.file_data.file_uri or p.inline_data.data for p in parts):
+            kind, text = "transcripcion", "Se observa herida contusa en región parietal."
+        elif "HALLAZGOS" in prompt:
+            kind, text = "causa", json.dumps({"causa_final": "Hemorragia subaracnoidea"})
+        else:
+            kind, text = "ner", json.dumps({"entities": [], "mapped_fields": {"datos_generales.fallecido.edad": 45}})
+
+        self.accepted.append(time.monotonic())
+        self.in_flight[model] += 1
+        self.max_in_flight[model] = max(self.max_in_flight[model], self.in_flight[model])
+        self.kinds_in_flight[kind] += 1
+        self.overlapped |= sum(1 for n in self.kinds_in_flight.values() if n) == 3
+        try:
+            await asyncio.sleep(LATENCY_SECONDS)
+        finally:
+            self.in_flight[model] -= 1
+            self.kinds_in_flight[kind] -= 1
+
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(role="model", parts=[glm.Part(text=text)]),
+            finish_reason=glm.Candidate.FinishReason.STOP,
+        )])
+
+
+async def start_stub(fake: FakeGemini):
+    server = grpc.aio.server()
+    handler = grpc.method_handlers_generic_handler(
+        "google.ai.generativelanguage.v1beta.GenerativeService",
+        {"GenerateContent": grpc.unary_unary_rpc_method_handler(
+            fake.generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize,
+        )},
+    )
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    return server, port
+
+
+class FakeFiles:
+    """API de archivos simulada: subida con latencia, un ciclo PROCESSING."""
+
+    def __init__(self):
+        self.uploads = 0
+        self.deleted = []
+
+    @staticmethod
+    def _file(name: str, state: str) -> file_types.File:
+        return file_types.File(glm.File(
+            name=name, uri=f"https://stub/{name}", mime_type="audio/wav", state=state
+        ))
+
+    def upload_file(self, path, mime_type=None):
+        time.sleep(UPLOAD_SECONDS)  # red simulada: corre en un hilo, no en el loop
+        self.uploads += 1
+        return self._file(f"files/{self.uploads}", "PROCESSING")
+
+    def get_file(self, name):
+        return self._file(name, "ACTIVE")
+
+    def delete_file(self, name):
+        self.deleted.append(name)
+
+
+def write_clip(directory: str, name: str, seconds: float, seed: int) -> str:
+    """WAV 16 kHz mono con ruido (contenido distinto por semilla)."""
+    import numpy as np
+
+    path = os.path.join(directory, name)
+    samples = (np.random.default_rng(seed).standard_normal(int(16000 * seconds)) * 1000).astype("<i2")
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(samples.tobytes())
+    return path
+
+
+async def test_gemini_stub(per_kind: int):
+    fake = FakeGemini(ERROR_RATE)
+    server, port = await start_stub(fake)
+    print(f"[INFO] Gemini falso en 127.0.0.1:{port} (latencia {LATENCY_SECONDS}s, {ERROR_RATE:.0%} de 429)")
+
+    files = FakeFiles()
+    genai.upload_file = files.upload_file
+    genai.get_file = files.get_file
+    genai.delete_file = files.delete_file
+    workdir = tempfile.mkdtemp(prefix="gemini_stub_")
+    long_clip = write_clip(workdir, "largo.wav", 30, seed=0)   # ~940 KB: API de archivos
+    service = GeminiService()
+    client = glm.GenerativeServiceAsyncClient(
+        transport=GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(f"127.0.0.1:{port}"))
+    )
+    service.basic_model._async_client = client
+    service.reasoning_model._async_client = client
+
+    # Calentamiento: la primera llamada abre el canal gRPC e importa perezosamente
+    await service.extract_entities("calentamiento")
+    fake.accepted.clear()
+    fake.rejected = 0
+
+    # Latido: mide el mayor hueco entre ticks (bloqueos del event loop)
+    max_gap = 0.0
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        nonlocal max_gap
+        last = time.monotonic()
+        while not stop.is_set():
+            await asyncio.sleep(0.05)
+            now = time.monotonic()
+            max_gap = max(max_gap, now - last - 0.05)
+            last = now
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.monotonic()
+    calls = []
+    for i in range(per_kind):
+        # Textos distintos: los idénticos se coalescen (ver single flight al final)
+        calls.append(service.extract_entities(f"Paciente masculino de {20 + i} años."))
+        calls.append(service.transcribe_audio(long_clip))
+        calls.append(service.analyze_death_cause(f"Fractura parietal con hematoma epidural de {20 + i} cc."))
+    results = await asyncio.gather(*calls)
+    elapsed = time.monotonic() - start
+    stop.set()
+    await beat
+
+    total = len(results)
+    print(f"[INFO] {total} llamadas en {elapsed:.1f}s, {fake.rejected} respuestas 429 reintentadas")
+
+    ner_ok = all(r["mapped_fields"] for r in results[0::3])
+    transcription_ok = all(r.startswith("Se observa") for r in results[1::3])
+    cause_ok = all(r["causa_final"] for r in results[2::3])
+    assert ner_ok and transcription_ok and cause_ok, "Respuestas incompletas"
+    print("[OK] Todas las llamadas completadas pese a los 429")
+
+    assert max_gap < 0.1, f"Event loop bloqueado {max_gap * 1000:.0f} ms"
+    print(f"[OK] Event loop libre (mayor retraso del latido: {max_gap * 1000:.0f} ms)")
+
+    rate = settings.GEMINI_REQUESTS_PER_MINUTE / 60
+    times = fake.accepted
+    allowed = settings.GEMINI_BURST + rate * (times[-1] - start) + 1
+    assert len(times) + fake.rejected <= allowed, "Se superó la tasa del limitador"
+    print(f"[OK] {len(times) + fake.rejected} solicitudes en {times[-1] - start:.1f}s (máximo permitido {allowed:.0f})")
+
+    assert max(fake.max_in_flight.values()) <= settings.GEMINI_MAX_CONCURRENCY
+    print(f"[OK] Concurrencia máxima por modelo: {dict(fake.max_in_flight)}")
+
+    assert fake.overlapped, "Las llamadas no corrieron en paralelo"
+    print("[OK] Extracción, transcripción y análisis corrieron en paralelo")
+
+    assert files.uploads == 1, f"El mismo audio se subió {files.uploads} veces"
+    print(f"[OK] {per_kind} transcripciones del mismo audio largo: 1 subida")
+
+    # Latencia de clips cortos (5 s): inline vs subida + espera de procesamiento
+    fake.error_rate = 0.0
+    inline_max = settings.GEMINI_INLINE_AUDIO_MAX_BYTES
+    latencies = {}
+    for label, limit in (("subida", 0), ("inline", inline_max)):
+        settings.GEMINI_INLINE_AUDIO_MAX_BYTES = limit
+        times = []
+        for i in range(5):
+            clip = write_clip(workdir, f"{label}_{i}.wav", 5, seed=100 + i + (10 if limit else 0))
+            t0 = time.monotonic()
+            await service.transcribe_audio(clip)
+            times.append(time.monotonic() - t0)
+        latencies[label] = statistics.median(times)
+    settings.GEMINI_INLINE_AUDIO_MAX_BYTES = inline_max
+    print(f"[INFO] Clip de 5 s, latencia mediana: subida {latencies['subida']:.2f}s, inline {latencies['inline']:.2f}s")
+    assert latencies["inline"] < latencies["subida"] / 2
+    print("[OK] Los clips cortos van inline")
+
+    await gemini_files.close()
+    assert len(files.deleted) == files.uploads, f"{files.uploads} subidas, {len(files.deleted)} borradas"
+    print(f"[OK] {len(files.deleted)} archivos remotos borrados al cerrar")
+
+    # Caché de LLM: la repetición (con otros espacios) se sirve sin llamar al modelo
+    llm_cache.path = Path(workdir) / "llm_cache.db"
+    llm_cache.enabled = True
+    text = "Paciente masculino de 45 años.  Hígado de 1500 gramos."
+    requests_before = len(fake.accepted)
+    t0 = time.monotonic()
+    first = await service.extract_entities(text)
+    miss_ms = (time.monotonic() - t0) * 1000
+    t0 = time.monotonic()
+    second = await service.extract_entities(" Paciente masculino de 45 años. Hígado de 1500 gramos.\n")
+    hit_ms = (time.monotonic() - t0) * 1000
+    assert second == first and len(fake.accepted) == requests_before + 1
+    stats = await llm_cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    print(f"[OK] Caché de LLM: fallo {miss_ms:.0f} ms, acierto {hit_ms:.1f} ms (1 sola llamada al modelo)")
+    # Single flight: 5 análisis idénticos a la vez -> 1 llamada al modelo
+    requests_before = len(fake.accepted)
+    coalesced_before = gemini_flight.coalesced
+    findings = "Hemoperitoneo de 1500 cc con laceración hepática grado III."
+    results = await asyncio.gather(*[service.analyze_death_cause(findings) for _ in range(5)])
+    assert len(fake.accepted) == requests_before + 1
+    assert gemini_flight.coalesced - coalesced_before == 4
+    assert all(r == results[0] for r in results) and len({id(r) for r in results}) == 5
+    print(f"[OK] Single flight: 5 análisis simultáneos, 1 llamada ({gemini_flight.stats()})")
+    await llm_cache.close()
+
+    await server.stop(None)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(test_gemini_stub(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
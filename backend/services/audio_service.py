@@ -0,0 +1,399 @@
+"""
+Preprocesamiento de audio en proceso (PyAV + NumPy).
+
+Decodifica cualquier formato que soporte FFmpeg (webm/Opus del navegador,
+wav, mp3...), remuestrea a 16 kHz mono float32 y recorta los silencios con
+una compuerta de energía, todo en streaming y sin archivos intermedios. El
+resultado es el PCM que consumen directamente los motores de ASR.
+
+También guarda las grabaciones como evidencia: la subida se escribe a disco
+en bloques de tamaño fijo mientras se calcula su SHA-256 y se controla el
+tamaño máximo, con memoria constante sea cual sea la duración. Las subidas
+multipart/form-data se leen con un parser incremental (MultipartUpload):
+el límite se aplica a los bytes que llegan, también con Transfer-Encoding
+chunked, sin esperar a que el cuerpo completo quede en un temporal.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import wave
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional, Union
+from uuid import uuid4
+
+import numpy as np
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from core.config import settings
+from core.database import read_connection, refresh_case_hash, write_connection
+from services.audit_service import audit_service
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+AUDIO_DIR = Path(settings.CORONERIA_DATA) / "audio"
+
+AUDIO_EXTENSIONS = {
+    "audio/webm": ".webm",
+    "audio/ogg": ".ogg",
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/wave": ".wav",
+    "audio/mpeg": ".mp3",
+    "audio/mp4": ".m4a",
+    "audio/x-m4a": ".m4a",
+}
+
+# Bloque de audio remuestreado que se pasa a la compuerta (~1 s)
+GATE_BLOCK_SAMPLES = SAMPLE_RATE
+
+
+class SilenceGate:
+    """
+    Compuerta de silencio por energía en ventanas de frame_ms.
+
+    Una ventana es voz si su RMS supera threshold_db (dBFS). Dentro de un
+    silencio se conservan hasta max_silence segundos (para no pegar las
+    frases) y se descarta el resto; el silencio inicial se descarta entero.
+    Mantiene estado entre bloques, así que el audio puede llegar por partes.
+    """
+
+    def __init__(self, rate: int, threshold_db: float, max_silence: float, frame_ms: int = 30):
+        self.frame = rate * frame_ms // 1000
+        self.threshold = 10 ** (threshold_db / 20)
+        self.max_gap = int(max_silence * 1000 / frame_ms)
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._run = self.max_gap + 1  # ventanas desde la última con voz
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """Procesa un bloque; retorna las muestras conservadas (ventanas completas)."""
+        self.samples_in += len(samples)
+        data = np.concatenate((self._pending, samples)) if len(self._pending) else samples
+        n = len(data) // self.frame
+        self._pending = data[n * self.frame:].copy()
+        if n == 0:
+            return data[:0]
+
+        frames = data[:n * self.frame].reshape(n, self.frame)
+        rms = np.sqrt(np.einsum("ij,ij->i", frames, frames) / self.frame)
+        voiced = rms >= self.threshold
+
+        # Ventanas desde la última con voz, continuando la racha del bloque anterior
+        idx = np.arange(n)
+        last_voiced = np.maximum.accumulate(np.where(voiced, idx, -1))
+        run = np.where(last_voiced >= 0, idx - last_voiced, idx + 1 + self._run)
+        self._run = int(run[-1])
+
+        kept = frames[run <= self.max_gap].reshape(-1)
+        self.samples_out += len(kept)
+        return kept
+
+    def flush(self) -> np.ndarray:
+        """Resto final (menos de una ventana)."""
+        rest, self._pending = self._pending, np.zeros(0, dtype=np.float32)
+        if self._run + 1 > self.max_gap:
+            return rest[:0]
+        self.samples_out += len(rest)
+        return rest
+
+
+class AudioTooLarge(Exception):
+    """La grabación supera AUDIO_MAX_UPLOAD_BYTES."""
+
+
+class InvalidUpload(Exception):
+    """Cuerpo multipart mal formado, incompleto o sin el campo del archivo."""
+
+
+class MultipartUpload:
+    """
+    Campo de archivo de un multipart/form-data, leído mientras llega el cuerpo.
+    open() avanza hasta las cabeceras de la parte (content_type queda
+    disponible) y chunks() entrega sus bytes a medida que se parsean.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], content_type: Optional[str], field: str = "file"):
+        mime, params = parse_options_header(content_type or "")
+        if mime != b"multipart/form-data" or not params.get(b"boundary"):
+            raise InvalidUpload("Se esperaba multipart/form-data")
+        self.field = field
+        self.content_type: Optional[str] = None
+        self._body = body.__aiter__()
+        self._found = False    # cabeceras de la parte del archivo leídas
+        self._reading = False  # dentro de la parte del archivo
+        self._finished = False
+        self._data: List[bytes] = []
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if not self._found and params.get(b"name") == self.field.encode():
+            self._found = self._reading = True
+            self.content_type = self._headers.get(b"content-type", b"").decode("latin-1") or None
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._reading:
+            self._data.append(bytes(data[start:end]))
+
+    def _on_part_end(self):
+        if self._reading:
+            self._reading = False
+            self._finished = True
+
+    async def _feed(self) -> bool:
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            return False
+        try:
+            self._parser.write(chunk)
+        except Exception as e:
+            raise InvalidUpload(f"Multipart mal formado: {e}")
+        return True
+
+    async def open(self):
+        """Lee hasta el comienzo del archivo. Lanza InvalidUpload si no está."""
+        while not self._found:
+            if not await self._feed():
+                raise InvalidUpload(f"Falta el campo '{self.field}'")
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            if self._data:
+                data, self._data = b"".join(self._data), []
+                yield data
+            if self._finished:
+                return
+            if not await self._feed():
+                raise InvalidUpload("Subida incompleta")
+
+
+@dataclass
+class StoredAudio:
+    path: Path
+    sha256: str
+    size: int
+
+
+def _write_block(f, digest, block: bytes):
+    # En un hilo: hashlib y la escritura liberan el GIL
+    digest.update(block)
+    f.write(block)
+
+
+class AudioService:
+    """Decodificación y limpieza de audio para ASR, y almacenamiento de grabaciones."""
+
+    def __init__(self, threshold_db: float, max_silence: float, max_upload_bytes: int, chunk_size: int):
+        self.threshold_db = threshold_db
+        self.max_silence = max_silence
+        self.max_upload_bytes = max_upload_bytes
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def extension_for(content_type: Optional[str]) -> str:
+        """Extensión por Content-Type ("audio/webm;codecs=opus" -> .webm)."""
+        mime = (content_type or "").split(";")[0].strip().lower()
+        return AUDIO_EXTENSIONS.get(mime, ".bin")
+
+    def check_length(self, content_length: Optional[str]):
+        """Rechaza de entrada una subida que declara más de max_upload_bytes."""
+        if content_length and content_length.isdigit() and int(content_length) > self.max_upload_bytes:
+            raise AudioTooLarge()
+
+    async def store(self, chunks: AsyncIterator[bytes], case_id: str, extension: str) -> StoredAudio:
+        """
+        Escribe la grabación en AUDIO_DIR/<case_id>/ en bloques de chunk_size,
+        con SHA-256 incremental. Lanza AudioTooLarge al pasar max_upload_bytes
+        (sin esperar al final de la subida) y no deja archivos a medias.
+        """
+        directory = AUDIO_DIR / case_id
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = directory / f".{uuid4().hex}.part"
+
+        digest = hashlib.sha256()
+        size = 0
+        buffer = bytearray()
+        f = open(tmp_path, "wb")
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    raise AudioTooLarge()
+                buffer += chunk
+                if len(buffer) >= self.chunk_size:
+                    await asyncio.to_thread(_write_block, f, digest, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(_write_block, f, digest, bytes(buffer))
+            await asyncio.to_thread(f.close)
+        except BaseException:
+            f.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        sha256 = digest.hexdigest()
+        # Nombre con el hash: nunca se sobrescribe una grabación anterior
+        path = directory / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{sha256[:12]}{extension}"
+        os.replace(tmp_path, path)
+        logger.info(f"Audio guardado: {path} ({size / 1024 / 1024:.1f} MB, sha256 {sha256[:12]})")
+        return StoredAudio(path=path, sha256=sha256, size=size)
+
+    async def spool(self, chunks: AsyncIterator[bytes]) -> BinaryIO:
+        """
+        Grabación sin caso (solo para transcribir) en un temporal anónimo, con
+        el mismo límite de tamaño que store(). Retorna el archivo al inicio.
+        """
+        f = tempfile.TemporaryFile()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_upload_bytes:
+                    raise AudioTooLarge()
+                await asyncio.to_thread(f.write, chunk)
+            f.seek(0)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    async def case_exists(self, case_id: str) -> bool:
+        """Verificación previa a la subida (no retiene una conexión mientras llega el audio)."""
+        async with read_connection() as db:
+            cursor = await db.execute("SELECT 1 FROM cases WHERE id = ?", (case_id,))
+            return await cursor.fetchone() is not None
+
+    async def attach(self, case_id: str, stored: StoredAudio, user_id: Optional[str] = None) -> Optional[str]:
+        """
+        Vincula la grabación al caso (audio_path, hash_audio) y lo audita.
+        Retorna el nuevo hash_caso, o None si el caso no existe.
+        """
+        async with write_connection() as db:
+            cursor = await db.execute("SELECT hash_caso FROM cases WHERE id = ?", (case_id,))
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            await db.execute(
+                """UPDATE cases SET audio_path = ?, hash_audio = ?, updated_at = ?, version = version + 1
+                   WHERE id = ?""",
+                (str(stored.path), stored.sha256, datetime.now().isoformat(), case_id)
+            )
+            hash_caso = await refresh_case_hash(db, case_id)
+            await db.commit()
+
+        audit_service.record(
+            "upload_audio", "case", case_id, user_id=user_id,
+            details={"hash_audio": stored.sha256, "size": stored.size},
+            hash_before=row[0], hash_after=hash_caso
+        )
+        return hash_caso
+
+    def new_gate(self) -> SilenceGate:
+        return SilenceGate(SAMPLE_RATE, self.threshold_db, self.max_silence)
+
+    def load_pcm(self, source: Union[str, BinaryIO], trim_silence: bool = True) -> np.ndarray:
+        """
+        Audio (ruta o archivo abierto) -> PCM float32 16 kHz mono, sin silencios.
+        CPU-bound: llamar con asyncio.to_thread desde el event loop.
+        """
+        import av
+
+        gate = self.new_gate() if trim_silence else None
+        kept: List[np.ndarray] = []
+        block: List[np.ndarray] = []
+        block_len = 0
+
+        def emit(samples: np.ndarray):
+            kept.append(gate.push(samples) if gate else samples)
+
+        with av.open(source, mode="r") as container:
+            stream = container.streams.audio[0]
+            stream.thread_type = "AUTO"
+            resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+
+            def resampled():
+                for frame in container.decode(stream):
+                    yield from resampler.resample(frame)
+                yield from resampler.resample(None)  # vaciar el remuestreador
+
+            # Agrupar frames de ~20 ms en bloques de ~1 s: menos llamadas a NumPy
+            for frame in resampled():
+                samples = frame.to_ndarray().reshape(-1)
+                block.append(samples)
+                block_len += len(samples)
+                if block_len >= GATE_BLOCK_SAMPLES:
+                    emit(np.concatenate(block))
+                    block, block_len = [], 0
+
+        if block:
+            emit(np.concatenate(block))
+        if gate:
+            kept.append(gate.flush())
+            if gate.samples_in:
+                logger.info(
+                    f"Audio: {gate.samples_in / SAMPLE_RATE:.1f}s -> {gate.samples_out / SAMPLE_RATE:.1f}s "
+                    f"({(1 - gate.samples_out / gate.samples_in) * 100:.1f}% silencio removido)"
+                )
+
+        return np.concatenate(kept) if kept else np.zeros(0, dtype=np.float32)
+
+    @staticmethod
+    def to_wav_bytes(pcm: np.ndarray) -> bytes:
+        """PCM float32 -> WAV 16-bit en memoria (para APIs que piden un archivo)."""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes(to_int16(pcm).tobytes())
+        return buffer.getvalue()
+
+
+def to_int16(pcm: np.ndarray) -> np.ndarray:
+    return (np.clip(pcm, -1.0, 1.0) * 32767).astype("<i2")
+
+
+# Singleton
+audio_service = AudioService(
+    settings.AUDIO_SILENCE_THRESHOLD_DB,
+    settings.AUDIO_MAX_SILENCE_SECONDS,
+    settings.AUDIO_MAX_UPLOAD_BYTES,
+    settings.AUDIO_UPLOAD_CHUNK_BYTES,
+)
@@ -0,0 +1,282 @@
+"""
+Servicio de auditoría (cadena de custodia).
+
+Los handlers encolan eventos con record() y siguen; una tarea de fondo los
+escribe en audit_log por lotes (una transacción por lote, no un commit por
+request). Cada fila guarda chain_hash = SHA-256(chain_hash anterior + campos
+de la fila), de modo que alterar o borrar una fila rompe la cadena.
+
+El último eslabón se lee dentro de la transacción de escritura de cada lote
+(BEGIN IMMEDIATE): con varios workers de uvicorn escribiendo, la cadena
+sigue siendo una sola. Un lote que no se puede escribir tras los reintentos
+se guarda en data/audit_spool y se vuelve a intentar después.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from core.config import settings
+from core.database import db_pool
+
+logger = logging.getLogger(__name__)
+
+# Campos encadenados, en orden (también columnas de audit_log)
+AUDIT_FIELDS = [
+    "timestamp", "user_id", "action", "resource_type", "resource_id",
+    "details", "hash_before", "hash_after", "device_id",
+]
+
+# Usuario de los eventos sin token (clientes aún sin autenticación)
+ANONYMOUS_USER = "anonimo"
+
+WRITE_RETRIES = 3
+
+SPOOL_DIR = Path(settings.CORONERIA_DATA) / "audit_spool"
+# Un archivo reclamado por un worker que murió a mitad del reintento vuelve a la cola
+SPOOL_CLAIM_TIMEOUT_SECONDS = 300
+
+
+def chain_hash(previous: Optional[str], event: Dict[str, Any]) -> str:
+    """Hash de una fila encadenado con el de la fila anterior."""
+    h = hashlib.sha256((previous or "").encode())
+    for field in AUDIT_FIELDS:
+        value = event.get(field)
+        h.update(b"\x1f")
+        h.update(b"\x00" if value is None else str(value).encode("utf-8"))
+    return h.hexdigest()
+
+
+class AuditService:
+    """Cola de eventos de auditoría con escritura diferida por lotes."""
+
+    def __init__(self, batch_size: int, backlog_warn: int, spool_dir: Path):
+        self.batch_size = max(1, batch_size)
+        self.backlog_warn = backlog_warn
+        self.spool_dir = Path(spool_dir)
+        self.device_id = platform.node()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spooled = True  # revisar el directorio al iniciar
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Inicia la escritura de fondo (primero reintenta los lotes guardados en disco)."""
+        if self.is_running:
+            return
+
+        self._spooled = True
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Auditoría iniciada")
+
+    async def stop(self):
+        """Escribe los eventos pendientes y detiene la tarea de fondo."""
+        if not self.is_running:
+            return
+
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("Auditoría detenida (cola vaciada)")
+
+    async def drain(self):
+        """Espera a que todos los eventos encolados estén escritos."""
+        if self.is_running:
+            await self._queue.join()
+
+    def record(
+        self,
+        action: str,
+        resource_type: str,
+        resource_id: str,
+        user_id: Optional[str] = None,
+        details: Optional[Dict[str, Any]] = None,
+        hash_before: Optional[str] = None,
+        hash_after: Optional[str] = None,
+    ):
+        """
+        Encola un evento sin esperar la escritura en disco.
+        La cola no descarta eventos: si crece por encima de AUDIT_BACKLOG_WARN
+        se advierte en el log (el escritor no da abasto).
+        """
+        if not self.is_running:
+            # Fuera de la aplicación (scripts): no hay escritor de auditoría
+            logger.debug(f"Auditoría inactiva, evento no registrado: {action} {resource_type}/{resource_id}")
+            return
+
+        self._queue.put_nowait({
+            "timestamp": datetime.now().isoformat(),
+            "user_id": user_id or ANONYMOUS_USER,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "details": json.dumps(details, ensure_ascii=False) if details else None,
+            "hash_before": hash_before,
+            "hash_after": hash_after,
+            "device_id": self.device_id,
+        })
+        if self._queue.qsize() == self.backlog_warn:
+            logger.warning(f"Auditoría con {self.backlog_warn} eventos pendientes de escritura")
+
+    async def _run(self):
+        while True:
+            if self._spooled:
+                await self._replay_spool()
+
+            batch = [await self._queue.get()]
+            # Lo acumulado mientras se escribía el lote anterior va en este
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                if not await self._write(batch):
+                    self._spill(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _insert(self, batch: List[Dict[str, Any]]):
+        """Un lote en una transacción, encadenado al último eslabón escrito por cualquier worker."""
+        async with db_pool.writer() as db:
+            # Toma el lock de escritura de SQLite antes de leer el eslabón
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("SELECT chain_hash FROM audit_log ORDER BY id DESC LIMIT 1")
+            row = await cursor.fetchone()
+            previous = row[0] if row else None
+
+            rows = []
+            for event in batch:
+                previous = chain_hash(previous, event)
+                rows.append([event[field] for field in AUDIT_FIELDS] + [previous])
+            await db.executemany(
+                f"""INSERT INTO audit_log ({', '.join(AUDIT_FIELDS)}, chain_hash)
+                    VALUES ({', '.join('?' * (len(AUDIT_FIELDS) + 1))})""",
+                rows
+            )
+            await db.commit()
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                await self._insert(batch)
+                return True
+            except Exception as e:
+                logger.error(f"Error escribiendo auditoría (intento {attempt}/{WRITE_RETRIES}): {e}")
+                await asyncio.sleep(attempt)
+        return False
+
+    def _spill(self, batch: List[Dict[str, Any]]):
+        """Guarda en disco un lote que no se pudo escribir (se reintenta en el próximo lote)."""
+        path = self.spool_dir / f"{time.time_ns()}-{os.getpid()}.jsonl"
+        try:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for event in batch:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._spooled = True
+            logger.error(f"Lote de auditoría ({len(batch)} eventos) guardado en {path} para reintentar")
+        except OSError as e:
+            # Último recurso: que los eventos queden al menos en el log
+            logger.error(f"No se pudo guardar el lote de auditoría en disco: {e}")
+            for event in batch:
+                logger.error(f"Evento de auditoría perdido: {json.dumps(event, ensure_ascii=False)}")
+
+    async def _replay_spool(self):
+        """Escribe los lotes guardados en disco, del más antiguo al más nuevo."""
+        self._spooled = False
+        if not self.spool_dir.is_dir():
+            return
+
+        now = time.time()
+        for claimed in self.spool_dir.glob("*.jsonl.claim-*"):
+            try:
+                if claimed.stat().st_mtime < now - SPOOL_CLAIM_TIMEOUT_SECONDS:
+                    os.replace(claimed, claimed.with_name(claimed.name.split(".claim-")[0]))
+            except OSError:
+                pass
+
+        for path in sorted(self.spool_dir.glob("*.jsonl")):
+            # Reclamar el archivo: con varios workers, solo uno lo reescribe
+            claimed = path.with_name(f"{path.name}.claim-{os.getpid()}")
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                batch = [json.loads(line) for line in f if line.strip()]
+            if await self._write(batch):
+                claimed.unlink()
+                logger.info(f"Lote de auditoría recuperado de {path.name} ({len(batch)} eventos)")
+            else:
+                os.replace(claimed, path)
+                self._spooled = True
+                return
+
+    async def query(
+        self,
+        db: aiosqlite.Connection,
+        resource_type: str,
+        resource_id: str,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """Historial de un recurso, del más reciente al más antiguo (idx_audit_resource)."""
+        sql = f"""SELECT id, {', '.join(AUDIT_FIELDS)}, chain_hash
+                  FROM audit_log INDEXED BY idx_audit_resource
+                  WHERE resource_type = ? AND resource_id = ?"""
+        params: List[Any] = [resource_type, resource_id]
+        if before_id is not None:
+            sql += " AND id < ?"
+            params.append(before_id)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        cursor = await db.execute(sql, params)
+        return [dict(row) for row in await cursor.fetchall()]
+
+    async def verify_chain(self, db: aiosqlite.Connection) -> Dict[str, Any]:
+        """Recalcula la cadena completa. Retorna la primera fila que no coincide."""
+        cursor = await db.execute(
+            f"SELECT id, {', '.join(AUDIT_FIELDS)}, chain_hash FROM audit_log ORDER BY id"
+        )
+        previous = None
+        checked = 0
+        while True:
+            rows = await cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                event = dict(row)
+                if event["chain_hash"] is None and previous is None:
+                    # Filas anteriores al encadenamiento
+                    continue
+                expected = chain_hash(previous, event)
+                if event["chain_hash"] != expected:
+                    return {"valid": False, "checked": checked, "broken_at": event["id"]}
+                previous = expected
+                checked += 1
+
+        return {"valid": True, "checked": checked, "broken_at": None}
+
+
+# Singleton (se inicia en el lifespan de la aplicación)
+audit_service = AuditService(settings.AUDIT_BATCH_SIZE, settings.AUDIT_BACKLOG_WARN, SPOOL_DIR)
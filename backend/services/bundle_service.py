@@ -0,0 +1,125 @@
+"""
+Paquete zip de un caso (PDF, FHIR, CSV, audio, transcripción) en streaming.
+
+El zip se arma al vuelo sobre un destino no posicionable: cada miembro se
+escribe por bloques y los bytes comprimidos salen hacia el cliente apenas
+se producen (descriptores de datos zip, sin archivo completo en memoria ni
+en disco). El audio se guarda sin comprimir (ya viene comprimido y deflate
+solo gastaría CPU). Al final va manifest.json con el SHA-256 de cada
+miembro, calculado mientras se transmite, para la cadena de custodia.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class BundleMember:
+    """
+    Miembro del paquete: contenido en memoria (data) o archivo ya abierto
+    (file). Los archivos se abren antes de responder: si la caché desaloja
+    el PDF durante el envío, el descriptor abierto conserva su contenido.
+    """
+    name: str
+    data: Optional[bytes] = None
+    file: Optional[BinaryIO] = None
+    stored: bool = False  # sin compresión
+
+
+class _ChunkSink:
+    """Destino de ZipFile sin seek: acumula bytes hasta que se envían."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.pending = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+class BundleService:
+    """Generación de paquetes zip en streaming."""
+
+    def __init__(self, chunk_size: int = 256 * 1024):
+        self.chunk_size = chunk_size
+
+    async def _blocks(self, member: BundleMember) -> AsyncIterator[bytes]:
+        if member.file is None:
+            for start in range(0, len(member.data or b""), self.chunk_size):
+                yield member.data[start:start + self.chunk_size]
+            return
+        while True:
+            block = await asyncio.to_thread(member.file.read, self.chunk_size)
+            if not block:
+                break
+            yield block
+
+    async def stream(self, members: List[BundleMember], metadata: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """Bytes del zip a medida que se producen; manifest.json al final (cierra los archivos)."""
+        try:
+            async for chunk in self._stream(members, metadata):
+                yield chunk
+        finally:
+            self.close(members)
+
+    @staticmethod
+    def close(members: List[BundleMember]):
+        for member in members:
+            if member.file is not None:
+                member.file.close()
+
+    async def _stream(self, members: List[BundleMember], metadata: Dict[str, Any]) -> AsyncIterator[bytes]:
+        sink = _ChunkSink()
+        date_time = datetime.now().timetuple()[:6]
+        files = []
+
+        with zipfile.ZipFile(sink, "w") as zf:
+            for member in members:
+                info = zipfile.ZipInfo(member.name, date_time=date_time)
+                info.compress_type = zipfile.ZIP_STORED if member.stored else zipfile.ZIP_DEFLATED
+                if member.file is not None:
+                    # Tamaño conocido: ZipFile decide si el miembro necesita ZIP64
+                    info.file_size = os.fstat(member.file.fileno()).st_size
+
+                digest = hashlib.sha256()
+                size = 0
+                with zf.open(info, "w") as dest:
+                    async for block in self._blocks(member):
+                        digest.update(block)
+                        size += len(block)
+                        dest.write(block)
+                        if sink.pending >= self.chunk_size:
+                            yield sink.drain()
+                files.append({"name": member.name, "size": size, "sha256": digest.hexdigest()})
+                yield sink.drain()
+
+            manifest = {**metadata, "generated_at": datetime.now().isoformat(), "files": files}
+            info = zipfile.ZipInfo(MANIFEST_NAME, date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+        # Directorio central (escrito al cerrar)
+        yield sink.drain()
+
+
+# Singleton
+bundle_service = BundleService()
@@ -0,0 +1,110 @@
+"""
+Repositorio de casos: lectura con proyección explícita de secciones.
+
+Cada consumidor pide solo las secciones que usa; solo esas columnas se leen
+y se parsean. Las secciones parseadas se guardan en una LRU en proceso
+por (case_id, updated_at): exportar el mismo caso varias veces seguidas
+(PDF, reimpresión, paquete) lo parsea una vez. Cualquier escritura cambia
+updated_at, así que una entrada vieja nunca se sirve: simplemente falla.
+"""
+
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from core.config import settings
+from core.database import SECTION_COLUMNS
+
+# Reintentos si el caso cambia entre la lectura de updated_at y la de las secciones
+READ_RETRIES = 3
+
+
+class CaseRepository:
+    """Carga de casos con caché LRU de secciones parseadas."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        # case_id -> (updated_at, {sección: dict parseado}); LRU primero
+        self._cache: "OrderedDict[str, Tuple[Optional[str], Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def load(
+        self,
+        db: aiosqlite.Connection,
+        case_id: str,
+        sections: Iterable[str],
+        columns: Sequence[str] = (),
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Secciones pedidas (parseadas, {} si vacías) más columnas escalares.
+        Retorna None si el caso no existe. Los dicts de sección se comparten
+        con la caché: no modificarlos.
+        """
+        sections = list(dict.fromkeys(sections))
+        unknown = set(sections) - set(SECTION_COLUMNS)
+        if unknown:
+            raise ValueError(f"Secciones desconocidas: {', '.join(sorted(unknown))}")
+
+        meta_sql = ", ".join(["updated_at", *columns])
+        for _ in range(READ_RETRIES):
+            cursor = await db.execute(f"SELECT {meta_sql} FROM cases WHERE id = ?", (case_id,))
+            meta = await cursor.fetchone()
+            if not meta:
+                self._cache.pop(case_id, None)
+                return None
+            updated_at = meta[0]
+
+            parsed = self._cached(case_id, updated_at)
+            missing = [s for s in sections if s not in parsed]
+            if missing:
+                self.misses += 1
+                # updated_at en el WHERE: si el caso cambió entre ambas lecturas, reintentar
+                cursor = await db.execute(
+                    f"SELECT {', '.join(missing)} FROM cases WHERE id = ? AND updated_at IS ?",
+                    (case_id, updated_at)
+                )
+                row = await cursor.fetchone()
+                if not row:
+                    continue
+                for section, value in zip(missing, row):
+                    parsed[section] = json.loads(value) if value else {}
+                self._store(case_id, updated_at, parsed)
+            else:
+                self.hits += 1
+
+            result = dict(zip(columns, meta[1:]))
+            result.update((section, parsed[section]) for section in sections)
+            return result
+
+        raise RuntimeError(f"El caso {case_id} cambió durante la lectura")
+
+    def _cached(self, case_id: str, updated_at: Optional[str]) -> Dict[str, Any]:
+        entry = self._cache.get(case_id)
+        if entry is None or entry[0] != updated_at:
+            return {}
+        self._cache.move_to_end(case_id)
+        return entry[1]
+
+    def _store(self, case_id: str, updated_at: Optional[str], parsed: Dict[str, Any]):
+        self._cache[case_id] = (updated_at, parsed)
+        self._cache.move_to_end(case_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, case_id: str):
+        self._cache.pop(case_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Singleton
+case_repository = CaseRepository(settings.CASE_CACHE_ENTRIES)
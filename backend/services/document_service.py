@@ -8,245 +8,199 @@ import json
 import csv
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Sequence, Tuple
 from uuid import uuid4
 
 from core.config import settings
 from services.storage_service import StorageService
+from services.render_service import render_service, RenderJob
+from services.pdf_cache import pdf_cache, content_key
+from services.protocol_template import render_protocol
 
 # Crear directorio de exports
 EXPORTS_DIR = Path(settings.CORONERIA_EXPORTS)
 EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Cambiar al modificar la plantilla o su hoja de estilos: invalida los PDFs en caché
+TEMPLATE_VERSION = "3"
+
+
+def _first_of(*expressions: str) -> str:
+    """Primer valor no vacío entre varias rutas (v2.0 primero, luego v1)."""
+    values = ", ".join(f"NULLIF({e}, '')" for e in expressions)
+    return f"COALESCE({values}, '')"
+
+
+def _json(section: str, path: str) -> str:
+    return f"json_extract({section}, '$.{path}')"
+
+
+# Columnas del CSV de Forensys, calculadas en SQL (sin json.loads por caso)
+FORENSYS_CSV_COLUMNS = [
+    ("protocolo_numero", _first_of(
+        _json("datos_generales", "numero_informe"),
+        _json("datos_administrativos", "protocolo_numero"),
+        "protocol_number")),
+    ("fecha_necropsia", _first_of(
+        _json("datos_generales", "fecha_informe"),
+        _json("datos_administrativos", "fecha_necropsia"))),
+    ("nombre_fallecido", f"""COALESCE(NULLIF(trim(
+            COALESCE({_json("datos_generales", "fallecido.nombre")}, '') || ' ' ||
+            COALESCE({_json("datos_generales", "fallecido.apellido_paterno")}, '') || ' ' ||
+            COALESCE({_json("datos_generales", "fallecido.apellido_materno")}, '')), ''),
+        {_json("datos_administrativos", "nombre_fallecido")}, 'NN')"""),
+    ("edad", _first_of(
+        _json("datos_generales", "fallecido.edad"),
+        _json("datos_administrativos", "edad"))),
+    ("sexo", _first_of(
+        _json("datos_generales", "fallecido.sexo"),
+        _json("datos_administrativos", "sexo"))),
+    ("talla", _first_of(
+        _json("examen_externo", "campo_36_talla"),
+        # v2.0 guarda la talla en metros; Forensys espera cm (solo si es numérica)
+        f"""CASE WHEN typeof({_json('datos_generales', 'fallecido.talla')}) IN ('integer', 'real')
+            THEN CAST(round({_json('datos_generales', 'fallecido.talla')} * 100) AS INTEGER) END""")),
+    ("peso", _first_of(
+        _json("examen_externo", "campo_37_peso"),
+        _json("datos_generales", "fallecido.peso"))),
+    ("causa_final", _first_of(
+        _json("causas_muerte", "diagnostico_integrado.causa_final.texto"),
+        _json("causas_muerte", "diagnostico_presuntivo.causa_final.texto"),
+        _json("conclusiones", "causa_final"))),
+    ("causa_basica", _first_of(
+        _json("causas_muerte", "diagnostico_integrado.causa_basica.texto"),
+        _json("causas_muerte", "diagnostico_presuntivo.causa_basica.texto"),
+        _json("conclusiones", "causa_basica"))),
+    ("codigo_cie10", _first_of(
+        _json("causas_muerte", "diagnostico_integrado.causa_final.cie10"),
+        _json("causas_muerte", "diagnostico_presuntivo.causa_final.cie10"),
+        _json("conclusiones", "codigo_cie10"))),
+]
+
+FORENSYS_CSV_HEADERS = [name for name, _ in FORENSYS_CSV_COLUMNS]
+FORENSYS_CSV_SQL = ", ".join(expression for _, expression in FORENSYS_CSV_COLUMNS)
+
+# Campos del DiagnosticReport, con la misma proyección que el CSV
+FHIR_REPORT_FIELDS = ["nombre_fallecido", "fecha_necropsia", "causa_final", "codigo_cie10"]
+FHIR_REPORT_SQL = ", ".join(dict(FORENSYS_CSV_COLUMNS)[name] for name in FHIR_REPORT_FIELDS)
+
+
+def diagnostic_report(case_id: str, row: Sequence[Any], issued: str) -> Dict:
+    """FHIR DiagnosticReport R4 (row: columnas de FHIR_REPORT_SQL)."""
+    
+    nombre, fecha, causa_final, cie10 = row
+    
+    return {
+        "resourceType": "DiagnosticReport",
+        "id": case_id,
+        "meta": {
+            "profile": ["http://hl7.org/fhir/StructureDefinition/DiagnosticReport"]
+        },
+        "status": "final",
+        "category": [{
+            "coding": [{
+                "system": "http://terminology.hl7.org/CodeSystem/v2-0074",
+                "code": "PAT",
+                "display": "Pathology"
+            }]
+        }],
+        "code": {
+            "coding": [{
+                "system": "http://loinc.org",
+                "code": "18743-5",
+                "display": "Autopsy report"
+            }],
+            "text": "Protocolo de Necropsia"
+        },
+        "subject": {
+            "display": nombre
+        },
+        "effectiveDateTime": fecha or issued,
+        "issued": issued,
+        "conclusion": causa_final,
+        "conclusionCode": [{
+            "coding": [{
+                "system": "http://hl7.org/fhir/sid/icd-10",
+                "code": cie10
+            }]
+        }] if cie10 else []
+    }
+
 
 class DocumentService:
     """Servicio de generación de documentos."""
     
     def __init__(self):
         self.storage_service = StorageService()
+        self._inflight: Dict[Tuple[str, str], RenderJob] = {}
     
-    async def generate_pdf(self, case_id: str, case_data: Dict[str, Any]) -> str:
-        """Genera PDF en formato IMLCF."""
+    def submit_pdf(self, case_id: str, case_data: Dict[str, Any]) -> RenderJob:
+        """
+        PDF IMLCF del caso: desde la caché si las secciones no cambiaron,
+        si no, encola el render en el pool de procesos (un solo render por
+        contenido aunque lleguen varias solicitudes a la vez).
+        Lanza RenderQueueFull si hay demasiados renders pendientes.
+        """
         
-        html_content = self._build_html(case_data)
+        key = content_key(case_data, TEMPLATE_VERSION)
+        
+        cached = pdf_cache.get(case_id, key)
+        if cached:
+            return render_service.completed(case_id, cached)
+        
+        inflight = self._inflight.get((case_id, key))
+        if inflight and inflight.status == "pending":
+            return inflight
         
-        # Usar WeasyPrint
-        from weasyprint import HTML
+        html_content = self._build_html(case_data)
+        pdf_path = pdf_cache.path_for(case_id, key)
         
-        filename = f"protocolo_{case_id[:8]}_{datetime.now().strftime('%Y%m%d')}.pdf"
-        pdf_path = EXPORTS_DIR / filename
+        job = render_service.submit(case_id, html_content, pdf_path, on_done=self._on_pdf_rendered)
+        self._inflight[(case_id, key)] = job
+        job.task.add_done_callback(lambda _: self._inflight.pop((case_id, key), None))
+        return job
+    
+    async def generate_pdf(self, case_id: str, case_data: Dict[str, Any]) -> str:
+        """Genera PDF en formato IMLCF (espera el render sin bloquear el event loop)."""
         
-        HTML(string=html_content).write_pdf(str(pdf_path))
+        job = await render_service.wait(self.submit_pdf(case_id, case_data))
+        if job.status != "done":
+            raise RuntimeError(f"Error generando PDF: {job.error}")
         
+        return str(job.path)
+    
+    async def _on_pdf_rendered(self, job: RenderJob):
+        pdf_cache.put(job.path)
+        await self._backup_pdf(job)
+    
+    async def _backup_pdf(self, job: RenderJob):
         # --- FASE 2: BACKUP AUTOMÁTICO (Simulado o Real) ---
         # Subir el PDF generado al bucket de "informes-finales"
-        cloud_url = await self.storage_service.upload_file(
-            file_path=str(pdf_path),
+        await self.storage_service.upload_file(
+            file_path=str(job.path),
             container_name="informes-finales",
-            blob_name=filename
+            blob_name=f"protocolo_{job.case_id[:8]}_{datetime.now().strftime('%Y%m%d')}.pdf"
         )
-        
-        return str(pdf_path)
     
     def _build_html(self, data: Dict) -> str:
-        """Construye HTML del protocolo IMLCF."""
+        """Construye HTML del protocolo IMLCF (plantilla precompilada)."""
         
-        admin = data.get('datos_administrativos', {})
-        signs = data.get('fenomenos_cadavericos', {})
-        external = data.get('examen_externo', {})
-        internal = data.get('examen_interno', {})
-        lesions = data.get('lesiones_traumaticas', {})
-        concl = data.get('conclusiones', {})
-        
-        return f"""
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {{ size: A4; margin: 2cm; }}
-                body {{ font-family: 'Times New Roman', serif; font-size: 11pt; line-height: 1.4; }}
-                .header {{ text-align: center; margin-bottom: 20px; }}
-                .header h1 {{ font-size: 14pt; margin: 0; }}
-                .header h2 {{ font-size: 12pt; font-weight: normal; margin: 5px 0; }}
-                .section {{ margin-bottom: 15px; }}
-                .section-title {{ font-weight: bold; font-size: 12pt; border-bottom: 1px solid #000; margin-bottom: 10px; }}
-                .field {{ margin-bottom: 8px; }}
-                .field-label {{ font-weight: bold; }}
-                table {{ width: 100%; border-collapse: collapse; margin: 10px 0; }}
-                td, th {{ border: 1px solid #000; padding: 5px; text-align: left; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>MINISTERIO PÚBLICO</h1>
-                <h2>INSTITUTO DE MEDICINA LEGAL Y CIENCIAS FORENSES</h2>
-                <h1>PROTOCOLO DE NECROPSIA Nº {admin.get('protocolo_numero', '')}</h1>
-            </div>
-
-            <div class="section">
-                <div class="section-title">I. DATOS ADMINISTRATIVOS</div>
-                <table>
-                    <tr>
-                        <td><strong>Nombre:</strong> {admin.get('nombre_fallecido', 'NN')}</td>
-                        <td><strong>Edad:</strong> {admin.get('edad', '')}</td>
-                        <td><strong>Sexo:</strong> {admin.get('sexo', '')}</td>
-                    </tr>
-                    <tr>
-                        <td colspan="3"><strong>Fecha:</strong> {admin.get('fecha_necropsia', '')}</td>
-                    </tr>
-                </table>
-            </div>
-
-            <div class="section">
-                <div class="section-title">II. FENÓMENOS CADAVÉRICOS</div>
-                <div class="field">
-                    <span class="field-label">Livideces:</span> {signs.get('campo_25_livideces', '')}
-                </div>
-                <div class="field">
-                    <span class="field-label">Rigidez:</span> {signs.get('campo_26_rigidez', '')}
-                </div>
-                <div class="field">
-                    <span class="field-label">Tiempo Aprox. Muerte:</span> {signs.get('campo_33_tiempo_muerte', '')}
-                </div>
-            </div>
-
-            <div class="section">
-                <div class="section-title">III. EXAMEN EXTERNO</div>
-                <table>
-                    <tr>
-                        <td><strong>Talla:</strong> {external.get('campo_36_talla', '')} cm</td>
-                        <td><strong>Peso:</strong> {external.get('campo_37_peso', '')} kg</td>
-                    </tr>
-                </table>
-            </div>
-
-            <div class="section">
-                <div class="section-title">IV. EXAMEN INTERNO</div>
-                <div class="field">
-                    <span class="field-label">Pulmón Derecho:</span> 
-                    {internal.get('campo_60_pulmon_derecho', '')}
-                    (Peso: {internal.get('peso_pulmon_derecho', '')}g)
-                </div>
-                <div class="field">
-                    <span class="field-label">Pulmón Izquierdo:</span> 
-                    {internal.get('campo_61_pulmon_izquierdo', '')}
-                    (Peso: {internal.get('peso_pulmon_izquierdo', '')}g)
-                </div>
-                <div class="field">
-                    <span class="field-label">Corazón:</span> 
-                    {internal.get('campo_63_corazon', '')}
-                    (Peso: {internal.get('peso_corazon', '')}g)
-                </div>
-                <div class="field">
-                    <span class="field-label">Hígado:</span> 
-                    {internal.get('campo_72_higado', '')}
-                    (Peso: {internal.get('peso_higado', '')}g)
-                </div>
-            </div>
-
-            <div class="section">
-                <div class="section-title">V. CONCLUSIONES</div>
-                <div class="field">
-                    <span class="field-label">Causa de Muerte:</span>
-                    {concl.get('causa_final', '')}
-                </div>
-                <div class="field">
-                    <span class="field-label">Código CIE-10:</span>
-                    {concl.get('codigo_cie10', '')}
-                </div>
-            </div>
-
-            <div style="margin-top: 50px; text-align: center;">
-                <div style="width: 200px; border-top: 1px solid #000; margin: 0 auto; padding-top: 5px;">
-                    Firma del Médico Legista
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        return render_protocol(data)
     
-    async def generate_fhir(self, case_id: str, case_data: Dict[str, Any]) -> Dict:
-        """Genera FHIR DiagnosticReport R4."""
+    async def generate_fhir(self, case_id: str, row: Sequence[Any]) -> Dict:
+        """Genera FHIR DiagnosticReport R4 (row: columnas de FHIR_REPORT_SQL)."""
         
-        admin = case_data.get('datos_administrativos', {})
-        concl = case_data.get('conclusiones', {})
-        
-        return {
-            "resourceType": "DiagnosticReport",
-            "id": case_id,
-            "meta": {
-                "profile": ["http://hl7.org/fhir/StructureDefinition/DiagnosticReport"]
-            },
-            "status": "final",
-            "category": [{
-                "coding": [{
-                    "system": "http://terminology.hl7.org/CodeSystem/v2-0074",
-                    "code": "PAT",
-                    "display": "Pathology"
-                }]
-            }],
-            "code": {
-                "coding": [{
-                    "system": "http://loinc.org",
-                    "code": "18743-5",
-                    "display": "Autopsy report"
-                }],
-                "text": "Protocolo de Necropsia"
-            },
-            "subject": {
-                "display": admin.get('nombre_fallecido', 'NN')
-            },
-            "effectiveDateTime": admin.get('fecha_necropsia', datetime.now().isoformat()),
-            "issued": datetime.now().isoformat(),
-            "conclusion": concl.get('causa_final', ''),
-            "conclusionCode": [{
-                "coding": [{
-                    "system": "http://hl7.org/fhir/sid/icd-10",
-                    "code": concl.get('codigo_cie10', '')
-                }]
-            }] if concl.get('codigo_cie10') else []
-        }
+        return diagnostic_report(case_id, row, datetime.now().isoformat())
     
-    async def generate_csv(self, case_id: str, case_data: Dict[str, Any]) -> str:
-        """Genera CSV para importación a Forensys."""
-        
-        admin = case_data.get('datos_administrativos', {})
-        external = case_data.get('examen_externo', {})
-        concl = case_data.get('conclusiones', {})
+    async def generate_csv(self, case_id: str, row: Sequence[Any]) -> str:
+        """Genera CSV para importación a Forensys (row: columnas de FORENSYS_CSV_SQL)."""
         
         filename = f"protocolo_{case_id[:8]}_{datetime.now().strftime('%Y%m%d')}.csv"
         csv_path = EXPORTS_DIR / filename
         
         with open(csv_path, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
-            
-            # Headers
-            writer.writerow([
-                'protocolo_numero',
-                'fecha_necropsia',
-                'nombre_fallecido',
-                'edad',
-                'sexo',
-                'talla',
-                'peso',
-                'causa_final',
-                'causa_basica',
-                'codigo_cie10'
-            ])
-            
-            # Data
-            writer.writerow([
-                admin.get('protocolo_numero', ''),
-                admin.get('fecha_necropsia', ''),
-                admin.get('nombre_fallecido', 'NN'),
-                admin.get('edad', ''),
-                admin.get('sexo', ''),
-                external.get('campo_36_talla', ''),
-                external.get('campo_37_peso', ''),
-                concl.get('causa_final', ''),
-                concl.get('causa_basica', ''),
-                concl.get('codigo_cie10', '')
-            ])
+            writer.writerow(FORENSYS_CSV_HEADERS)
+            writer.writerow(row)
         
         return str(csv_path)
@@ -0,0 +1,335 @@
+"""
+Exportación masiva FHIR (estilo Bulk Data $export) de DiagnosticReports.
+
+Un trabajo en segundo plano recorre los casos filtrados por páginas (keyset
+sobre idx_cases_updated, devolviendo la conexión al pool entre páginas),
+arma los reportes con la misma proyección SQL que la exportación individual
+y los escribe como NDJSON comprimido con gzip, en archivos de hasta
+FHIR_EXPORT_FILE_RESOURCES recursos. El cliente consulta el estado hasta
+obtener el manifiesto con los archivos a descargar.
+
+Cada trabajo publica su estado en <directorio>/job.json (al iniciar, por
+página y al terminar): con varios workers de uvicorn, la consulta, la
+descarga o el borrado pueden llegar a un worker distinto del que exporta.
+La limpieza es por antigüedad de job.json, nunca del directorio completo.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import uuid4
+
+from core.config import settings
+from core.database import db_pool
+from services.document_service import FHIR_REPORT_SQL, diagnostic_report
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_TYPE = "DiagnosticReport"
+PAGE_ROWS = 1000
+GZIP_LEVEL = 6  # 9 cuesta el doble de CPU por ~3% menos de tamaño
+STATE_NAME = "job.json"
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class FhirExportBusy(Exception):
+    """Demasiadas exportaciones masivas en curso."""
+
+
+class FhirExportRemoved(Exception):
+    """La exportación se borró (DELETE, posiblemente en otro worker) mientras corría."""
+
+
+@dataclass
+class FhirExportJob:
+    id: str
+    directory: Path
+    request: str
+    since: Optional[str] = None
+    status_filter: Optional[str] = None
+    status: str = "pending"  # pending | done | error
+    transaction_time: str = ""
+    total: int = 0
+    exported: int = 0
+    files: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+
+    @property
+    def progress(self) -> str:
+        return f"{self.exported}/{self.total}"
+
+    _STATE_FIELDS = (
+        "id", "request", "since", "status_filter", "status", "transaction_time",
+        "total", "exported", "files", "error", "created_at", "finished_at",
+    )
+
+    def to_state(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self._STATE_FIELDS}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], directory: Path) -> "FhirExportJob":
+        return cls(directory=directory, **{name: state.get(name) for name in cls._STATE_FIELDS if name in state})
+
+
+class _NdjsonGzipFile:
+    """
+    Archivo NDJSON comprimido. Escritura y cierre corren en hilos y se
+    serializan: si el trabajo se cancela a mitad de una escritura, el cierre
+    espera a que termine en lugar de cerrar el archivo debajo de ella.
+    """
+
+    def __init__(self, path: Path):
+        self._file = gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+        self._lock = threading.Lock()
+
+    def write_reports(self, rows: Sequence[Sequence[Any]], issued: str):
+        lines = [
+            json.dumps(diagnostic_report(row[0], row[1:], issued), ensure_ascii=False, separators=(",", ":"))
+            for row in rows
+        ]
+        lines.append("")
+        with self._lock:
+            self._file.write("\n".join(lines).encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class FhirExportService:
+    """Trabajos de exportación NDJSON en segundo plano."""
+
+    def __init__(self, directory: Path, max_jobs: int, file_resources: int, job_ttl: int):
+        self.directory = Path(directory)
+        self.max_jobs = max(1, max_jobs)
+        self.file_resources = max(1, file_resources)
+        self.job_ttl = job_ttl
+        self._jobs: Dict[str, FhirExportJob] = {}
+
+    @property
+    def running(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "pending")
+
+    def _prune(self):
+        """
+        Borra las exportaciones sin actividad hace más de job_ttl: las propias
+        terminadas y, en disco, las de otros workers o ejecuciones anteriores
+        (job.json se reescribe en cada página, así que las que siguen
+        exportando en otro worker nunca quedan viejas).
+        """
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            self.remove(job_id)
+
+        if not self.directory.is_dir():
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name in self._jobs:
+                continue
+            try:
+                mtime = os.stat(os.path.join(entry.path, STATE_NAME)).st_mtime
+            except OSError:
+                mtime = entry.stat().st_mtime  # sin estado: restos de una versión anterior
+            if mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _save(self, job: FhirExportJob):
+        """Publica el estado del trabajo (escritura atómica); no recrea un directorio borrado."""
+        path = job.directory / STATE_NAME
+        tmp = job.directory / f"{STATE_NAME}.{os.getpid()}.tmp"
+        try:
+            tmp.write_text(json.dumps(job.to_state()))
+            os.replace(tmp, path)
+        except FileNotFoundError:
+            pass  # exportación borrada
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el estado de la exportación {job.id}: {e}")
+
+    def _load(self, job_id: str) -> Optional[FhirExportJob]:
+        """Exportación de otro worker (por su job.json), o None."""
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        directory = self.directory / job_id
+        try:
+            state = json.loads((directory / STATE_NAME).read_text())
+        except (OSError, ValueError):
+            return None
+        return FhirExportJob.from_state(state, directory)
+
+    def start(self, request_url: str, since: Optional[str] = None, status: Optional[str] = None) -> FhirExportJob:
+        """Lanza una exportación. Lanza FhirExportBusy si hay demasiadas en curso."""
+        self._prune()
+        if self.running >= self.max_jobs:
+            raise FhirExportBusy()
+
+        job_id = uuid4().hex
+        job = FhirExportJob(
+            id=job_id, directory=self.directory / job_id, request=request_url,
+            since=since, status_filter=status, created_at=time.time()
+        )
+        self._jobs[job_id] = job
+        job.directory.mkdir(parents=True, exist_ok=True)
+        self._save(job)
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job: FhirExportJob):
+        try:
+            await self._export(job)
+            job.status = "done"
+            logger.info(f"Exportación FHIR {job.id}: {job.exported} reportes en {len(job.files)} archivos")
+        except asyncio.CancelledError:
+            # Apagado o reinicio: el job.json guardado debe quedar terminal
+            job.status = "error"
+            job.error = "Exportación cancelada"
+            raise
+        except FhirExportRemoved:
+            logger.info(f"Exportación FHIR {job.id} borrada durante la ejecución")
+            self._jobs.pop(job.id, None)
+            job.status = "error"
+            job.error = "Exportación borrada"
+        except Exception as e:
+            logger.error(f"Error en exportación FHIR {job.id}: {e}")
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    async def _export(self, job: FhirExportJob):
+        conditions = ["status != 'deleted'"]
+        params: List[Any] = []
+        if job.since:
+            conditions.append("updated_at > ?")
+            params.append(job.since)
+        if job.status_filter:
+            conditions.append("status = ?")
+            params.append(job.status_filter)
+
+        # Cota superior fija: lo modificado durante la exportación queda para la próxima
+        async with db_pool.reader() as db:
+            cursor = await db.execute(
+                "SELECT updated_at, id FROM cases INDEXED BY idx_cases_updated "
+                "ORDER BY updated_at DESC, id DESC LIMIT 1"
+            )
+            upper = await cursor.fetchone()
+            if upper is None:
+                job.transaction_time = datetime.now().isoformat()
+                return
+            conditions.append("(updated_at, id) <= (?, ?)")
+            params.extend(upper)
+            where = " AND ".join(conditions)
+            cursor = await db.execute(f"SELECT COUNT(*) FROM cases WHERE {where}", params)
+            job.total = (await cursor.fetchone())[0]
+
+        job.transaction_time = datetime.now().isoformat()
+
+        sql = f"""SELECT id, {FHIR_REPORT_SQL}, updated_at
+                  FROM cases INDEXED BY idx_cases_updated
+                  WHERE {where} AND (updated_at, id) > (?, ?)
+                  ORDER BY updated_at, id LIMIT {PAGE_ROWS}"""
+        last = ["", ""]
+        out = None
+        try:
+            while True:
+                if not job.directory.is_dir():
+                    raise FhirExportRemoved()
+                async with db_pool.reader() as db:
+                    cursor = await db.execute(sql, params + last)
+                    rows = await cursor.fetchall()
+                if not rows:
+                    break
+                last = [rows[-1][-1], rows[-1][0]]
+
+                # Repartir la página entre el archivo actual y los siguientes
+                while rows:
+                    if out is None or job.files[-1]["count"] >= self.file_resources:
+                        if out is not None:
+                            await asyncio.to_thread(out.close)
+                        out = self._open_file(job)
+                    room = self.file_resources - job.files[-1]["count"]
+                    chunk = [row[:-1] for row in rows[:room]]
+                    rows = rows[room:]
+                    await asyncio.to_thread(out.write_reports, chunk, job.transaction_time)
+                    job.files[-1]["count"] += len(chunk)
+                    job.exported += len(chunk)
+                self._save(job)
+        finally:
+            if out is not None:
+                await asyncio.to_thread(out.close)
+
+    def _open_file(self, job: FhirExportJob) -> _NdjsonGzipFile:
+        name = f"{RESOURCE_TYPE}_{len(job.files) + 1}.ndjson.gz"
+        job.files.append({"type": RESOURCE_TYPE, "name": name, "count": 0})
+        return _NdjsonGzipFile(job.directory / name)
+
+    def get(self, job_id: str) -> Optional[FhirExportJob]:
+        """Exportación de este worker o, si no, la publicada por otro."""
+        return self._jobs.get(job_id) or self._load(job_id)
+
+    def file_path(self, job: FhirExportJob, name: str) -> Optional[Path]:
+        """Ruta de un archivo del manifiesto (solo nombres listados, sin rutas arbitrarias)."""
+        if job.status != "done" or name not in {f["name"] for f in job.files}:
+            return None
+        return job.directory / name
+
+    def manifest(self, job: FhirExportJob, base_url: str) -> Dict[str, Any]:
+        """Manifiesto Bulk Data con las URLs de descarga."""
+        return {
+            "transactionTime": job.transaction_time,
+            "request": job.request,
+            "requiresAccessToken": False,
+            "output": [
+                {"type": f["type"], "url": f"{base_url}/{f['name']}", "count": f["count"]}
+                for f in job.files
+            ],
+            "error": [],
+        }
+
+    def remove(self, job_id: str) -> bool:
+        """Cancela (si sigue en curso) y elimina una exportación y sus archivos."""
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            # De otro worker: al borrar su directorio, ese worker la detiene en la próxima página
+            job = self._load(job_id)
+            if job is None:
+                return False
+            shutil.rmtree(job.directory, ignore_errors=True)
+            return True
+        if job.task is not None and not job.task.done():
+            # Borrar cuando el trabajo haya cerrado su archivo abierto
+            job.task.add_done_callback(lambda _: shutil.rmtree(job.directory, ignore_errors=True))
+            job.task.cancel()
+        else:
+            shutil.rmtree(job.directory, ignore_errors=True)
+        return True
+
+    async def shutdown(self):
+        """Cancela las exportaciones en curso (antes de cerrar el pool de conexiones)."""
+        tasks = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Singleton
+fhir_export_service = FhirExportService(
+    Path(settings.CORONERIA_EXPORTS) / "fhir_bulk",
+    settings.FHIR_EXPORT_MAX_JOBS,
+    settings.FHIR_EXPORT_FILE_RESOURCES,
+    settings.FHIR_EXPORT_JOB_TTL_SECONDS,
+)
@@ -0,0 +1,125 @@
+"""
+Índice de campos del protocolo.
+Mantiene la tabla case_fields (ruta con puntos → valor tipado) para poder
+filtrar casos por campos anidados de las secciones JSON directamente en SQL.
+"""
+
+import logging
+import re
+from typing import Any, List, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+# Rutas calientes: tienen índice de expresión sobre la tabla cases
+# (ver init_db), así que se filtran con json_extract sin pasar por case_fields.
+HOT_PATHS = {
+    "causas_muerte.diagnostico_presuntivo.etiologia.forma": (
+        "causas_muerte", "$.diagnostico_presuntivo.etiologia.forma"
+    ),
+    "datos_generales.fallecido.sexo": (
+        "datos_generales", "$.fallecido.sexo"
+    ),
+}
+
+OPERATORS = {
+    "eq": "=",
+    "ne": "!=",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+}
+
+PATH_PATTERN = re.compile(r'^[a-z_]+(\.[A-Za-z0-9_]+|\[\d+\])+$')
+
+# Aplana una sección con json_tree: una fila por hoja (sin deserializar en Python).
+# json_tree entrecomilla algunas claves en fullkey ($."diagnostico_presuntivo"),
+# por eso se quitan las comillas para obtener la ruta con puntos.
+INDEX_SECTION_SQL = """
+    INSERT OR REPLACE INTO case_fields (case_id, section, path, value_text, value_num)
+    SELECT c.id, '{section}', '{section}' || replace(substr(j.fullkey, 2), '"', ''),
+           CASE j.type
+               WHEN 'text' THEN j.atom
+               WHEN 'true' THEN 'true'
+               WHEN 'false' THEN 'false'
+           END,
+           CASE
+               WHEN j.type IN ('integer', 'real') THEN j.atom
+               WHEN j.type = 'text' AND trim(j.atom) GLOB '*[0-9]*'
+                    AND trim(j.atom) NOT GLOB '*[^0-9.-]*'
+                   THEN CAST(trim(j.atom) AS REAL)
+           END
+    FROM cases c, json_tree(c.{section}) j
+    WHERE {where} AND j.type NOT IN ('object', 'array', 'null')
+"""
+
+
+class FieldIndexService:
+    """Mantenimiento y consulta del índice de campos (case_fields)."""
+
+    def __init__(self, sections: List[str]):
+        self.sections = list(sections)
+
+    async def reindex(self, db: aiosqlite.Connection, case_id: str, sections: List[str]):
+        """
+        Reindexa las secciones indicadas de un caso.
+        Debe llamarse dentro de la misma transacción que la escritura.
+        """
+        for section in sections:
+            if section not in self.sections:
+                continue
+            await db.execute(
+                "DELETE FROM case_fields WHERE case_id = ? AND section = ?",
+                (case_id, section)
+            )
+            await db.execute(
+                INDEX_SECTION_SQL.format(section=section, where="c.id = ?"),
+                (case_id,)
+            )
+
+    async def backfill(self, db: aiosqlite.Connection):
+        """Construye el índice completo si está vacío (bases previas al índice)."""
+        cursor = await db.execute("SELECT EXISTS (SELECT 1 FROM case_fields)")
+        if (await cursor.fetchone())[0]:
+            return
+
+        for section in self.sections:
+            await db.execute(INDEX_SECTION_SQL.format(section=section, where="1"))
+        await db.commit()
+
+        cursor = await db.execute("SELECT COUNT(*) FROM case_fields")
+        logger.info(f"Índice de campos construido: {(await cursor.fetchone())[0]} valores")
+
+    def validate_path(self, path: str) -> bool:
+        """Valida que la ruta tenga forma seccion.campo[.subcampo] y sección conocida."""
+        if not PATH_PATTERN.match(path):
+            return False
+        section = re.split(r'[.\[]', path, maxsplit=1)[0]
+        return section in self.sections
+
+    def build_filter(self, path: str, op: str, value: Any) -> Tuple[str, list]:
+        """
+        Construye una condición SQL sobre la tabla cases para un filtro.
+        Retorna (sql, params).
+        """
+        sql_op = OPERATORS[op]
+
+        if path in HOT_PATHS:
+            column, json_path = HOT_PATHS[path]
+            # Misma expresión que el índice para que SQLite lo use
+            return f"json_extract({column}, '{json_path}') {sql_op} ?", [value]
+
+        if isinstance(value, bool):
+            column, value = "value_text", "true" if value else "false"
+        elif isinstance(value, (int, float)):
+            column = "value_num"
+        else:
+            column = "value_text"
+
+        return (
+            f"id IN (SELECT case_id FROM case_fields WHERE path = ? AND {column} {sql_op} ?)",
+            [path, value]
+        )
@@ -1,10 +1,223 @@
+"""
+Cliente de Gemini (transcripción, extracción NER y análisis de causa de muerte).
+
+Todas las llamadas son asíncronas (generate_content_async; la API de
+archivos, que solo es síncrona, corre en un hilo) y pasan por un limitador
+token bucket compartido por todo el proceso, dimensionado a la cuota
+(GEMINI_REQUESTS_PER_MINUTE). Cada modelo tiene además su propio semáforo
+de concurrencia, así extracción, transcripción y análisis corren en
+paralelo sin que uno acapare al otro. Los 429 se reintentan con backoff
+exponencial (asyncio.sleep: el event loop sigue atendiendo).
+
+El audio corto viaja inline en la solicitud; el largo se sube una sola vez
+por contenido (GeminiFiles) y se borra de Gemini en segundo plano. Las
+respuestas de extracción y análisis se guardan en llm_cache, y las
+solicitudes idénticas simultáneas comparten una llamada (gemini_flight).
+"""
 
+import asyncio
+import hashlib
+import json
 import logging
+import mimetypes
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import IO, Any, Dict, Optional, Union
+
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from core.config import settings
+from services.llm_cache import cache_key, llm_cache
+from services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+RETRY_BASE_SECONDS = 2
+FILE_POLL_SECONDS = 2
+FILE_MAX_WAIT_SECONDS = 30
+
+# Versiones de los prompts (clave de llm_cache): subirlas al cambiar el prompt
+NER_PROMPT_VERSION = "v2.0-1"
+DEATH_CAUSE_PROMPT_VERSION = "1"
+
+
+class TokenBucket:
+    """Limitador de tasa: rate solicitudes por segundo, ráfagas de hasta capacity."""
+
+    def __init__(self, requests_per_minute: int, capacity: int):
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Espera (sin bloquear el loop) hasta tener un token; en orden de llegada."""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def drain(self):
+        """Tras un 429 la cuota real está agotada: vaciar el bucket frena a todos."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
+
+
+# Compartidos por todas las instancias de GeminiService del proceso
+rate_limiter = TokenBucket(settings.GEMINI_REQUESTS_PER_MINUTE, settings.GEMINI_BURST)
+_model_semaphores: Dict[str, asyncio.Semaphore] = {}
+gemini_flight = SingleFlight("Gemini")
+
+
+def _model_semaphore(model_name: str) -> asyncio.Semaphore:
+    if model_name not in _model_semaphores:
+        _model_semaphores[model_name] = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENCY)
+    return _model_semaphores[model_name]
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return isinstance(error, google_exceptions.ResourceExhausted) or "429" in str(error)
+
+
+def _audio_bytes(audio: Union[str, IO[bytes]], limit: int) -> Optional[bytes]:
+    """Contenido del audio si no supera limit bytes (para enviarlo inline), si no None."""
+    if isinstance(audio, str):
+        if os.path.getsize(audio) > limit:
+            return None
+        with open(audio, "rb") as f:
+            return f.read()
+    start = audio.tell()
+    data = audio.read(limit + 1)
+    audio.seek(start)
+    return data if len(data) <= limit else None
+
+
+def _sha256(audio: Union[str, IO[bytes]]) -> str:
+    digest = hashlib.sha256()
+    f = open(audio, "rb") if isinstance(audio, str) else audio
+    start = f.tell()
+    try:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    finally:
+        if isinstance(audio, str):
+            f.close()
+        else:
+            f.seek(start)
+    return digest.hexdigest()
+
+
+def _failed(task: asyncio.Task) -> bool:
+    return task.cancelled() or task.exception() is not None
+
+
+class _Upload:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.last_used = time.monotonic()
+
+
+class GeminiFiles:
+    """
+    Audios subidos a la API de archivos, por SHA-256 del contenido: un
+    reintento (o una subida simultánea del mismo audio) reutiliza el
+    archivo remoto en vez de subirlo y esperar su procesamiento otra vez.
+    Los archivos sin uso durante ttl segundos se borran en segundo plano.
+    """
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._uploads: "OrderedDict[str, _Upload]" = OrderedDict()
+        self._deletions = set()
+
+    async def get(self, audio: Union[str, IO[bytes]], mime_type: Optional[str]):
+        """Archivo remoto ACTIVE con el contenido de audio (subido una sola vez)."""
+        digest = await asyncio.to_thread(_sha256, audio)
+        self._expire()
+
+        upload = self._uploads.get(digest)
+        if upload is None or (upload.task.done() and _failed(upload.task)):
+            upload = _Upload(asyncio.create_task(self._upload(audio, mime_type)))
+            self._uploads[digest] = upload
+        else:
+            logger.info(f"♻️ Reutilizando archivo de Gemini ({digest[:12]})")
+        upload.last_used = time.monotonic()
+        self._uploads.move_to_end(digest)
+        return await asyncio.shield(upload.task)
+
+    @staticmethod
+    async def _upload(audio: Union[str, IO[bytes]], mime_type: Optional[str]):
+        """Sube el audio y espera a que esté ACTIVE."""
+        logger.info(f"📤 Subiendo audio a Gemini: {audio if isinstance(audio, str) else mime_type}")
+        # La API de archivos solo es síncrona: en un hilo
+        audio_file = await asyncio.to_thread(genai.upload_file, path=audio, mime_type=mime_type)
+
+        wait_time = 0
+        while audio_file.state.name == "PROCESSING" and wait_time < FILE_MAX_WAIT_SECONDS:
+            logger.info(f"⏳ Esperando que archivo esté listo... ({wait_time}s)")
+            await asyncio.sleep(FILE_POLL_SECONDS)
+            wait_time += FILE_POLL_SECONDS
+            audio_file = await asyncio.to_thread(genai.get_file, audio_file.name)
+
+        if audio_file.state.name != "ACTIVE":
+            raise ValueError(f"Archivo no está activo después de {FILE_MAX_WAIT_SECONDS}s: {audio_file.state.name}")
+        return audio_file
+
+    def _expire(self):
+        """Descarta subidas fallidas y borra (sin esperar) las vencidas o sobrantes."""
+        now = time.monotonic()
+        for digest, upload in list(self._uploads.items()):
+            if not upload.task.done():
+                continue
+            expired = now - upload.last_used > self.ttl or len(self._uploads) > self.max_entries
+            if _failed(upload.task):
+                del self._uploads[digest]
+            elif expired:
+                del self._uploads[digest]
+                self._delete(upload.task.result().name)
+
+    def _delete(self, name: str):
+        task = asyncio.create_task(asyncio.to_thread(genai.delete_file, name))
+        self._deletions.add(task)
+        task.add_done_callback(self._deleted)
+
+    def _deleted(self, task: asyncio.Task):
+        self._deletions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"No se pudo borrar un archivo de Gemini: {task.exception()}")
+
+    async def close(self):
+        """Borra todos los archivos remotos (apagado del servidor)."""
+        for upload in self._uploads.values():
+            if not upload.task.done():
+                upload.task.cancel()
+            elif not _failed(upload.task):
+                self._delete(upload.task.result().name)
+        self._uploads.clear()
+        if self._deletions:
+            await asyncio.gather(*self._deletions, return_exceptions=True)
+
+
+# Compartido por todas las instancias de GeminiService del proceso
+gemini_files = GeminiFiles(settings.GEMINI_FILE_TTL_SECONDS, settings.GEMINI_FILE_CACHE_ENTRIES)
+
+
+def _parse_json(text: str) -> Dict[str, Any]:
+    # Limpiar posible markdown ```json ... ```
+    return json.loads(text.replace("```json", "").replace("```", "").strip())
+
+
 class GeminiService:
     def __init__(self):
         if settings.GEMINI_API_KEY:
@@ -19,31 +232,53 @@ class GeminiService:
             self.reasoning_model = None
             logger.warning("⚠️ GEMINI_API_KEY no configurada.")
 
-    async def transcribe_audio(self, audio_path: str) -> str:
+    async def _generate(self, model, contents, label: str) -> str:
+        """
+        generate_content_async con el limitador del proceso, el semáforo del
+        modelo y reintentos con backoff exponencial ante 429.
+        """
+        semaphore = _model_semaphore(model.model_name)
+        max_retries = settings.GEMINI_MAX_RETRIES
+
+        for attempt in range(max_retries + 1):
+            try:
+                async with semaphore:
+                    await rate_limiter.acquire()
+                    response = await model.generate_content_async(contents)
+                return response.text
+            except Exception as e:
+                if _is_rate_limited(e) and attempt < max_retries:
+                    rate_limiter.drain()
+                    sleep_time = RETRY_BASE_SECONDS * (2 ** attempt) * (1 + random.random() / 4)
+                    logger.warning(f"⚠️ {label}: cuota excedida (429). Reintentando en {sleep_time:.1f}s... (Intento {attempt + 1}/{max_retries})")
+                    await asyncio.sleep(sleep_time)
+                else:
+                    raise
+
+    async def transcribe_audio(self, audio: Union[str, IO[bytes]], mime_type: Optional[str] = None) -> str:
         """
         Transcribe audio utilizando Gemini 1.5 Flash (Multimodal).
-        Sube el archivo a la API de Gemini y solicita la transcripción.
+        Los clips de hasta GEMINI_INLINE_AUDIO_MAX_BYTES van inline en la
+        solicitud; los más largos se suben a la API de archivos (ruta o
+        archivo en memoria con mime_type), reutilizando la subida si el
+        mismo contenido ya está en Gemini.
         """
         if not self.basic_model:
             raise ValueError("Gemini no está configurado. Verifica GEMINI_API_KEY.")
 
         try:
-            logger.info(f"📤 Subiendo audio a Gemini: {audio_path}")
-            # Subir archivo usando la API de File
-            audio_file = genai.upload_file(path=audio_path)
+            if mime_type is None and isinstance(audio, str):
+                mime_type = mimetypes.guess_type(audio)[0]
             
-            # Esperar a que el archivo esté en estado ACTIVE
-            import time
-            max_wait = 30  # máximo 30 segundos
-            wait_time = 0
-            while audio_file.state.name == "PROCESSING" and wait_time < max_wait:
-                logger.info(f"⏳ Esperando que archivo esté listo... ({wait_time}s)")
-                time.sleep(2)
-                wait_time += 2
-                audio_file = genai.get_file(audio_file.name)
-            
-            if audio_file.state.name != "ACTIVE":
-                raise ValueError(f"Archivo no está activo después de {max_wait}s: {audio_file.state.name}")
+            # Clips cortos inline: sin subida ni espera de procesamiento
+            data = None
+            if mime_type:
+                data = await asyncio.to_thread(_audio_bytes, audio, settings.GEMINI_INLINE_AUDIO_MAX_BYTES)
+            if data is not None:
+                logger.info(f"📤 Audio inline a Gemini ({len(data) / 1024:.0f} KB, {mime_type})")
+                audio_part = {"mime_type": mime_type, "data": data}
+            else:
+                audio_part = await gemini_files.get(audio, mime_type)
             
             # Prompt para transcripción médica precisa
             prompt = """
@@ -55,25 +290,9 @@ class GeminiService:
             """
 
             logger.info("🧠 Generando transcripción con Gemini...")
-            
-            # Retry Logic para 429 Resource Exhausted
-            import time
-            max_retries = 3
-            base_delay = 2
-            
-            for attempt in range(max_retries + 1):
-                try:
-                    response = self.basic_model.generate_content([prompt, audio_file])
-                    text = response.text
-                    logger.info(f"✅ Transcripción Gemini completada ({len(text)} caracteres)")
-                    return text
-                except Exception as e:
-                    if "429" in str(e) and attempt < max_retries:
-                        sleep_time = base_delay * (2 ** attempt)
-                        logger.warning(f"⚠️ Cuota excedida (429). Reintentando en {sleep_time}s... (Intento {attempt + 1}/{max_retries})")
-                        time.sleep(sleep_time)
-                    else:
-                        raise e
+            text = await self._generate(self.basic_model, [prompt, audio_part], "Transcripción")
+            logger.info(f"✅ Transcripción Gemini completada ({len(text)} caracteres)")
+            return text
 
         except Exception as e:
             logger.error(f"❌ Error en transcripción Gemini: {e}")
@@ -87,6 +306,16 @@ class GeminiService:
         if not self.basic_model:
             raise ValueError("Gemini no está configurado.")
 
+        # Solicitudes idénticas simultáneas comparten una sola llamada
+        key = cache_key("ner", self.basic_model.model_name, NER_PROMPT_VERSION, text)
+        return await gemini_flight.do(key, lambda: self._extract_entities(text))
+
+    async def _extract_entities(self, text: str) -> dict:
+        cached = await llm_cache.get("ner", self.basic_model.model_name, NER_PROMPT_VERSION, text)
+        if cached is not None:
+            logger.info("⚡ NER v2.0 desde caché")
+            return cached
+
         prompt = f"""
 Actúa como un experto forense peruano del IMLCF. Analiza el texto de necropsia y extrae información estructurada.
 
@@ -155,27 +384,10 @@ Responde SOLO con JSON válido, sin markdown ni comentarios.
         
         try:
             logger.info("🔍 Extrayendo entidades v2.0 con Gemini...")
-            # Retry Logic para 429 Resource Exhausted
-            import time
-            max_retries = 3
-            base_delay = 2
-            
-            for attempt in range(max_retries + 1):
-                try:
-                    response = self.basic_model.generate_content(prompt)
-                    # Limpiar posible markdown ```json ... ```
-                    clean_text = response.text.replace("```json", "").replace("```", "").strip()
-                    import json
-                    result = json.loads(clean_text)
-                    logger.info(f"✅ NER v2.0: {len(result.get('mapped_fields', {}))} campos extraídos")
-                    return result
-                except Exception as e:
-                    if "429" in str(e) and attempt < max_retries:
-                        sleep_time = base_delay * (2 ** attempt)
-                        logger.warning(f"⚠️ Cuota NER excedida (429). Reintentando en {sleep_time}s... (Intento {attempt + 1}/{max_retries})")
-                        time.sleep(sleep_time)
-                    else:
-                        raise e
+            result = _parse_json(await self._generate(self.basic_model, prompt, "NER"))
+            logger.info(f"✅ NER v2.0: {len(result.get('mapped_fields', {}))} campos extraídos")
+            await llm_cache.put("ner", self.basic_model.model_name, NER_PROMPT_VERSION, text, result)
+            return result
         except Exception as e:
             return {"entities": [], "mapped_fields": {}}
 
@@ -187,6 +399,16 @@ Responde SOLO con JSON válido, sin markdown ni comentarios.
         if not self.reasoning_model:
             raise ValueError("Gemini 3 (Reasoning) no está configurado.")
 
+        key = cache_key("death_cause", self.reasoning_model.model_name, DEATH_CAUSE_PROMPT_VERSION, findings_text)
+        return await gemini_flight.do(key, lambda: self._analyze_death_cause(findings_text))
+
+    async def _analyze_death_cause(self, findings_text: str) -> dict:
+        model_name = self.reasoning_model.model_name
+        cached = await llm_cache.get("death_cause", model_name, DEATH_CAUSE_PROMPT_VERSION, findings_text)
+        if cached is not None:
+            logger.info("⚡ Gemini 3: análisis desde caché")
+            return cached
+
         prompt = f"""
         Actúa como un Médico Legista Senior.
         Analiza los siguientes HALLAZGOS DE NECROPSIA y razona paso a paso para determinar la Causa de Muerte.
@@ -212,28 +434,11 @@ Responde SOLO con JSON válido, sin markdown ni comentarios.
 
         try:
             logger.info("🧠 Gemini 3 Thinking: Analizando causa de muerte...")
-            
-            # Retry Logic
-            import time
-            max_retries = 3
-            base_delay = 2
-            
-            for attempt in range(max_retries + 1):
-                try:
-                    response = self.reasoning_model.generate_content(prompt)
-                    clean_text = response.text.replace("```json", "").replace("```", "").strip()
-                    import json
-                    result = json.loads(clean_text)
-                    logger.info("✅ Gemini 3: Análisis completado.")
-                    return result
-                except Exception as e:
-                    if "429" in str(e) and attempt < max_retries:
-                        sleep_time = base_delay * (2 ** attempt)
-                        logger.warning(f"⚠️ Gemini 3 Busy (429). Reintentando en {sleep_time}s...")
-                        time.sleep(sleep_time)
-                    else:
-                        raise e
-                        
+            result = _parse_json(await self._generate(self.reasoning_model, prompt, "Gemini 3"))
+            logger.info("✅ Gemini 3: Análisis completado.")
+            await llm_cache.put("death_cause", model_name, DEATH_CAUSE_PROMPT_VERSION, findings_text, result)
+            return result
+
         except Exception as e:
             logger.error(f"❌ Error Gemini 3 Reasoning: {e}")
             raise
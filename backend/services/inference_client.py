@@ -0,0 +1,138 @@
+"""
+Cliente del servidor local de inferencia (ver services/inference_server).
+
+Cada worker de uvicorn abre una sola conexión al socket Unix y multiplexa
+sus solicitudes por id: una tarea lectora entrega cada respuesta a quien
+la espera. Si el servidor se reinicia, la siguiente solicitud reconecta.
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+
+from core.config import settings
+from services.inference_server import read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceUnavailable(Exception):
+    """El servidor de inferencia no responde o cerró la conexión."""
+
+
+class InferenceClient:
+    """Conexión compartida de un worker web con el servidor de inferencia."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.socket_path)
+
+    async def _connection(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                try:
+                    self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                except OSError as e:
+                    raise InferenceUnavailable(f"Servidor de inferencia no disponible en {self.socket_path}: {e}")
+                self._reader_task = asyncio.create_task(self._read_responses(self._reader, self._writer))
+            return self._writer
+
+    async def _read_responses(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header, _ = await read_frame(reader)
+                future = self._pending.pop(header.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(header)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Conexión con el servidor de inferencia perdida: {e}")
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._drop(InferenceUnavailable("Conexión con el servidor de inferencia cerrada"))
+
+    def _drop(self, error: Exception):
+        """Cierra la conexión y falla las solicitudes en curso."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def _request(self, header: Dict[str, Any], payload=b"") -> Dict[str, Any]:
+        writer = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self._write_lock:
+                write_frame(writer, {**header, "id": request_id}, payload)
+                await writer.drain()
+            response = await asyncio.wait_for(future, self.timeout)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            raise InferenceUnavailable(f"Servidor de inferencia: {str(e) or type(e).__name__}")
+        finally:
+            self._pending.pop(request_id, None)
+
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    async def transcribe(
+        self,
+        audio: Union[str, np.ndarray],
+        beam_size: int,
+        vad_filter: bool = False,
+        initial_prompt: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> str:
+        """Una pasada de Whisper en el servidor (ruta local o PCM float32 16 kHz)."""
+        header = {
+            "op": "transcribe",
+            "model": model,
+            "beam_size": beam_size,
+            "vad_filter": vad_filter,
+            "initial_prompt": initial_prompt,
+        }
+        if isinstance(audio, str):
+            header["path"] = audio
+            payload = b""
+        else:
+            payload = memoryview(np.ascontiguousarray(audio, dtype="<f4")).cast("B")
+        response = await self._request(header, payload)
+        return response["text"]
+
+    async def status(self) -> Dict[str, Any]:
+        """Estado de los modelos y de la cola del servidor."""
+        response = await self._request({"op": "status"})
+        response.pop("id", None)
+        return response
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+        self._drop(InferenceUnavailable("Cliente de inferencia cerrado"))
+
+
+# Singleton (inactivo si INFERENCE_SOCKET está vacío)
+inference_client = InferenceClient(settings.INFERENCE_SOCKET, settings.INFERENCE_TIMEOUT_SECONDS)
@@ -0,0 +1,171 @@
+"""
+Servidor local de inferencia: una sola copia de los modelos para todos los
+workers de uvicorn.
+
+Con varios workers cada proceso cargaría su propio Whisper (la RAM se
+multiplica por el número de workers). Este proceso es dueño de los modelos
+y atiende a los workers por un socket Unix: las solicitudes de todos llegan
+a una misma cola, que drenan num_workers pasadas en paralelo sobre el mismo
+modelo. Los workers solo hacen HTTP y escalan por núcleos sin costo de
+memoria.
+
+Las solicitudes no se agrupan en un lote: WhisperModel.transcribe procesa un
+audio por llamada (segmentación en ventanas de 30 s, VAD y prompt propios),
+así que el paralelismo viene de las num_workers réplicas de CTranslate2 que
+comparten los pesos. Un lote entre solicitudes exigiría reimplementar esa
+decodificación sobre CTranslate2.
+
+Protocolo (por conexión, solicitudes multiplexadas por "id"): cada mensaje
+es una cabecera de 8 bytes (!II: largo del JSON, largo del payload), el
+JSON y el payload binario. Para "transcribe" el payload es PCM float32
+16 kHz mono (o vacío si la cabecera trae "path" a un archivo local).
+
+Uso:
+    INFERENCE_SOCKET=/tmp/coroneria-inference.sock python -m services.inference_server
+    INFERENCE_SOCKET=/tmp/coroneria-inference.sock uvicorn main:app
+
+Con varios workers de uvicorn (--workers N) los límites de Gemini
+(GEMINI_REQUESTS_PER_MINUTE, GEMINI_MAX_CONCURRENCY, GEMINI_BURST) y los
+pools de render y bcrypt son por worker: dividirlos entre N.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import sys
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+from core.config import settings
+from services.model_registry import ModelRegistry, run_whisper, whisper_models
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("!II")
+MAX_HEADER_BYTES = 64 * 1024
+MAX_PAYLOAD_BYTES = 1024 * 1024 * 1024
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    """Lee un mensaje; lanza IncompleteReadError si la conexión se cerró."""
+    header_len, payload_len = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if header_len > MAX_HEADER_BYTES or payload_len > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Mensaje demasiado grande ({header_len} + {payload_len} bytes)")
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+def write_frame(writer: asyncio.StreamWriter, header: Dict[str, Any], payload=b""):
+    """Escribe un mensaje (el llamador hace drain y serializa las escrituras)."""
+    data = json.dumps(header).encode()
+    writer.write(FRAME_HEADER.pack(len(data), len(payload)) + data)
+    if len(payload):
+        writer.write(payload)
+
+
+class InferenceServer:
+    """Cola única de inferencia atendida por num_workers pasadas en paralelo."""
+
+    def __init__(self, socket_path: str, registry: ModelRegistry):
+        self.socket_path = socket_path
+        self.registry = registry
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._served = 0
+        self._connections = set()
+
+    async def serve(self):
+        self.registry.preload()
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.registry.workers())]
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # socket de una ejecución anterior
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Servidor de inferencia escuchando en {self.socket_path} ({len(workers)} en paralelo)")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in workers:
+                task.cancel()
+            for writer in list(self._connections):
+                writer.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Una conexión por worker web; las respuestas salen en orden de término."""
+        write_lock = asyncio.Lock()
+        self._connections.add(writer)
+
+        async def respond(header: Dict[str, Any]):
+            async with write_lock:
+                write_frame(writer, header)
+                await writer.drain()
+
+        try:
+            while True:
+                header, payload = await read_frame(reader)
+                op = header.get("op")
+                if op == "transcribe":
+                    self._queue.put_nowait((header, payload, respond))
+                elif op == "status":
+                    await respond({
+                        "id": header.get("id"),
+                        "whisper": self.registry.status(),
+                        "queued": self._queue.qsize(),
+                        "served": self._served,
+                    })
+                else:
+                    await respond({"id": header.get("id"), "error": f"Operación desconocida: {op}"})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # el worker cerró la conexión
+        except Exception as e:
+            logger.error(f"Conexión de inferencia cerrada por error: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _worker(self):
+        while True:
+            header, payload, respond = await self._queue.get()
+            response: Dict[str, Any] = {"id": header.get("id")}
+            try:
+                model = await self.registry.get(header.get("model"))
+                audio = header["path"] if header.get("path") else np.frombuffer(payload, dtype="<f4")
+                response["text"] = await asyncio.to_thread(
+                    run_whisper, model, audio,
+                    header.get("beam_size", 5),
+                    header.get("vad_filter", False),
+                    header.get("initial_prompt"),
+                )
+                self._served += 1
+            except Exception as e:
+                logger.error(f"Error en inferencia: {e}")
+                response["error"] = str(e)
+            try:
+                await respond(response)
+            except Exception:
+                pass  # el worker web se desconectó antes de la respuesta
+
+
+async def main():
+    if not settings.INFERENCE_SOCKET:
+        print("[ERROR] Definir INFERENCE_SOCKET (ruta del socket Unix)")
+        sys.exit(1)
+    await InferenceServer(settings.INFERENCE_SOCKET, whisper_models).serve()
+
+
+if __name__ == "__main__":
+    from core.logging_config import setup_logging
+
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,181 @@
+"""
+Caché persistente de respuestas de LLM (Gemini, Azure OpenAI).
+
+Repetir "extraer" o un reintento del frontend con el mismo texto no vuelve a
+llamar al modelo: la respuesta se guarda en una base SQLite local
+(data/llm_cache.db) con clave SHA-256 de (tipo de llamada, modelo, versión
+del prompt, texto normalizado). Subir la versión del prompt invalida sus
+entradas anteriores. Las entradas vencen a los LLM_CACHE_TTL_SECONDS y el
+tamaño total se limita a LLM_CACHE_MAX_BYTES desalojando las menos usadas.
+Solo se guardan respuestas exitosas; el texto del dictado no se almacena.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import aiosqlite
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = Path(settings.CORONERIA_DATA) / "llm_cache.db"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Misma clave para el mismo dictado aunque cambien espacios o la forma Unicode."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(kind: str, model: str, prompt_version: str, text: str) -> str:
+    payload = "\x1f".join((kind, model, prompt_version, normalize_text(text)))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Respuestas JSON en SQLite con TTL y desalojo LRU bajo un presupuesto de bytes."""
+
+    def __init__(self, path: Path, ttl: int, max_bytes: int, enabled: bool = True):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._bytes = 0
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+
+    async def _connection(self) -> aiosqlite.Connection:
+        async with self._open_lock:
+            if self._db is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                db = await aiosqlite.connect(self.path)
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.execute("PRAGMA synchronous = NORMAL")
+                await db.execute(f"PRAGMA busy_timeout = {int(settings.DB_BUSY_TIMEOUT_MS)}")
+                await db.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        key TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+                await db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_used ON llm_cache(last_used)")
+                await db.commit()
+                self._db = db
+                await self._evict()
+            return self._db
+
+    async def get(self, kind: str, model: str, prompt_version: str, text: str) -> Optional[Dict[str, Any]]:
+        """Respuesta guardada (y la marca como usada), o None."""
+        if not self.enabled:
+            return None
+        key = cache_key(kind, model, prompt_version, text)
+        now = time.time()
+        try:
+            db = await self._connection()
+            cursor = await db.execute(
+                "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl)
+            )
+            row = await cursor.fetchone()
+            if row is not None:
+                await db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+                await db.commit()
+        except Exception as e:
+            # La caché nunca debe impedir la llamada al modelo
+            logger.warning(f"Caché LLM no disponible: {e}")
+            row = None
+
+        if row is None:
+            self.misses[kind] += 1
+            return None
+        self.hits[kind] += 1
+        return json.loads(row[0])
+
+    async def put(self, kind: str, model: str, prompt_version: str, text: str, response: Dict[str, Any]):
+        """Guarda una respuesta exitosa y desaloja si se excede el presupuesto."""
+        if not self.enabled:
+            return
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        try:
+            db = await self._connection()
+            await db.execute(
+                """INSERT OR REPLACE INTO llm_cache (key, kind, model, response, size, created_at, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (cache_key(kind, model, prompt_version, text), kind, model, data, size, now, now)
+            )
+            await db.commit()
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                await self._evict()
+        except Exception as e:
+            logger.warning(f"No se pudo guardar en la caché LLM: {e}")
+
+    async def _evict(self):
+        """Borra lo vencido y, si hace falta, lo menos usado hasta caber en max_bytes."""
+        db = self._db
+        await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        # Suma acumulada desde la más reciente: se conservan las que caben
+        await db.execute(
+            """DELETE FROM llm_cache WHERE key IN (
+                   SELECT key FROM (
+                       SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running
+                       FROM llm_cache
+                   ) WHERE running > ?
+               )""",
+            (self.max_bytes,)
+        )
+        await db.commit()
+        cursor = await db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache")
+        self._bytes = (await cursor.fetchone())[0]
+
+    async def stats(self) -> Dict[str, Any]:
+        db = await self._connection()
+        cursor = await db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache")
+        entries, size = await cursor.fetchone()
+        kinds = sorted(set(self.hits) | set(self.misses))
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "by_kind": {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in kinds},
+        }
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+# Singleton
+llm_cache = LLMCache(
+    CACHE_PATH,
+    settings.LLM_CACHE_TTL_SECONDS,
+    settings.LLM_CACHE_MAX_BYTES,
+    settings.LLM_CACHE_ENABLED,
+)
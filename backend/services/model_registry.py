@@ -0,0 +1,175 @@
+"""
+Registro de modelos Whisper (faster-whisper / CTranslate2).
+
+Los modelos se configuran en Settings.WHISPER_MODELS (tamaño, ruta local,
+tipo de cómputo, hilos de CPU). El modelo por defecto se precarga en
+segundo plano al iniciar el servidor y se calienta con una inferencia
+corta, así la primera transcripción no paga la carga (decenas de
+segundos). El estado de cada modelo se reporta en /health.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+
+from core.config import settings, WhisperModelConfig
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SECONDS = 1.0
+
+
+def detect_device() -> str:
+    """cuda si CTranslate2 ve una GPU (sin importar torch), si no cpu."""
+    try:
+        import ctranslate2
+        return "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    except Exception:
+        return "cpu"
+
+
+@dataclass
+class ModelState:
+    name: str
+    config: WhisperModelConfig
+    status: str = "idle"  # idle | loading | ready | error
+    device: Optional[str] = None
+    compute_type: Optional[str] = None
+    load_seconds: Optional[float] = None
+    warmup_seconds: Optional[float] = None
+    error: Optional[str] = None
+    model: Any = None
+    task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "size": self.config.size,
+            "device": self.device,
+            "compute_type": self.compute_type,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+    """Carga única (compartida entre solicitudes) de los modelos configurados."""
+
+    def __init__(self, configs: Dict[str, WhisperModelConfig], default: str):
+        self.default = default
+        self._states = {name: ModelState(name, config) for name, config in configs.items()}
+
+    def _state(self, name: Optional[str]) -> ModelState:
+        name = name or self.default
+        if name not in self._states:
+            raise KeyError(f"Modelo Whisper no configurado: {name}")
+        return self._states[name]
+
+    def preload(self, name: Optional[str] = None):
+        """Inicia la carga en segundo plano (no espera)."""
+        state = self._state(name)
+        if state.task is None or (state.status == "error" and state.task.done()):
+            state.status = "loading"
+            state.error = None
+            state.task = asyncio.create_task(self._load(state))
+
+    async def get(self, name: Optional[str] = None):
+        """Modelo listo para usar; espera su carga (o la inicia) si hace falta."""
+        state = self._state(name)
+        self.preload(state.name)
+        await asyncio.shield(state.task)
+        if state.status != "ready":
+            raise RuntimeError(f"No se pudo cargar Whisper '{state.name}': {state.error}")
+        return state.model
+
+    async def _load(self, state: ModelState):
+        try:
+            start = time.perf_counter()
+            state.model = await asyncio.to_thread(self._build, state)
+            state.load_seconds = round(time.perf_counter() - start, 2)
+
+            # Calentar: la primera inferencia inicializa kernels y buffers
+            start = time.perf_counter()
+            await asyncio.to_thread(self._warmup, state.model)
+            state.warmup_seconds = round(time.perf_counter() - start, 2)
+
+            state.status = "ready"
+            logger.info(
+                f"Whisper '{state.name}' listo en {state.device}/{state.compute_type} "
+                f"(carga {state.load_seconds}s, calentamiento {state.warmup_seconds}s)"
+            )
+        except Exception as e:
+            state.status = "error"
+            state.error = str(e)
+            logger.error(f"Error cargando Whisper '{state.name}': {e}")
+
+    @staticmethod
+    def _build(state: ModelState):
+        from faster_whisper import WhisperModel
+
+        config = state.config
+        state.device = detect_device() if config.device == "auto" else config.device
+        if config.compute_type == "auto":
+            state.compute_type = "float16" if state.device == "cuda" else "int8"
+        else:
+            state.compute_type = config.compute_type
+
+        # Ruta local si existe (modelo convertido a CTranslate2), si no el tamaño
+        path = config.path or os.path.join(settings.CORONERIA_MODELS, "whisper", config.size)
+        source = path if os.path.isdir(path) else config.size
+        logger.info(f"Cargando Whisper '{state.name}' ({source}) en {state.device}...")
+        return WhisperModel(
+            source,
+            device=state.device,
+            compute_type=state.compute_type,
+            cpu_threads=config.cpu_threads,
+            num_workers=config.num_workers,
+            download_root=os.path.join(settings.CORONERIA_MODELS, "whisper"),
+        )
+
+    @staticmethod
+    def _warmup(model):
+        audio = np.zeros(int(16000 * WARMUP_SECONDS), dtype=np.float32)
+        segments, _ = model.transcribe(audio, language="es", beam_size=1)
+        list(segments)
+
+    def workers(self, name: Optional[str] = None) -> int:
+        """Pasadas simultáneas que admite el modelo (num_workers)."""
+        return max(1, self._state(name).config.num_workers)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "default": self.default,
+            "ready": self.default in self._states and self._states[self.default].status == "ready",
+            "models": {name: state.to_dict() for name, state in self._states.items()},
+        }
+
+
+def run_whisper(
+    model,
+    audio: Union[str, np.ndarray],
+    beam_size: int,
+    vad_filter: bool = False,
+    initial_prompt: Optional[str] = None,
+) -> str:
+    """Una pasada de Whisper (CPU/GPU-bound: llamar desde un hilo)."""
+    # transcribe() es perezoso: el trabajo ocurre al iterar los segmentos
+    segments, info = model.transcribe(
+        audio,
+        language="es",
+        initial_prompt=initial_prompt,
+        beam_size=beam_size,
+        vad_filter=vad_filter,
+        condition_on_previous_text=False,
+    )
+    return " ".join(s.text for s in segments)
+
+
+# Singleton
+whisper_models = ModelRegistry(settings.WHISPER_MODELS, settings.WHISPER_DEFAULT_MODEL)
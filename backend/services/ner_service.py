@@ -11,10 +11,17 @@ from typing import Dict, Any, List
 
 from core.config import settings
 from services.gemini_service import GeminiService
+from services.llm_cache import cache_key, llm_cache
+from services.single_flight import SingleFlight
 from services.validation_service import ValidationService
 
 logger = logging.getLogger(__name__)
 
+ner_flight = SingleFlight("NER")
+
+# Versión de SYSTEM_PROMPT_NER (clave de llm_cache): subirla al cambiar el prompt
+AZURE_NER_PROMPT_VERSION = "v2-1"
+
 # System prompt para Azure OpenAI
 SYSTEM_PROMPT_NER = """
 Eres un especialista forense experto en estructurar información de protocolos de necropsia.
@@ -148,7 +155,11 @@ class NERService:
     
     async def extract_and_map(self, text: str) -> Dict[str, Any]:
         """Extrae entidades y mapea a campos del protocolo."""
-        
+        # Un doble envío del mismo dictado comparte una sola extracción
+        key = cache_key("extract_and_map", self._mode, "", text)
+        return await ner_flight.do(key, lambda: self._extract_and_map(text))
+    
+    async def _extract_and_map(self, text: str) -> Dict[str, Any]:
         if self._mode == "azure":
             return await self._extract_azure(text)
         elif self._mode == "gemini":
@@ -182,6 +193,11 @@ class NERService:
                     azure_endpoint=settings.AZURE_OPENAI_ENDPOINT
                 )
             
+            cached = await llm_cache.get("ner_azure", settings.AZURE_OPENAI_MODEL, AZURE_NER_PROMPT_VERSION, text)
+            if cached is not None:
+                cached["mode"] = "azure"
+                return cached
+            
             response = self._azure_client.chat.completions.create(
                 model=settings.AZURE_OPENAI_MODEL,
                 messages=[
@@ -194,6 +210,7 @@ class NERService:
             )
             
             result = json.loads(response.choices[0].message.content)
+            await llm_cache.put("ner_azure", settings.AZURE_OPENAI_MODEL, AZURE_NER_PROMPT_VERSION, text, result)
             result["mode"] = "azure"
             
             return result
@@ -0,0 +1,134 @@
+"""
+Caché de PDFs direccionada por contenido.
+
+Cada PDF se guarda como <case_id>_<clave>.pdf, donde la clave es el hash de
+las secciones usadas por la plantilla más su versión: si el caso no cambió,
+la reimpresión se sirve desde disco sin volver a renderizar. El tamaño total
+se limita a PDF_CACHE_MAX_BYTES desalojando los menos usados (LRU por mtime,
+que se actualiza en cada acierto y sobrevive reinicios).
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(case_data: Dict[str, Any], template_version: str) -> str:
+    """Hash estable de los datos de la plantilla (independiente del orden de claves)."""
+    payload = json.dumps(case_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{template_version}\x1f{payload}".encode("utf-8")).hexdigest()[:32]
+
+
+class PdfCache:
+    """Directorio de PDFs con desalojo LRU bajo un presupuesto de bytes."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # nombre -> tamaño (LRU primero)
+        self._total = 0
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        """Indexa los PDFs existentes, del menos al más recientemente usado."""
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".pdf")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in files:
+            size = entry.stat().st_size
+            self._entries[entry.name] = size
+            self._total += size
+        self._loaded = True
+
+    def path_for(self, case_id: str, key: str) -> Path:
+        return self.directory / f"{case_id}_{key}.pdf"
+
+    def get(self, case_id: str, key: str) -> Optional[Path]:
+        """Ruta del PDF en caché (y lo marca como usado), o None."""
+        path = self.path_for(case_id, key)
+        self._load()
+        if path.name not in self._entries or not path.exists():
+            self._entries.pop(path.name, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(path.name)
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def open(self, path: Path) -> Optional[BinaryIO]:
+        """
+        Abre un PDF para enviarlo, o None si ya fue desalojado. El archivo
+        abierto sigue legible aunque otro worker lo desaloje después (POSIX)
+        o no se puede borrar mientras se envía (Windows, ver _remove).
+        """
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            self._entries.pop(path.name, None)
+            return None
+
+    def put(self, path: Path):
+        """Registra un PDF recién renderizado y desaloja si se excede el presupuesto."""
+        size = path.stat().st_size
+        self._load()
+        self._total += size - self._entries.pop(path.name, 0)
+        self._entries[path.name] = size
+        self._evict(keep=path.name)
+
+    def _evict(self, keep: str):
+        for name, size in list(self._entries.items()):
+            if self._total <= self.max_bytes:
+                break
+            if name != keep:
+                self._remove(name, size)
+
+    def _remove(self, name: str, size: int):
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Windows: el archivo puede estar abierto (descarga en curso)
+            logger.warning(f"No se pudo desalojar {name}: {e}")
+            return
+        del self._entries[name]
+        self._total -= size
+
+    def invalidate(self, case_id: str):
+        """Elimina las versiones en caché de un caso (sus secciones cambiaron)."""
+        prefix = f"{case_id}_"
+        self._load()
+        for name, size in [(n, s) for n, s in self._entries.items() if n.startswith(prefix)]:
+            self._remove(name, size)
+
+    def stats(self) -> Dict[str, int]:
+        self._load()
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Singleton
+pdf_cache = PdfCache(Path(settings.CORONERIA_EXPORTS) / "pdf_cache", settings.PDF_CACHE_MAX_BYTES)
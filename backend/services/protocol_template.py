@@ -0,0 +1,629 @@
+"""
+Plantilla del Protocolo de Necropsia IMLCF (v2.0).
+
+El protocolo se describe de forma declarativa (secciones, grupos, órganos y
+campos con su ruta en el JSON del caso) y se compila una sola vez, al
+importar el módulo, en una cadena de funciones: cada render solo recorre los
+datos del caso y concatena fragmentos HTML ya preparados (etiquetas escapadas,
+rutas resueltas). Los campos vacíos se omiten.
+
+La hoja de estilos (STYLESHEET) no va en el HTML: el proceso de render la
+parsea una vez como objeto CSS de WeasyPrint (ver render_service).
+"""
+
+from abc import ABC, abstractmethod
+from html import escape
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+Renderer = Callable[[Any], str]
+
+STYLESHEET = """
+@page { size: A4; margin: 2cm; }
+body { font-family: 'Times New Roman', serif; font-size: 11pt; line-height: 1.4; }
+.header { text-align: center; margin-bottom: 20px; }
+.header h1 { font-size: 14pt; margin: 0; }
+.header h2 { font-size: 12pt; font-weight: normal; margin: 5px 0; }
+.section { margin-bottom: 15px; }
+.section-title { font-weight: bold; font-size: 12pt; border-bottom: 1px solid #000; margin-bottom: 10px; }
+.group { margin: 0 0 8px 10px; break-inside: avoid; }
+.group-title { font-weight: bold; text-decoration: underline; margin-bottom: 4px; }
+.field { margin-bottom: 6px; }
+.field-label { font-weight: bold; }
+.text { margin: 2px 0 0 0; text-align: justify; }
+table { width: 100%; border-collapse: collapse; margin: 10px 0; }
+td, th { border: 1px solid #000; padding: 5px; text-align: left; vertical-align: top; }
+.signature { margin-top: 50px; text-align: center; }
+.signature div { width: 200px; border-top: 1px solid #000; margin: 0 auto; padding-top: 5px; }
+"""
+
+# Etiquetas de los campos de opciones del formulario (valor guardado -> texto).
+# Solo se aplican a los campos que las declaran; el texto libre va tal cual.
+SI_NO = {"si": "Sí", "no": "No", "ignora": "Ignora"}
+SEXO = {"M": "Masculino", "F": "Femenino"}
+UBICACION_LIVIDECES = {
+    "dorsales": "Dorsales", "ventrales": "Ventrales", "lateral_derecho": "Lateral derecho",
+    "lateral_izquierdo": "Lateral izquierdo", "en_pantalon": "En pantalón",
+}
+ESTADO_LIVIDECES = {
+    "modificable": "Modificable", "poco_modificable": "Poco modificable", "no_modificable": "No modificable",
+}
+UBICACION_RIGIDEZ = {
+    "mandibula": "Mandíbula", "cuello": "Cuello",
+    "miembros_superiores": "Miembros superiores", "miembros_inferiores": "Miembros inferiores",
+}
+ESTADO_RIGIDEZ = {"instalado": "Instalado", "parcial": "Parcial", "flacida": "Flácida"}
+ESTADO_CAVIDAD = {"libre": "Libre", "contenido": "Contenido"}
+FORMA_CABEZA = {
+    "normocefalo": "Normocéfalo", "dolicocefalo": "Dolicocéfalo",
+    "braquicefalo": "Braquicéfalo", "turricefalo": "Turricéfalo",
+}
+CABELLO = {"lacio": "Lacio", "ondulado": "Ondulado", "rizado": "Rizado", "calvicie": "Calvicie"}
+ETIOLOGIA = {
+    "HOMICIDA": "Homicida", "SUICIDA": "Suicida", "ACCIDENTAL": "Accidental",
+    "NATURAL": "Natural", "INDETERMINADA": "Indeterminada",
+}
+SITUACION_CADAVER = {"identificado": "Identificado", "nn": "NN", "restos_oseos": "Restos óseos"}
+
+Choices = Optional[Mapping[str, str]]
+
+
+# ============================================
+# VALORES
+# ============================================
+
+def _getter(path: str) -> Callable[[Any], Any]:
+    """Compila 'a.b.c' en una función que recorre dicts (None si falta algo)."""
+    keys = tuple(path.split(".")) if path else ()
+
+    def get(data: Any) -> Any:
+        for key in keys:
+            if not isinstance(data, dict):
+                return None
+            data = data.get(key)
+        return data
+
+    return get
+
+
+def _format(value: Any, skip_zero: bool = False, choices: Choices = None) -> Optional[str]:
+    """Texto HTML de un valor, o None si está vacío (choices: etiquetas del campo)."""
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, bool):
+        return "Sí" if value else "No"
+    if isinstance(value, (int, float)):
+        if skip_zero and value == 0:
+            return None
+        return str(int(value)) if float(value).is_integer() else str(value)
+    if isinstance(value, list):
+        items = [_format(v, choices=choices) for v in value]
+        return ", ".join(item for item in items if item) or None
+    if isinstance(value, dict):
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    if choices and text in choices:
+        return escape(choices[text])
+    return escape(text).replace("\n", "<br>")
+
+
+# ============================================
+# NODOS DE LA PLANTILLA
+# ============================================
+
+class Node(ABC):
+    @abstractmethod
+    def compile(self) -> Renderer:
+        """Función datos -> HTML (cadena vacía si no hay nada que mostrar)."""
+
+
+class Field(Node):
+    """Etiqueta: valor [unidad]."""
+
+    def __init__(self, label: str, path: str, unit: str = "", skip_zero: bool = False, choices: Choices = None):
+        self.label, self.path, self.unit, self.skip_zero = label, path, unit, skip_zero
+        self.choices = choices
+
+    def compile(self) -> Renderer:
+        get = _getter(self.path)
+        prefix = f'<div class="field"><span class="field-label">{escape(self.label)}:</span> '
+        suffix = f" {escape(self.unit)}</div>" if self.unit else "</div>"
+        skip_zero, choices = self.skip_zero, self.choices
+
+        def render(data: Any) -> str:
+            value = _format(get(data), skip_zero, choices)
+            return f"{prefix}{value}{suffix}" if value else ""
+
+        return render
+
+
+class Text(Node):
+    """Texto narrativo bajo su etiqueta."""
+
+    def __init__(self, label: str, path: str):
+        self.label, self.path = label, path
+
+    def compile(self) -> Renderer:
+        get = _getter(self.path)
+        prefix = f'<div class="field"><div class="field-label">{escape(self.label)}</div><p class="text">'
+
+        def render(data: Any) -> str:
+            value = _format(get(data))
+            return f"{prefix}{value}</p></div>" if value else ""
+
+        return render
+
+
+class Measures(Node):
+    """Medidas 3D (largo × ancho × alto)."""
+
+    def __init__(self, path: str, label: str = "Medidas"):
+        self.path, self.label = path, label
+
+    def compile(self) -> Renderer:
+        get = _getter(self.path)
+        prefix = f'<div class="field"><span class="field-label">{escape(self.label)}:</span> '
+
+        def render(data: Any) -> str:
+            medidas = get(data)
+            if not isinstance(medidas, dict):
+                return ""
+            dims = [_format(medidas.get(k), skip_zero=True) for k in ("largo", "ancho", "alto")]
+            if not any(dims):
+                return ""
+            return f"{prefix}{' × '.join(d or '—' for d in dims)} cm</div>"
+
+        return render
+
+
+class Grid(Node):
+    """Campos cortos en una tabla de N columnas: (etiqueta, ruta[, opciones])."""
+
+    def __init__(self, fields: Sequence[Tuple], columns: int = 3):
+        self.fields, self.columns = fields, columns
+
+    def compile(self) -> Renderer:
+        cells = [
+            (f"<td><strong>{escape(label)}:</strong> ", _getter(path), choices[0] if choices else None)
+            for label, path, *choices in self.fields
+        ]
+        columns = self.columns
+
+        def render(data: Any) -> str:
+            values = [(prefix, _format(get(data), choices=choices)) for prefix, get, choices in cells]
+            values = [f"{prefix}{value}</td>" for prefix, value in values if value]
+            if not values:
+                return ""
+            rows = [values[i:i + columns] for i in range(0, len(values), columns)]
+            return "<table>" + "".join(f"<tr>{''.join(row)}</tr>" for row in rows) + "</table>"
+
+        return render
+
+
+class ItemsTable(Node):
+    """Lista de objetos (prendas, objetos) como tabla."""
+
+    def __init__(self, label: str, path: str, columns: Sequence[Tuple[str, str]]):
+        self.label, self.path, self.columns = label, path, columns
+
+    def compile(self) -> Renderer:
+        get = _getter(self.path)
+        keys = [key for _, key in self.columns]
+        head = (
+            f'<div class="group"><div class="group-title">{escape(self.label)}</div><table><tr>'
+            + "".join(f"<th>{escape(label)}</th>" for label, _ in self.columns)
+            + "</tr>"
+        )
+
+        def render(data: Any) -> str:
+            items = get(data)
+            if not isinstance(items, list):
+                return ""
+            rows = [
+                "<tr>" + "".join(f"<td>{_format(item.get(key)) or ''}</td>" for key in keys) + "</tr>"
+                for item in items if isinstance(item, dict)
+            ]
+            return f"{head}{''.join(rows)}</table></div>" if rows else ""
+
+        return render
+
+
+class Group(Node):
+    """Bloque con título; se omite si todos sus hijos están vacíos."""
+
+    def __init__(self, label: str, children: Sequence[Node], path: str = ""):
+        self.label, self.children, self.path = label, children, path
+
+    def compile(self) -> Renderer:
+        get = _getter(self.path)
+        children = [child.compile() for child in self.children]
+        head = f'<div class="group"><div class="group-title">{escape(self.label)}</div>'
+
+        def render(data: Any) -> str:
+            scope = get(data)
+            body = "".join(child(scope) for child in children)
+            return f"{head}{body}</div>" if body else ""
+
+        return render
+
+
+def Structure(label: str, path: str) -> Group:
+    """Estructura anatómica: presencia, lesiones y descripción."""
+    return Group(label, [
+        Field("Presencia", "presencia", choices=SI_NO),
+        Field("Lesiones", "lesiones", choices=SI_NO),
+        Text("Descripción", "descripcion"),
+    ], path)
+
+
+def Organ(label: str, path: str, extra: Sequence[Node] = ()) -> Group:
+    """Órgano con peso y medidas."""
+    return Group(label, [
+        Field("Presencia", "presencia", choices=SI_NO),
+        Field("Lesiones", "lesiones", choices=SI_NO),
+        Field("Peso", "peso", "g", skip_zero=True),
+        Measures("medidas"),
+        *extra,
+        Text("Descripción", "descripcion"),
+        Text("Características", "caracteristicas"),
+    ], path)
+
+
+def Diagnosis(label: str, path: str) -> Group:
+    """Diagnóstico de causas de muerte con CIE-10 y etiología."""
+    return Group(label, [
+        Grid([("Causa final", "causa_final.texto"), ("CIE-10", "causa_final.cie10")], columns=2),
+        Grid([("Causa intermedia", "causa_intermedia.texto"), ("CIE-10", "causa_intermedia.cie10")], columns=2),
+        Grid([("Causa básica", "causa_basica.texto"), ("CIE-10", "causa_basica.cie10")], columns=2),
+        Field("Agente causante", "agente_causante"),
+        Grid([
+            ("Etiología médico legal", "etiologia.forma", ETIOLOGIA),
+            ("Agente", "etiologia.agente"),
+            ("Tipo de agente", "etiologia.tipo_agente"),
+        ]),
+    ], path)
+
+
+class Section(Node):
+    """Sección numerada del protocolo (una columna del caso)."""
+
+    def __init__(self, title: str, key: str, children: Sequence[Node]):
+        self.title, self.key, self.children = title, key, children
+
+    def compile(self) -> Renderer:
+        head = f'<div class="section"><div class="section-title">{escape(self.title)}</div>'
+        children = [child.compile() for child in self.children]
+        key = self.key
+
+        def render(case_data: Dict[str, Any]) -> str:
+            data = case_data.get(key)
+            content = "".join(child(data) for child in children)
+            return f"{head}{content}</div>" if content else ""
+
+        return render
+
+
+# ============================================
+# PROTOCOLO v2.0
+# ============================================
+
+PROTOCOL_LAYOUT: List[Section] = [
+    Section("I. DATOS GENERALES", "datos_generales", [
+        Grid([
+            ("Informe Nº", "numero_informe"),
+            ("Fecha", "fecha_informe"),
+            ("Inicio necropsia", "hora_inicio_necropsia"),
+            ("Término necropsia", "hora_termino_necropsia"),
+        ], columns=2),
+        Group("Fallecido", [
+            Grid([
+                ("Nombre", "nombre"), ("Apellido paterno", "apellido_paterno"),
+                ("Apellido materno", "apellido_materno"), ("Sexo", "sexo", SEXO),
+                ("Edad", "edad"), ("Talla (m)", "talla"), ("Peso (kg)", "peso"),
+                ("Raza", "raza"), ("Nacionalidad", "nacionalidad"), ("Religión", "religion"),
+                ("Estado civil", "estado_civil"), ("Ocupación", "ocupacion"),
+                ("Profesión", "profesion"),
+            ]),
+        ], "fallecido"),
+        Grid([
+            ("Lugar de fallecimiento", "lugar_fallecimiento"),
+            ("Lugar del hecho", "lugar_hecho"),
+            ("Lugar de residencia", "lugar_residencia"),
+        ]),
+        Group("Dirección", [
+            Grid([
+                ("Calle", "calle"), ("Número", "numero"), ("Interior", "interior"),
+                ("Manzana", "manzana"), ("Lote", "lote"), ("Urbanización", "urbanizacion"),
+            ]),
+        ], "direccion"),
+        Group("Informante", [
+            Grid([("Nombre", "nombre"), ("Parentesco", "parentesco")], columns=2),
+        ], "informante"),
+        Group("Participantes", [
+            Grid([
+                ("CMP médico (1)", "cm_medico_primero"),
+                ("CMP médico (2)", "cm_medico_segundo"),
+                ("Técnico de apoyo", "tecnico_apoyo"),
+                ("Autoridades presentes", "autoridades_presentes"),
+                ("Tipo de autoridad", "tipo_autoridad"),
+                ("Otras autoridades", "otras_autoridades"),
+            ]),
+        ]),
+        ItemsTable("Prendas", "prendas", [
+            ("Tipo", "tipo"), ("Color", "color"), ("Material", "material"), ("Descripción", "descripcion"),
+        ]),
+        ItemsTable("Objetos", "objetos", [
+            ("Tipo", "tipo"), ("Color", "color"), ("Estado", "estado"), ("Descripción", "descripcion"),
+        ]),
+        Text("Circunstancias de la muerte", "circunstancias_muerte"),
+    ]),
+    Section("II. FENÓMENOS CADAVÉRICOS", "fenomenos_cadavericos", [
+        Group("Fenómenos oculares", [
+            Grid([("Pupilas", "pupilas"), ("Córneas", "corneas"), ("Tensión ocular", "tension_ocular")]),
+            Text("Observaciones", "observaciones"),
+        ], "oculares"),
+        Group("Livideces", [
+            Field("Ubicación", "ubicacion", choices=UBICACION_LIVIDECES),
+            Field("Estado", "estado", choices=ESTADO_LIVIDECES),
+            Text("Observaciones", "observaciones"),
+        ], "livideces"),
+        Group("Rigidez", [
+            Field("Ubicación", "ubicacion", choices=UBICACION_RIGIDEZ),
+            Field("Estado", "estado", choices=ESTADO_RIGIDEZ),
+            Text("Observaciones", "observaciones"),
+        ], "rigidez"),
+        Group("Putrefacción", [
+            Field("Fase", "fase"), Text("Observaciones", "observaciones"),
+        ], "putrefaccion"),
+        Text("Flora y fauna cadavérica", "flora_fauna"),
+        Group("Temperaturas", [
+            Grid([("Ambiental (°C)", "ambiental"), ("Rectal (°C)", "rectal"), ("Hepática (°C)", "hepatica")]),
+        ], "temperatura"),
+        Field("Tiempo aproximado de muerte", "tiempo_muerte_horas", "horas"),
+        # Protocolo v1
+        Field("Livideces", "campo_25_livideces"),
+        Field("Rigidez", "campo_26_rigidez"),
+        Field("Tiempo Aprox. Muerte", "campo_33_tiempo_muerte"),
+    ]),
+    Section("III. EXAMEN EXTERNO", "examen_externo", [
+        Text("Descripción general", "descripcion_general"),
+        Text("Piel", "piel"),
+        Text("Cicatrices", "cicatrices"),
+        Text("Tatuajes", "tatuajes"),
+        Text("Cabeza", "cabeza"),
+        Text("Cuello", "cuello"),
+        Text("Tórax", "torax"),
+        Text("Abdomen", "abdomen"),
+        Text("Miembros superiores", "miembros_superiores"),
+        Text("Miembros inferiores", "miembros_inferiores"),
+        Text("Genitales externos", "genitales_externos"),
+        Text("Observaciones", "observaciones"),
+        # Protocolo v1
+        Grid([("Talla (cm)", "campo_36_talla"), ("Peso (kg)", "campo_37_peso")], columns=2),
+    ]),
+    Section("IV. EXAMEN EXTERNO - CABEZA", "examen_externo_cabeza", [
+        Grid([
+            ("Presencia", "presencia", SI_NO), ("Lesiones", "lesiones", SI_NO),
+            ("Perímetro cefálico (cm)", "perimetro_cefalico"), ("Forma", "forma", FORMA_CABEZA),
+            ("Cabello", "cabello", CABELLO), ("Otro color de cabello", "otro_color_cabello"),
+        ]),
+        Text("Características", "caracteristicas"),
+    ]),
+    Section("V. EXAMEN INTERNO - CABEZA", "examen_interno_cabeza", [
+        Structure("Cuero cabelludo (cara interna)", "cuero_cabelludo_interno"),
+        Structure("Bóveda craneal", "boveda"),
+        Structure("Base de cráneo", "base_craneo"),
+        Text("Meninges (duramadre, aracnoides)", "meninges_duramadre_aracnoide"),
+        Organ("Encéfalo", "encefalo"),
+        Text("Vasos", "vasos"),
+        Group("Macizo facial", [
+            Field("Presencia", "presencia", choices=SI_NO), Field("Lesiones", "lesiones", choices=SI_NO),
+        ], "macizo_facial"),
+    ]),
+    Section("VI. EXAMEN INTERNO - CUELLO", "examen_interno_cuello", [
+        Structure("Columna cervical", "columna_cervical"),
+        Structure("Faringe", "faringe"),
+        Structure("Esófago", "esofago"),
+        Structure("Laringe", "laringe"),
+        Structure("Glotis", "glotis"),
+        Structure("Epiglotis", "epiglotis"),
+        Structure("Hioides", "hioides"),
+        Structure("Tráquea", "traquea"),
+        Organ("Tiroides", "tiroides", [
+            Grid([
+                ("Color", "color"), ("Consistencia", "consistencia"), ("Superficie", "superficie"),
+                ("Simetría", "simetria"), ("Alteraciones", "alteraciones"),
+            ]),
+        ]),
+        Text("Vasos", "vasos"),
+    ]),
+    Section("VII. EXAMEN INTERNO - TÓRAX", "examen_interno_torax", [
+        Structure("Columna dorsal y parrilla costal", "columna_dorsal_parrilla_costal"),
+        Text("Pleuras y cavidades", "pleuras_cavidades"),
+        Text("Mediastino", "mediastino"),
+        Organ("Timo", "timo"),
+        Organ("Pulmón derecho", "pulmones.derecho"),
+        Organ("Pulmón izquierdo", "pulmones.izquierdo"),
+        Text("Pulmones - características", "pulmones.caracteristicas"),
+        Text("Pulmones - descripción", "pulmones_descripcion"),
+        Structure("Pericardio", "pericardio"),
+        Organ("Corazón", "corazon", [
+            Grid([
+                ("Válvula aórtica (mm)", "valvulas.aortica_mm"),
+                ("Válvula mitral (mm)", "valvulas.mitral_mm"),
+                ("Válvula tricúspide (mm)", "valvulas.tricuspide_mm"),
+                ("Válvula pulmonar (mm)", "valvulas.pulmonar_mm"),
+            ], columns=2),
+            Text("Válvulas - características", "valvulas.caracteristicas"),
+            Grid([
+                ("Pared ventricular derecha (mm)", "paredes_ventriculares.derecha_mm"),
+                ("Pared ventricular izquierda (mm)", "paredes_ventriculares.izquierda_mm"),
+            ], columns=2),
+            Text("Paredes ventriculares - observaciones", "paredes_ventriculares.observaciones"),
+            Text("Arterias aorta y pulmonar", "arteria_aorta_pulmonar"),
+            Text("Arterias coronarias", "arterias_coronarias"),
+        ]),
+    ]),
+    Section("VIII. EXAMEN INTERNO - ABDOMEN Y PELVIS", "examen_interno_abdomen", [
+        Structure("Columna lumbosacra y pelvis", "columna_lumbosacra_pelvis"),
+        Structure("Pared peritoneal", "pared_peritoneal"),
+        Group("Cavidad peritoneal", [
+            Field("Estado", "estado", choices=ESTADO_CAVIDAD), Field("Contenido", "contenido"),
+            Field("Volumen", "volumen_cm3", "cm³", skip_zero=True),
+        ], "cavidad_peritoneal"),
+        Structure("Diafragma", "diafragma"),
+        Structure("Epiplones", "epiplones"),
+        Structure("Mesenterio", "mesenterio"),
+        Group("Estómago", [
+            Field("Presencia", "presencia", choices=SI_NO), Field("Lesiones", "lesiones", choices=SI_NO),
+            Text("Descripción", "descripcion"), Text("Contenido", "contiene"),
+        ], "estomago"),
+        Structure("Intestino delgado", "intestino_delgado"),
+        Structure("Intestino grueso", "intestino_grueso"),
+        Text("Apéndice", "apendice"),
+        Organ("Hígado", "higado"),
+        Group("Vesícula biliar", [
+            Text("Descripción", "descripcion"), Field("Litiasis", "litiasis", choices=SI_NO),
+        ], "vesicula_biliar"),
+        Organ("Bazo", "bazo"),
+        Organ("Páncreas", "pancreas"),
+        Organ("Riñón derecho", "rinones.derecho"),
+        Organ("Riñón izquierdo", "rinones.izquierdo"),
+        Text("Riñones - características", "rinones.caracteristicas"),
+        Text("Suprarrenales", "suprarrenales"),
+        Structure("Vías de excreción renal", "vias_excrecion_renal"),
+        Structure("Vasos", "vasos"),
+    ]),
+    Section("IX. APARATO GENITAL", "aparato_genital", [
+        Group("Femenino", [
+            Field("Presencia", "presencia", choices=SI_NO),
+            Organ("Útero", "utero"),
+            Group("Cavidad endometrial", [
+                Grid([
+                    ("Ocupada", "ocupada", SI_NO), ("Placenta", "placenta"), ("Feto", "feto"),
+                    ("Semanas de gestación", "semanas_gestacion"), ("Otros", "otros"),
+                ]),
+                Text("Características", "caracteristicas"),
+            ], "cavidad_endometrial"),
+            Group("Anexos", [
+                Field("Presencia", "presencia", choices=SI_NO),
+                Organ("Ovario derecho", "derecho"),
+                Organ("Ovario izquierdo", "izquierdo"),
+                Text("Características", "caracteristicas"),
+            ], "anexos"),
+        ], "femenino"),
+        Group("Masculino", [
+            Field("Presencia", "presencia", choices=SI_NO), Text("Próstata", "prostata"),
+            Field("Lesiones", "lesiones", choices=SI_NO),
+        ], "masculino"),
+    ]),
+    Section("X. LESIONES TRAUMÁTICAS", "lesiones_traumaticas", [
+        Text("Descripción", "descripcion"),
+    ]),
+    Section("XI. PERENNIZACIÓN", "perennizacion", [
+        Field("Se realizó", "se_realizo", choices=SI_NO),
+        Grid([
+            ("Fotográfico revelado", "tipo.fotografico_revelado"),
+            ("Fotográfico digital", "tipo.fotografico_digital"),
+            ("Video en cinta", "tipo.video_cinta"),
+            ("Video en disco compacto", "tipo.video_disco_compacto"),
+            ("Video en memoria digital", "tipo.video_memoria_digital"),
+        ]),
+        Field("Código de vistas", "codigo_vistas"),
+        Grid([
+            ("Responsable", "responsable.nombre"),
+            ("Apellido paterno", "responsable.apellido_paterno"),
+            ("Apellido materno", "responsable.apellido_materno"),
+        ]),
+        Field("Registro en cuadernillo", "registro_cuadernillo", choices=SI_NO),
+        Text("Detalle del registro", "detalle_registro"),
+        Text("Observaciones", "observaciones"),
+    ]),
+    Section("XII. DATOS REFERENCIALES", "datos_referenciales", [
+        Text("Datos referenciales", "datos_referenciales"),
+        Field("Tipo de situación del cadáver", "tipo_situacion_cadaver", choices=SITUACION_CADAVER),
+        Field("Donación de órganos y tejidos", "donacion_organos_tejidos", choices=SI_NO),
+        Text("Detalle de la donación", "detalle_donacion"),
+        Field("Donado a institución educativa", "donado_institucion_educativa"),
+        Field("Institución", "institucion"),
+    ]),
+    Section("XIII. CAUSA(S) DE MUERTE", "causas_muerte", [
+        Text("Datos preliminares", "datos_preliminares"),
+        Diagnosis("Diagnóstico presuntivo", "diagnostico_presuntivo"),
+        Field("Fecha de cierre (presuntivo)", "fecha_cierre_presuntivo"),
+        Diagnosis("Diagnóstico integrado", "diagnostico_integrado"),
+        Field("Fecha de cierre (integrado)", "fecha_cierre_integrado"),
+        Text("Conclusiones", "conclusiones"),
+    ]),
+    Section("XIV. ÓRGANOS ADICIONALES", "organos_adicionales", [
+        Grid([("Placenta", "placenta"), ("Cordón umbilical", "cordon_umbilical")], columns=2),
+        Text("Características", "caracteristicas"),
+    ]),
+    # Protocolo v1 (casos creados antes de v2.0)
+    Section("DATOS ADMINISTRATIVOS", "datos_administrativos", [
+        Grid([
+            ("Nombre", "nombre_fallecido"), ("Edad", "edad"), ("Sexo", "sexo"),
+            ("Fecha", "fecha_necropsia"),
+        ]),
+    ]),
+    Section("EXAMEN INTERNO", "examen_interno", [
+        Field("Pulmón Derecho", "campo_60_pulmon_derecho"),
+        Field("Peso pulmón derecho", "peso_pulmon_derecho", "g"),
+        Field("Pulmón Izquierdo", "campo_61_pulmon_izquierdo"),
+        Field("Peso pulmón izquierdo", "peso_pulmon_izquierdo", "g"),
+        Field("Corazón", "campo_63_corazon"),
+        Field("Peso corazón", "peso_corazon", "g"),
+        Field("Hígado", "campo_72_higado"),
+        Field("Peso hígado", "peso_higado", "g"),
+    ]),
+    Section("CONCLUSIONES", "conclusiones", [
+        Field("Causa de Muerte", "causa_final"),
+        Field("Causa básica", "causa_basica"),
+        Field("Código CIE-10", "codigo_cie10"),
+    ]),
+]
+
+# Secciones (columnas del caso) que usa la plantilla
+TEMPLATE_SECTIONS = [section.key for section in PROTOCOL_LAYOUT]
+
+
+# ============================================
+# COMPILACIÓN
+# ============================================
+
+_DOCUMENT_HEAD = """<!DOCTYPE html>
+<html lang="es">
+<head><meta charset="UTF-8"></head>
+<body>
+<div class="header">
+<h1>MINISTERIO PÚBLICO</h1>
+<h2>INSTITUTO DE MEDICINA LEGAL Y CIENCIAS FORENSES</h2>
+<h1>PROTOCOLO DE NECROPSIA Nº """
+
+_DOCUMENT_TAIL = """<div class="signature"><div>Firma del Médico Legista</div></div>
+</body>
+</html>"""
+
+_protocol_number = [
+    _getter("datos_generales.numero_informe"),
+    _getter("datos_administrativos.protocolo_numero"),
+]
+
+
+def compile_protocol(layout: Sequence[Section]) -> Callable[[Dict[str, Any]], str]:
+    """Compila la plantilla en una función case_data -> HTML."""
+    sections = [section.compile() for section in layout]
+
+    def render(case_data: Dict[str, Any]) -> str:
+        number = next((n for n in (_format(get(case_data)) for get in _protocol_number) if n), "")
+        parts = [_DOCUMENT_HEAD, number, "</h1>\n</div>\n"]
+        parts.extend(section(case_data) for section in sections)
+        parts.append(_DOCUMENT_TAIL)
+        return "".join(parts)
+
+    return render
+
+
+# Compilada una vez al importar
+render_protocol = compile_protocol(PROTOCOL_LAYOUT)
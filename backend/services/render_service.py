@@ -0,0 +1,276 @@
+"""
+Servicio de render de PDF en un pool de procesos.
+
+WeasyPrint es CPU-bound (segundos por protocolo): en el event loop congela
+el servidor para todos. Aquí cada render corre en un proceso aparte (varios
+núcleos en paralelo) y se sigue como un trabajo con estado. La cola es
+acotada: con RENDER_MAX_PENDING trabajos sin terminar se rechazan nuevos.
+
+El estado de cada trabajo se guarda además como JSON en un directorio
+compartido (exports/render_jobs): con varios workers de uvicorn, la
+consulta del estado o la descarga puede llegar a un worker distinto del
+que lo encoló.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional
+from uuid import uuid4
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Demasiados trabajos de render pendientes."""
+
+
+# ============================================
+# LADO DEL PROCESO DE TRABAJO
+# ============================================
+
+# Por proceso: hoja de estilos parseada y configuración de fuentes, reutilizadas
+# en todos los renders (WeasyPrint no re-parsea el CSS ni re-resuelve fuentes)
+_stylesheet = None
+_font_config = None
+
+
+def _init_worker():
+    """Prepara WeasyPrint una vez por proceso."""
+    global _stylesheet, _font_config
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+    from services.protocol_template import STYLESHEET
+
+    _font_config = FontConfiguration()
+    _stylesheet = CSS(string=STYLESHEET, font_config=_font_config)
+
+
+def _layout(html: str):
+    """Maqueta el HTML con la hoja de estilos del proceso (weasyprint Document)."""
+    from weasyprint import HTML
+
+    if _stylesheet is None:
+        _init_worker()
+    return HTML(string=html).render(stylesheets=[_stylesheet], font_config=_font_config)
+
+
+def _render_pdf(html: str, pdf_path: str) -> int:
+    """Renderiza HTML a PDF. Escribe a un temporal y renombra (atómico)."""
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    try:
+        _layout(html).write_pdf(tmp_path)
+        os.replace(tmp_path, pdf_path)
+    except BaseException:
+        # PDF a medio escribir: no dejarlo en el directorio de la caché
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return os.path.getsize(pdf_path)
+
+
+# ============================================
+# LADO DEL SERVIDOR
+# ============================================
+
+@dataclass
+class RenderJob:
+    id: str
+    case_id: str
+    path: Path
+    status: str = "pending"  # pending | done | error
+    error: Optional[str] = None
+    size: Optional[int] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "case_id": self.case_id,
+            "status": self.status,
+            "error": self.error,
+            "size": self.size,
+            "render_ms": round((self.finished_at - self.created_at) * 1000) if self.finished_at else None,
+        }
+
+    def to_state(self) -> Dict:
+        return {
+            "id": self.id, "case_id": self.case_id, "path": str(self.path),
+            "status": self.status, "error": self.error, "size": self.size,
+            "created_at": self.created_at, "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "RenderJob":
+        return cls(**{**state, "path": Path(state["path"])})
+
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class RenderService:
+    """Cola acotada de trabajos de render sobre un ProcessPoolExecutor."""
+
+    def __init__(self, workers: int, max_pending: int, job_ttl: int, state_dir: Optional[Path] = None):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.job_ttl = job_ttl
+        self.state_dir = Path(state_dir) if state_dir else None  # None = solo en memoria
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, RenderJob] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "pending")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: el servidor tiene hilos (aiosqlite), fork no es seguro
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            logger.info(f"Pool de render iniciado: {self.workers} procesos")
+        return self._executor
+
+    def _prune(self):
+        """Olvida trabajos terminados hace más de RENDER_JOB_TTL_SECONDS."""
+        cutoff = time.time() - self.job_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+        # Estados compartidos vencidos (de este o de otros workers)
+        if self.state_dir is not None and self.state_dir.is_dir():
+            for entry in os.scandir(self.state_dir):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def _save(self, job: RenderJob):
+        """Publica el estado del trabajo para los demás workers (escritura atómica)."""
+        if self.state_dir is None:
+            return
+        try:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            path = self.state_dir / f"{job.id}.json"
+            tmp = path.with_name(f"{job.id}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(job.to_state()))
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el estado del trabajo {job.id}: {e}")
+
+    def _load(self, job_id: str) -> Optional[RenderJob]:
+        """Trabajo encolado por otro worker, o None."""
+        if self.state_dir is None or not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            state = json.loads((self.state_dir / f"{job_id}.json").read_text())
+        except (OSError, ValueError):
+            return None
+        job = RenderJob.from_state(state)
+        if job.finished_at and job.finished_at < time.time() - self.job_ttl:
+            return None
+        return job
+
+    def submit(
+        self,
+        case_id: str,
+        html: str,
+        pdf_path: Path,
+        on_done: Optional[Callable[[RenderJob], Awaitable[None]]] = None,
+    ) -> RenderJob:
+        """Encola un render. Lanza RenderQueueFull si la cola está llena."""
+        self._prune()
+        if self.pending >= self.max_pending:
+            raise RenderQueueFull()
+
+        job = RenderJob(id=uuid4().hex, case_id=case_id, path=pdf_path, created_at=time.time())
+        self._jobs[job.id] = job
+        self._save(job)
+        job.task = asyncio.create_task(self._execute(job, html, on_done))
+        return job
+
+    async def _execute(self, job: RenderJob, html: str, on_done):
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        try:
+            job.size = await loop.run_in_executor(executor, _render_pdf, html, str(job.path))
+            job.status = "done"
+        except BrokenProcessPool as e:
+            # Un proceso murió (p. ej. sin memoria): recrear el pool en el próximo render
+            if self._executor is executor:
+                logger.error(f"Pool de render roto, se reiniciará: {e}")
+                self.shutdown()
+            # El proceso muerto no llegó a borrar su temporal
+            for tmp in job.path.parent.glob(f"{job.path.name}.*.tmp"):
+                tmp.unlink(missing_ok=True)
+            job.status = "error"
+            job.error = str(e)
+        except Exception as e:
+            logger.error(f"Error renderizando PDF del caso {job.case_id}: {e}")
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+        if job.status == "done" and on_done:
+            try:
+                await on_done(job)
+            except Exception as e:
+                logger.error(f"Error post-render del caso {job.case_id}: {e}")
+        self._save(job)
+
+    def completed(self, case_id: str, pdf_path: Path) -> RenderJob:
+        """Registra como terminado un PDF que no necesita render (caché)."""
+        self._prune()
+        now = time.time()
+        job = RenderJob(
+            id=uuid4().hex, case_id=case_id, path=pdf_path, status="done",
+            size=pdf_path.stat().st_size, created_at=now, finished_at=now
+        )
+        self._jobs[job.id] = job
+        self._save(job)
+        return job
+
+    async def wait(self, job: RenderJob) -> RenderJob:
+        """Espera a que termine un trabajo (render + post-proceso)."""
+        if job.task is not None:
+            await asyncio.shield(job.task)
+        return job
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        """Trabajo de este worker o, si no, el estado publicado por otro."""
+        return self._jobs.get(job_id) or self._load(job_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Singleton
+render_service = RenderService(
+    settings.RENDER_WORKERS, settings.RENDER_MAX_PENDING, settings.RENDER_JOB_TTL_SECONDS,
+    state_dir=Path(settings.CORONERIA_EXPORTS) / "render_jobs",
+)
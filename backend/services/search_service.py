@@ -0,0 +1,84 @@
+"""
+Servicio de búsqueda de texto completo sobre casos.
+Consulta la tabla FTS5 cases_fts (transcripción + texto del protocolo).
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+# Columnas buscables (case_id es UNINDEXED: solo identifica el caso)
+SEARCH_COLUMNS = "{protocol_number transcript hallazgos}"
+
+# Pesos bm25 por columna: case_id, protocol_number, transcript, hallazgos
+BM25_WEIGHTS = "0.0, 4.0, 2.0, 1.0"
+
+MAX_TERMS = 16
+
+
+class SearchService:
+    """Búsqueda full-text con ranking bm25 y snippets resaltados."""
+
+    def build_match(self, text: str) -> Optional[str]:
+        """
+        Convierte texto libre del usuario en una expresión MATCH segura.
+        Cada término va entre comillas (sin operadores FTS del usuario) y el
+        último término se busca por prefijo para búsqueda mientras se escribe.
+        """
+        terms = re.findall(r'\w+', text)[:MAX_TERMS]
+        if not terms:
+            return None
+
+        quoted = [f'"{t}"' for t in terms]
+        quoted[-1] += "*"
+        return f"{SEARCH_COLUMNS} : ({' '.join(quoted)})"
+
+    async def search(
+        self,
+        db: aiosqlite.Connection,
+        text: str,
+        limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """Busca casos por texto. Retorna resultados ordenados por relevancia."""
+
+        match = self.build_match(text)
+        if not match:
+            return []
+
+        # Top-k directamente sobre FTS: con bm25() explícito (no la columna
+        # rank) y sin subconsultas, SQLite solo calcula snippet() para las
+        # filas que sobreviven al LIMIT.
+        cursor = await db.execute(
+            f"""SELECT case_id, bm25(cases_fts, {BM25_WEIGHTS}) AS score,
+                      snippet(cases_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet
+               FROM cases_fts
+               WHERE cases_fts MATCH ?
+               ORDER BY score
+               LIMIT ?""",
+            (match, limit)
+        )
+        hits = await cursor.fetchall()
+        if not hits:
+            return []
+
+        # Metadatos de los casos encontrados (búsqueda por clave primaria)
+        placeholders = ", ".join("?" * len(hits))
+        cursor = await db.execute(
+            f"SELECT id, protocol_number, status, created_at FROM cases WHERE id IN ({placeholders})",
+            [hit[0] for hit in hits]
+        )
+        cases = {row[0]: row for row in await cursor.fetchall()}
+
+        return [
+            {
+                "id": case_id,
+                "protocol_number": cases[case_id][1],
+                "status": cases[case_id][2],
+                "created_at": cases[case_id][3],
+                "rank": score,
+                "snippet": snippet,
+            }
+            for case_id, score, snippet in hits
+            if case_id in cases
+        ]
@@ -0,0 +1,53 @@
+"""
+Coalescencia de solicitudes idénticas en curso (single flight).
+
+Un doble envío del cliente Electron o dos pestañas analizando los mismos
+hallazgos disparaban una llamada al modelo por solicitud. Con SingleFlight
+la primera solicitud de una clave lanza la llamada y las que llegan
+mientras sigue en curso esperan ese mismo resultado. La llamada corre en su
+propia tarea: si el primer cliente se desconecta, los demás no la pierden.
+"""
+
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Una llamada en curso por clave; los demás solicitantes la comparten."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.upstream = 0    # llamadas realmente lanzadas
+        self.coalesced = 0   # solicitudes atendidas con una llamada ya en curso
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Resultado de call() para key, compartido con las solicitudes simultáneas."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.upstream += 1
+            task = asyncio.create_task(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+            logger.info(f"{self.name}: solicitud idéntica en curso, se reutiliza su resultado")
+        # Copia por solicitante: los llamadores modifican el dict (mode, advertencias)
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # marcada como leída aunque todos los solicitantes se hayan ido
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "upstream_calls": self.upstream,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
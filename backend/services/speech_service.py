@@ -3,13 +3,20 @@ Servicio unificado de reconocimiento de voz.
 Soporta Azure AI Speech (cloud) y Whisper local (edge).
 """
 
-import os
+import asyncio
+import io
 import logging
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional, Union
 from enum import Enum
 
+import numpy as np
+
 from core.config import settings
+from services.audio_service import audio_service, to_int16, SAMPLE_RATE
 from services.gemini_service import GeminiService
+from services.inference_client import inference_client
+from services.model_registry import run_whisper, whisper_models
+from services.whisper_stream import WhisperStream
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +33,9 @@ class SpeechService:
     def __init__(self):
         self._mode = self._determine_mode()
         self._azure_recognizer = None
-        self._whisper_model = None
         self._gemini_service = None
         self._is_streaming = False
+        self._whisper_slots: Dict[str, asyncio.Semaphore] = {}
 
         if self._mode == "gemini":
             self._gemini_service = GeminiService()
@@ -62,8 +69,19 @@ class SpeechService:
         else:
             return await self._transcribe_whisper(audio_path)
     
-    async def _transcribe_azure(self, audio_path: str) -> str:
-        """Transcribe usando Azure AI Speech."""
+    async def transcribe_pcm(self, pcm: np.ndarray) -> str:
+        """Transcribe PCM float32 16 kHz mono (ver audio_service) sin archivos intermedios."""
+        
+        if self._mode == "azure":
+            return await self._transcribe_azure(pcm)
+        elif self._mode == "gemini":
+            wav = io.BytesIO(audio_service.to_wav_bytes(pcm))
+            return await self._gemini_service.transcribe_audio(wav, mime_type="audio/wav")
+        else:
+            return await self._transcribe_whisper(pcm)
+    
+    async def _transcribe_azure(self, audio: Union[str, np.ndarray]) -> str:
+        """Transcribe usando Azure AI Speech (ruta de archivo o PCM)."""
         try:
             import azure.cognitiveservices.speech as speechsdk
             
@@ -73,7 +91,16 @@ class SpeechService:
             )
             speech_config.speech_recognition_language = settings.CORONERIA_LANGUAGE
             
-            audio_config = speechsdk.AudioConfig(filename=audio_path)
+            if isinstance(audio, str):
+                audio_config = speechsdk.AudioConfig(filename=audio)
+            else:
+                # PCM 16-bit 16 kHz mono directo al SDK
+                stream = speechsdk.audio.PushAudioInputStream(
+                    speechsdk.audio.AudioStreamFormat(samples_per_second=SAMPLE_RATE, bits_per_sample=16, channels=1)
+                )
+                stream.write(to_int16(audio).tobytes())
+                stream.close()
+                audio_config = speechsdk.AudioConfig(stream=stream)
             recognizer = speechsdk.SpeechRecognizer(
                 speech_config=speech_config,
                 audio_config=audio_config
@@ -96,63 +123,34 @@ class SpeechService:
         except Exception as e:
             logger.error(f"Error en Azure Speech: {e}")
             # Fallback a Whisper
-            return await self._transcribe_whisper(audio_path)
+            return await self._transcribe_whisper(audio)
     
-    async def _transcribe_whisper(self, audio_path: str) -> str:
-        """Transcribe usando Whisper local."""
+    async def _transcribe_whisper(self, audio: Union[str, np.ndarray]) -> str:
+        """Transcribe usando Whisper local (ruta de archivo o PCM 16 kHz)."""
         try:
-            if self._whisper_model is None:
-                await self._load_whisper()
-            
-            segments, info = self._whisper_model.transcribe(
-                audio_path,
-                language="es",
-                initial_prompt=self._get_forensic_prompt(),
-                vad_filter=True
-            )
-            
-            return " ".join([s.text for s in segments])
+            return await self._whisper_pass(audio, 5, True)
             
         except Exception as e:
             logger.error(f"Error en Whisper: {e}")
             return ""
     
-    async def _load_whisper(self):
-        """Carga el modelo Whisper."""
-        from faster_whisper import WhisperModel
-        
-        model_path = os.path.join(settings.CORONERIA_MODELS, "whisper", "large-v3")
-        
-        # Verificar si hay GPU
-        import torch
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        compute_type = "float16" if device == "cuda" else "int8"
-        
-        logger.info(f"Cargando Whisper en {device}...")
-        
-        self._whisper_model = WhisperModel(
-            "medium",
-            device=device,
-            compute_type=compute_type,
-            download_root=os.path.join(settings.CORONERIA_MODELS, "whisper")
-        )
-        
-        logger.info("Whisper cargado correctamente")
-    
     async def start_streaming(
         self,
         on_partial: Callable,
         on_final: Callable,
         on_error: Callable
-    ):
-        """Inicia streaming de reconocimiento."""
+    ) -> Optional[WhisperStream]:
+        """
+        Inicia streaming de reconocimiento.
+        En modo local retorna la sesión de dictado que recibe el PCM del cliente.
+        """
         self._is_streaming = True
         
         if self._mode == "azure":
             await self._start_azure_streaming(on_partial, on_final, on_error)
-        else:
-            await self._start_whisper_streaming(on_partial, on_final, on_error)
-    
+            return None
+        return await self._start_whisper_streaming(on_partial, on_final, on_error)
+
     async def _start_azure_streaming(
         self,
         on_partial: Callable,
@@ -213,11 +211,44 @@ class SpeechService:
         on_partial: Callable,
         on_final: Callable,
         on_error: Callable
-    ):
-        """Streaming con Whisper local (simulado con chunks)."""
-        # Whisper no soporta streaming nativo, usamos chunks
-        # Esta es una implementación simplificada
-        await on_error("Whisper streaming no implementado aún. Use modo archivo.")
+    ) -> Optional[WhisperStream]:
+        """Streaming con Whisper local: VAD + pasadas por frase (ver whisper_stream)."""
+        try:
+            if inference_client.enabled:
+                await inference_client.status()
+            else:
+                await whisper_models.get()
+        except Exception as e:
+            logger.error(f"Error cargando Whisper para streaming: {e}")
+            await on_error(f"Whisper no disponible: {e}")
+            return None
+        
+        async def transcribe_utterance(pcm: np.ndarray, partial: bool) -> str:
+            # Parciales con beam 1: rápidos y descartables
+            return await self._whisper_pass(pcm, 1 if partial else 5)
+        
+        return WhisperStream(
+            transcribe_utterance,
+            on_partial, on_final, on_error,
+            threshold_db=settings.AUDIO_SILENCE_THRESHOLD_DB,
+            end_silence_ms=settings.WHISPER_STREAM_END_SILENCE_MS,
+            partial_interval_ms=settings.WHISPER_STREAM_PARTIAL_MS,
+            max_utterance_seconds=settings.WHISPER_STREAM_MAX_UTTERANCE_SECONDS,
+        )
+    
+    async def _whisper_pass(self, audio: Union[str, np.ndarray], beam_size: int, vad_filter: bool = False) -> str:
+        """Una pasada de Whisper: en el servidor de inferencia si está configurado, si no en proceso."""
+        if inference_client.enabled:
+            return await inference_client.transcribe(audio, beam_size, vad_filter, self._get_forensic_prompt())
+        
+        name = whisper_models.default
+        model = await whisper_models.get(name)
+        # Hasta num_workers pasadas a la vez por modelo (CPU-bound, en hilos)
+        slots = self._whisper_slots.get(name)
+        if slots is None:
+            slots = self._whisper_slots[name] = asyncio.Semaphore(whisper_models.workers(name))
+        async with slots:
+            return await asyncio.to_thread(run_whisper, model, audio, beam_size, vad_filter, self._get_forensic_prompt())
     
     async def stop_streaming(self):
         """Detiene el streaming."""
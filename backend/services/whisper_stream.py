@@ -0,0 +1,184 @@
+"""
+Dictado en vivo con Whisper local sobre el WebSocket de transcripción.
+
+El cliente envía frames binarios PCM 16-bit little-endian, 16 kHz mono. Las
+muestras se escriben en un buffer circular preasignado; un VAD de energía
+por ventanas de 30 ms detecta el inicio y el fin de cada frase. Mientras se
+habla se envían transcripciones parciales de la frase en curso (si el
+modelo está libre) y, tras WHISPER_STREAM_END_SILENCE_MS de silencio, la
+transcripción final de la frase: la latencia tras terminar de hablar es ese
+silencio más una pasada del modelo (~1 s).
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+from services.audio_service import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+# Ventanas con voz seguidas para abrir una frase (ignora clics aislados)
+START_FRAMES = 3
+# Audio previo al inicio detectado que se incluye en la frase
+PREROLL_MS = 300
+
+
+class PcmRingBuffer:
+    """Buffer circular de muestras float32 con capacidad fija."""
+
+    def __init__(self, capacity: int):
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.written = 0  # total de muestras escritas desde el inicio
+
+    def write(self, samples: np.ndarray):
+        if len(samples) > self.capacity:
+            self.written += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        start = self.written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def since(self, position: int) -> np.ndarray:
+        """Copia de las muestras escritas desde la posición absoluta dada."""
+        position = max(position, self.written - self.capacity, 0)
+        n = self.written - position
+        start = position % self.capacity
+        if start + n <= self.capacity:
+            return self._data[start:start + n].copy()
+        return np.concatenate((self._data[start:], self._data[:start + n - self.capacity]))
+
+
+class WhisperStream:
+    """
+    Sesión de dictado de una conexión. feed() no bloquea: las pasadas del
+    modelo corren en una tarea aparte, en orden, y los parciales se
+    descartan si el modelo sigue ocupado con la pasada anterior.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[np.ndarray, bool], Awaitable[str]],
+        on_partial: Callable[[str], Awaitable[None]],
+        on_final: Callable[[str], Awaitable[None]],
+        on_error: Callable[[str], Awaitable[None]],
+        threshold_db: float,
+        end_silence_ms: int,
+        partial_interval_ms: int,
+        max_utterance_seconds: float,
+    ):
+        self._transcribe = transcribe
+        self._on_partial = on_partial
+        self._on_final = on_final
+        self._on_error = on_error
+        self.threshold = 10 ** (threshold_db / 20)
+        self.end_frames = max(1, end_silence_ms // FRAME_MS)
+        self.partial_samples = SAMPLE_RATE * partial_interval_ms // 1000
+        self.max_samples = int(SAMPLE_RATE * max_utterance_seconds)
+        self.preroll = SAMPLE_RATE * PREROLL_MS // 1000
+
+        self._ring = PcmRingBuffer(self.max_samples + self.preroll + FRAME_SAMPLES)
+        self._pending = b""
+        self._vad_position = 0      # próxima muestra a evaluar por el VAD
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._start: Optional[int] = None   # inicio de la frase en curso
+        self._utterance = 0                 # número de la frase en curso
+        self._last_partial = 0
+        self._last_voice_at = 0.0
+
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._partial_queued = False
+        self._worker = asyncio.create_task(self._run())
+        self.final_latencies_ms: List[float] = []
+        self.partials = 0
+
+    async def feed(self, data: bytes):
+        """Agrega PCM s16le; evalúa el VAD sobre las ventanas completas."""
+        data = self._pending + data
+        usable = len(data) - len(data) % 2
+        self._pending = data[usable:]
+        if not usable:
+            return
+        self._ring.write(np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768)
+
+        while self._ring.written - self._vad_position >= FRAME_SAMPLES:
+            frame = self._ring.since(self._vad_position)[:FRAME_SAMPLES]
+            self._vad_position += FRAME_SAMPLES
+            self._step(float(np.sqrt(np.dot(frame, frame) / FRAME_SAMPLES)) >= self.threshold)
+
+    def _step(self, voiced: bool):
+        if voiced:
+            self._voiced_run += 1
+            self._silent_run = 0
+            self._last_voice_at = time.perf_counter()
+        else:
+            self._voiced_run = 0
+            self._silent_run += 1
+
+        if self._start is None:
+            if self._voiced_run >= START_FRAMES:
+                self._start = max(0, self._vad_position - START_FRAMES * FRAME_SAMPLES - self.preroll)
+                self._utterance += 1
+                self._last_partial = self._vad_position
+            return
+
+        length = self._vad_position - self._start
+        if self._silent_run >= self.end_frames or length >= self.max_samples:
+            self._finish()
+        elif self._vad_position - self._last_partial >= self.partial_samples and not self._partial_queued:
+            self._last_partial = self._vad_position
+            self._partial_queued = True
+            self._queue.put_nowait(("partial", self._ring.since(self._start), self._utterance))
+
+    def _finish(self):
+        """Cierra la frase en curso y encola su transcripción final."""
+        if self._start is None:
+            return
+        audio = self._ring.since(self._start)[:self._vad_position - self._start]
+        self._queue.put_nowait(("final", audio, self._last_voice_at))
+        self._start = None
+        self._voiced_run = 0
+
+    async def _run(self):
+        while True:
+            kind, audio, tag = await self._queue.get()
+            try:
+                if kind == "partial":
+                    self._partial_queued = False
+                    if self._start is None or tag != self._utterance:
+                        continue  # la frase ya se cerró: viene su final
+                    text = (await self._transcribe(audio, True)).strip()
+                    if text:
+                        self.partials += 1
+                        await self._on_partial(text)
+                else:
+                    text = (await self._transcribe(audio, False)).strip()
+                    # tag: instante de la última ventana con voz de la frase
+                    self.final_latencies_ms.append((time.perf_counter() - tag) * 1000)
+                    if text:
+                        await self._on_final(text)
+            except Exception as e:
+                logger.error(f"Error en dictado Whisper: {e}")
+                try:
+                    await self._on_error(f"Error en transcripción: {e}")
+                except Exception:
+                    pass  # conexión cerrada: el worker sigue para que close() no se cuelgue
+            finally:
+                self._queue.task_done()
+
+    async def close(self, flush: bool = True):
+        """Termina la sesión; con flush transcribe la frase pendiente antes de cerrar."""
+        if flush:
+            self._finish()
+            await self._queue.join()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
@@ -1,5 +1,6 @@
 import { create } from 'zustand'
 import type { ProtocoloNecropsia } from '../types/protocol'
+import { useAuthStore } from './authStore'
 
 // ============================================
 // INTERFACES
@@ -17,6 +18,10 @@ interface CaseListItem {
 interface CaseState {
     cases: CaseListItem[]
     currentCase: Partial<ProtocoloNecropsia> | null
+    // ETag de la versión cargada (If-Match al guardar)
+    etag: string | null
+    // Cambios pendientes en formato JSON Merge Patch (RFC 7396)
+    pendingPatch: Record<string, any>
     isLoading: boolean
     error: string | null
 
@@ -29,25 +34,11 @@ interface CaseState {
     clearCase: () => void
 }
 
-// ============================================
-// SECCIONES DEL PROTOCOLO
-// ============================================
-
-const PROTOCOL_SECTIONS = [
-    'datos_generales',
-    'fenomenos_cadavericos',
-    'examen_externo_cabeza',
-    'examen_interno_cabeza',
-    'examen_interno_cuello',
-    'examen_interno_torax',
-    'examen_interno_abdomen',
-    'aparato_genital',
-    'lesiones_traumaticas',
-    'perennizacion',
-    'datos_referenciales',
-    'causas_muerte',
-    'organos_adicionales',
-] as const
+// Token de sesión para que la auditoría registre al usuario
+function authHeaders(): Record<string, string> {
+    const token = useAuthStore.getState().token
+    return token ? { Authorization: `Bearer ${token}` } : {}
+}
 
 // ============================================
 // STORE
@@ -56,6 +47,8 @@ const PROTOCOL_SECTIONS = [
 export const useCaseStore = create<CaseState>((set, get) => ({
     cases: [],
     currentCase: null,
+    etag: null,
+    pendingPatch: {},
     isLoading: false,
     error: null,
 
@@ -64,7 +57,7 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         try {
             const response = await fetch('/api/cases')
             const data = await response.json()
-            set({ cases: data, isLoading: false })
+            set({ cases: data.items, isLoading: false })
         } catch (error) {
             set({ error: 'Error cargando casos', isLoading: false })
         }
@@ -74,7 +67,7 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         try {
             const response = await fetch('/api/cases', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', ...authHeaders() },
                 body: JSON.stringify({}),
             })
             const data = await response.json()
@@ -94,7 +87,12 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         try {
             const response = await fetch(`/api/cases/${caseId}`)
             const data = await response.json()
-            set({ currentCase: data, isLoading: false })
+            set({
+                currentCase: data,
+                etag: response.headers.get('ETag'),
+                pendingPatch: {},
+                isLoading: false,
+            })
         } catch (error) {
             set({ error: 'Error cargando caso', isLoading: false })
         }
@@ -105,6 +103,7 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         if (!current) return
 
         const sectionData = (current[section] as Record<string, any>) || {}
+        const pending = get().pendingPatch
 
         set({
             currentCase: {
@@ -114,6 +113,13 @@ export const useCaseStore = create<CaseState>((set, get) => ({
                     [field]: value,
                 },
             },
+            pendingPatch: {
+                ...pending,
+                [section]: {
+                    ...(pending[section] || {}),
+                    [field]: value,
+                },
+            },
         })
     },
 
@@ -136,11 +142,23 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         // Establecer el valor
         target[path[path.length - 1]] = value
 
+        // Registrar solo la ruta modificada en el patch pendiente
+        const pending = JSON.parse(JSON.stringify(get().pendingPatch))
+        let patchTarget = pending[section] = pending[section] || {}
+        for (let i = 0; i < path.length - 1; i++) {
+            if (typeof patchTarget[path[i]] !== 'object' || patchTarget[path[i]] === null) {
+                patchTarget[path[i]] = {}
+            }
+            patchTarget = patchTarget[path[i]]
+        }
+        patchTarget[path[path.length - 1]] = value
+
         set({
             currentCase: {
                 ...current,
                 [section]: sectionData,
             },
+            pendingPatch: pending,
         })
     },
 
@@ -148,20 +166,36 @@ export const useCaseStore = create<CaseState>((set, get) => ({
         const current = get().currentCase
         if (!current || !current.id) return
 
-        try {
-            // Construir objeto con todas las secciones
-            const payload: Record<string, any> = {}
+        const patch = get().pendingPatch
+        if (Object.keys(patch).length === 0) return
 
-            for (const section of PROTOCOL_SECTIONS) {
-                if (current[section]) {
-                    payload[section] = current[section]
-                }
+        try {
+            // Enviar solo los cambios (merge patch) condicionados a la versión cargada
+            const headers: Record<string, string> = {
+                'Content-Type': 'application/merge-patch+json',
+                ...authHeaders(),
             }
+            const etag = get().etag
+            if (etag) headers['If-Match'] = etag
 
-            await fetch(`/api/cases/${current.id}`, {
+            const response = await fetch(`/api/cases/${current.id}`, {
                 method: 'PATCH',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload),
+                headers,
+                body: JSON.stringify(patch),
+            })
+
+            if (response.status === 412) {
+                set({ error: 'El caso fue modificado en otra pestaña. Recargue antes de guardar.' })
+                return
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`)
+            }
+
+            // Si hubo ediciones durante el guardado, se conservan para el próximo
+            set({
+                etag: response.headers.get('ETag'),
+                pendingPatch: get().pendingPatch === patch ? {} : get().pendingPatch,
             })
         } catch (error) {
             set({ error: 'Error guardando caso' })
@@ -169,6 +203,6 @@ export const useCaseStore = create<CaseState>((set, get) => ({
     },
 
     clearCase: () => {
-        set({ currentCase: null })
+        set({ currentCase: null, etag: null, pendingPatch: {} })
     },
 }))
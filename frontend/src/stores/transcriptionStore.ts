@@ -1,4 +1,6 @@
 import { create } from 'zustand'
+import { useAuthStore } from './authStore'
+import { useCaseStore } from './caseStore'
 
 interface TranscriptionState {
     transcript: string
@@ -78,8 +80,16 @@ export const useTranscriptionStore = create<TranscriptionState>((set, get) => ({
                     const controller = new AbortController()
                     const timeoutId = setTimeout(() => controller.abort(), 120000) // 2 min timeout
 
-                    const response = await fetch('/api/transcription/transcribe', {
+                    // Con un caso abierto, la grabación queda vinculada a él como evidencia
+                    const caseId = useCaseStore.getState().currentCase?.id
+                    const url = caseId
+                        ? `/api/transcription/transcribe?case_id=${encodeURIComponent(caseId)}`
+                        : '/api/transcription/transcribe'
+                    const token = useAuthStore.getState().token
+
+                    const response = await fetch(url, {
                         method: 'POST',
+                        headers: token ? { Authorization: `Bearer ${token}` } : {},
                         body: formData,
                         signal: controller.signal
                     })